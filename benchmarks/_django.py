@@ -0,0 +1,25 @@
+"""
+Bootstrap helpers so the benchmark scripts can be run directly with
+``python benchmarks/<script>.py`` from the repository root.
+"""
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def setup(sqlite_path=None):
+    """
+    Configure Django. With ``sqlite_path`` the default database is replaced
+    by that SQLite file, so benchmarks that seed data never touch the
+    configured database.
+    """
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mmony_chronicles.settings')
+    import django
+    from django.conf import settings
+    if sqlite_path is not None:
+        settings.DATABASES = {'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': sqlite_path}}
+    django.setup()
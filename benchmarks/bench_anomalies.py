@@ -0,0 +1,141 @@
+"""
+Measure anomaly detection on a large account.
+
+Generates ``--rows`` synthetic ledger rows in memory (signed amounts, kind
+labels and UTC timestamps, with a sprinkling of outliers) and times the
+former pandas implementation of ``AnalysisView.get_anomalies`` against the
+vectorised engine in ``transactions/utils/anomalies.py``, checking both
+report the same records. No database is needed.
+
+    python benchmarks/bench_anomalies.py [--rows 1000000] [--repeat 3]
+"""
+
+import argparse
+import math
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from transactions.utils.anomalies import detect_anomalies  # noqa: E402
+
+LABELS = [
+    'Incoming Money', 'Payment to Code Holder', 'Transfer to Mobile', 'Bank Deposit', 'Airtime Bill Payment',
+    'Cash Power Bill Payment', 'Third Party Transaction', 'Withdrawal from Agent', 'Bank Transfer',
+]
+
+
+def generate_columns(rows, seed=0):
+    rng = np.random.default_rng(seed)
+    kinds = rng.integers(0, len(LABELS), rows)
+    amounts = rng.integers(1, 500, rows) * 100.0
+    # One transaction in a thousand is ten to fifty times larger
+    outliers = rng.random(rows) < 0.001
+    amounts[outliers] *= rng.integers(10, 50, outliers.sum())
+    # Only incoming money and bank deposits are credits
+    amounts[(kinds != 0) & (kinds != 3)] *= -1
+    seconds = np.cumsum(rng.integers(5, 300, rows)).tolist()
+    start = datetime(2020, 1, 1, tzinfo=timezone.utc)
+    date_times = [start + timedelta(seconds=s) for s in seconds]
+    types = [LABELS[k] for k in kinds.tolist()]
+    return date_times, amounts.tolist(), types, list(range(1, rows + 1))
+
+
+def legacy_anomalies(date_times, amounts, types, ids):
+    # The original implementation: a dict per row, per-type statistics
+    # through iterrows and the frame filtered again for every type
+    all_transactions_list = [
+        {'date_time': d, 'amount': a, 'type': t, 'id': i, 'description': '', 'sender': '', 'recipient': ''}
+        for d, a, t, i in zip(date_times, amounts, types, ids)
+    ]
+    df = pd.DataFrame(all_transactions_list)
+    if df.empty:
+        return []
+    overall_mean = df['amount'].mean()
+    overall_std = df['amount'].std()
+    overall_threshold = overall_mean + 3 * overall_std
+    type_stats = df.groupby('type')['amount'].agg(['mean', 'std', 'count']).reset_index()
+    type_stats['threshold'] = type_stats['mean'] + 3 * type_stats['std']
+    type_stats_dict = {row['type']: row for _, row in type_stats.iterrows()}
+    anomalies = []
+    high_amount_anomalies = df[df['amount'] > overall_threshold].copy()
+    if not high_amount_anomalies.empty:
+        high_amount_anomalies['anomaly_type'] = 'High Amount'
+        high_amount_anomalies['threshold'] = overall_threshold
+        high_amount_anomalies['deviation_percent'] = ((high_amount_anomalies['amount'] - overall_threshold) / overall_threshold * 100).round(2)
+        high_amount_anomalies['overall_mean'] = overall_mean
+        high_amount_anomalies['times_above_mean'] = (high_amount_anomalies['amount'] / overall_mean).round(2)
+        anomalies.append(high_amount_anomalies)
+    for tx_type, stats in type_stats_dict.items():
+        if pd.isna(stats['threshold']):
+            continue
+        type_anomalies = df[(df['type'] == tx_type) & (df['amount'] > stats['threshold'])].copy()
+        if not type_anomalies.empty:
+            type_anomalies['anomaly_type'] = f'High Amount for {tx_type}'
+            type_anomalies['threshold'] = stats['threshold']
+            type_anomalies['type_mean'] = stats['mean']
+            type_anomalies['deviation_percent'] = ((type_anomalies['amount'] - stats['threshold']) / stats['threshold'] * 100).round(2)
+            type_anomalies['times_above_type_mean'] = (type_anomalies['amount'] / stats['mean']).round(2)
+            anomalies.append(type_anomalies)
+    df['hour'] = pd.to_datetime(df['date_time']).dt.hour
+    night_transactions = df[(df['hour'] >= 22) | (df['hour'] <= 5)].copy()
+    if not night_transactions.empty:
+        night_transactions['anomaly_type'] = 'Unusual Time (Late Night/Early Morning)'
+        night_transactions['unusual_hour'] = night_transactions['hour']
+        anomalies.append(night_transactions)
+    if anomalies:
+        return pd.concat(anomalies).drop_duplicates(subset=['id', 'type', 'amount', 'date_time']).to_dict('records')
+    return []
+
+
+def engine_anomalies(date_times, amounts, types, ids):
+    hours = np.fromiter((d.hour for d in date_times), dtype=np.int64, count=len(date_times))
+    return detect_anomalies(date_times, np.asarray(amounts), types, ids, hours)
+
+
+def same_value(a, b):
+    if isinstance(a, float) and isinstance(b, float):
+        return (math.isnan(a) and math.isnan(b)) or math.isclose(a, b, rel_tol=1e-9, abs_tol=0.011)
+    return a == b
+
+
+def same_records(legacy, current):
+    return len(legacy) == len(current) and all(
+        list(a) == list(b) and all(same_value(a[key], b[key]) for key in a)
+        for a, b in zip(legacy, current)
+    )
+
+
+def best_time(func, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    columns = generate_columns(args.rows)
+    before, legacy = best_time(lambda: legacy_anomalies(*columns), args.repeat)
+    after, current = best_time(lambda: engine_anomalies(*columns), args.repeat)
+    assert same_records(legacy, current), "anomaly records differ"
+
+    print(f"{args.rows:,} transactions, {len(current):,} anomalies")
+    print(f"{'':<24} {'before':>9} {'after':>9} {'speedup':>8}")
+    print(f"{'anomaly detection (s)':<24} {before:>9.3f} {after:>9.3f} {before / after:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
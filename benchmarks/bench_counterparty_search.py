@@ -0,0 +1,85 @@
+"""
+Measure receiver history searches by counterparty name or number.
+
+Seeds a SQLite database with ``--rows`` transactions for one user sent to
+``--counterparties`` distinct recipients (cached in ``benchmarks/.data/``)
+and times the first page of the receiver history filtered by each search
+term, with the former ``icontains`` filters on the transaction tables
+against the filters through the counterparty trigram index.
+
+    python benchmarks/bench_counterparty_search.py [--rows 500000] [--counterparties 20000] [--repeat 3]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.seed import seeded_database  # noqa: E402
+
+
+def best_time(func, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def legacy_filters(user, text):
+    # The receiver filter as it was: LIKE scans of the transaction tables
+    from django.db.models import Q
+
+    basic = Q(recipient__icontains=text)
+    return [basic, basic | Q(recipient_number__icontains=text), basic]
+
+
+def indexed_filters(user, text):
+    # As built by the receiver history view
+    from django.db.models import Q
+
+    from transactions.utils import counterparties
+
+    basic = Q(counterparty__in=counterparties.search(user, text, ['name']))
+    return [basic, Q(counterparty__in=counterparties.search(user, text, ['name', 'number'])), basic]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=500_000)
+    parser.add_argument('--counterparties', type=int, default=20_000)
+    parser.add_argument('--page-size', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    user = seeded_database(args.rows, counterparties=args.counterparties)
+    from transactions.models import Counterparty
+    from transactions.utils import counterparties
+    from transactions.utils.receiver_history import fetch_page
+
+    # A full name, a surname fragment, a common syllable run and part of a
+    # phone number: from a handful of matching counterparties to thousands
+    names = list(Counterparty.objects.filter(user=user).exclude(number='').values_list('name', 'number')[:1])
+    name, number = names[0]
+    terms = [name, name.split()[1][:5].lower(), 'kamu', number[-5:]]
+
+    print(f"{args.rows:,} transactions, {Counterparty.objects.filter(user=user).count():,} counterparties")
+    print(f"{'search':<20} {'matched':>8} {'icontains':>11} {'trigram':>10} {'speedup':>8}")
+    for term in terms:
+        legacy_time, (legacy, _) = best_time(
+            lambda: fetch_page(user, legacy_filters(user, term), page_size=args.page_size), args.repeat
+        )
+        indexed_time, (indexed, _) = best_time(
+            lambda: fetch_page(user, indexed_filters(user, term), page_size=args.page_size), args.repeat
+        )
+        assert indexed == legacy, f"results differ for {term!r}"
+        matched = counterparties.search(user, term).count()
+        print(f"{term!r:<20} {matched:>8} {legacy_time:>10.4f}s {indexed_time:>9.4f}s {legacy_time / indexed_time:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+Measure dashboard latency on a large account.
+
+Seeds a SQLite database with ``--rows`` transactions for one user (cached in
+``benchmarks/.data/``), then times the daily (day, type) aggregation and the
+full ``DashboardView`` render, before (rows summed in Python) and after
+(read from the daily rollups).
+
+    python benchmarks/bench_dashboard.py [--rows 1000000] [--repeat 3]
+"""
+
+import argparse
+import os
+import sys
+import time
+from collections import defaultdict
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.seed import seeded_database  # noqa: E402
+
+
+def legacy_daily_transactions(view):
+    # The original implementation: every row of the nine models is loaded
+    # and summed in Python
+    from django.db.models import CharField, F, Value
+    from django.db.models.functions import TruncDay
+
+    from transactions.utils.ledger import LEDGER_SOURCES
+
+    aggregated = defaultdict(lambda: {'total_amount': 0, 'transaction_count': 0})
+    for kind, source in LEDGER_SOURCES.items():
+        rows = source.model.objects.filter(user=view.request.user).annotate(
+            day=TruncDay('date_time'),
+            type=Value(kind, output_field=CharField()),
+            amount_val=F('amount'),
+        ).values('day', 'type', 'amount_val')
+        for row in list(rows):
+            key = (row['day'], row['type'])
+            aggregated[key]['total_amount'] += float(row['amount_val'])
+            aggregated[key]['transaction_count'] += 1
+    daily = [{'day': day, 'type': kind, **data} for (day, kind), data in aggregated.items()]
+    daily.sort(key=lambda x: (x['day'], x['type']))
+    return daily
+
+
+def best_time(func, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    user = seeded_database(args.rows)
+    from django.test import RequestFactory
+
+    from transactions.views import DashboardView
+
+    request = RequestFactory().get('/dashboard/')
+    request.user = user
+    view = DashboardView()
+    view.setup(request)
+
+    def render():
+        return DashboardView.as_view()(request).render()
+
+    before, legacy = best_time(lambda: legacy_daily_transactions(view), args.repeat)
+    after, current = best_time(view.get_daily_transactions, args.repeat)
+    assert len(legacy) == len(current) and all(
+        a['day'] == b['day'] and a['type'] == b['type'] and a['transaction_count'] == b['transaction_count']
+        and abs(a['total_amount'] - b['total_amount']) < 0.01
+        for a, b in zip(legacy, current)
+    ), "aggregations differ"
+
+    with mock.patch.object(DashboardView, 'get_daily_transactions', legacy_daily_transactions):
+        render_before, _ = best_time(render, args.repeat)
+    render_after, _ = best_time(render, args.repeat)
+
+    print(f"{args.rows:,} transactions, {len(current):,} (day, type) rows")
+    print(f"{'':<24} {'before':>9} {'after':>9} {'speedup':>8}")
+    print(f"{'daily aggregation (s)':<24} {before:>9.3f} {after:>9.3f} {before / after:>7.1f}x")
+    print(f"{'dashboard render (s)':<24} {render_before:>9.3f} {render_after:>9.3f} {render_before / render_after:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
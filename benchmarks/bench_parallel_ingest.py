@@ -0,0 +1,50 @@
+"""
+Measure how the parse stage of ingestion scales with worker processes.
+
+Times XML parsing plus SMS classification for the single-process path
+(``iter_sms`` + ``parse_sms``) and for ``parse_xml_parallel`` with an
+increasing number of workers. Database writes stay in the parent process and
+are not included.
+
+    python benchmarks/bench_parallel_ingest.py [--messages 1000000] [--workers 1 2 4 8 16]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import _django  # noqa: E402
+from benchmarks.synthetic import cached_backup  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=1_000_000)
+    parser.add_argument('--workers', nargs='+', type=int, default=[1, 2, 4, 8, 16])
+    parser.add_argument('--chunk-bytes', type=int, default=1 << 20)
+    args = parser.parse_args()
+
+    _django.setup()
+    from transactions.utils.parallel_ingest import parse_xml_parallel
+    from transactions.utils.process_data import iter_sms, parse_sms_elements
+
+    path = cached_backup(args.messages)
+    baseline = None
+    print(f"{'workers':>8} {'seconds':>9} {'messages/s':>12} {'speedup':>8}")
+    for workers in args.workers:
+        start = time.perf_counter()
+        with open(path, 'rb') as f:
+            if workers == 1:
+                count = sum(1 for _ in parse_sms_elements(iter_sms(f)))
+            else:
+                count = sum(1 for _ in parse_xml_parallel(f, workers, args.chunk_bytes))
+        elapsed = time.perf_counter() - start
+        baseline = baseline or elapsed
+        print(f"{workers:>8} {elapsed:>9.2f} {count / elapsed:>12,.0f} {baseline / elapsed:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
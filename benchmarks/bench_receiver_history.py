@@ -0,0 +1,80 @@
+"""
+Measure receiver history latency on a large account.
+
+Seeds a SQLite database with ``--rows`` transactions for one user (cached in
+``benchmarks/.data/``) and times the former receiver history, which loaded
+every payment to a code holder, transfer to mobile and bank transfer and
+sorted them in Python, against one keyset page, at the start of the history
+and ``--depth`` pages into it.
+
+    python benchmarks/bench_receiver_history.py [--rows 1000000] [--depth 100] [--repeat 3]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.seed import seeded_database  # noqa: E402
+
+
+def legacy_history(user):
+    # The original implementation: every row materialised as a model
+    # instance, merged and sorted in Python
+    from transactions.models import BankTransfer, PaymentToCodeHolder, TransferToMobile
+
+    transactions = []
+    for payment in PaymentToCodeHolder.objects.filter(user=user).order_by('-date_time'):
+        transactions.append({'type': 'Payment to Code Holder', 'recipient': payment.recipient, 'amount': payment.amount, 'date_time': payment.date_time})
+    for transfer in TransferToMobile.objects.filter(user=user).order_by('-date_time'):
+        transactions.append({'type': 'Transfer to Mobile', 'recipient': transfer.recipient, 'amount': transfer.amount, 'date_time': transfer.date_time})
+    for transfer in BankTransfer.objects.filter(user=user).order_by('-date_time'):
+        transactions.append({'type': 'Bank Transfer', 'recipient': transfer.recipient, 'amount': transfer.amount, 'date_time': transfer.date_time})
+    transactions.sort(key=lambda x: x['date_time'], reverse=True)
+    return transactions
+
+
+def best_time(func, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--depth', type=int, default=100)
+    parser.add_argument('--page-size', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    user = seeded_database(args.rows)
+    from django.db.models import Q
+
+    from transactions.utils.receiver_history import fetch_page
+
+    filters = [Q(), Q(), Q()]
+    legacy_time, legacy = best_time(lambda: legacy_history(user), args.repeat)
+    first_time, (first, cursor) = best_time(lambda: fetch_page(user, filters, page_size=args.page_size), args.repeat)
+    assert [tx['amount'] for tx in first] == [tx['amount'] for tx in legacy[:args.page_size]], "first pages differ"
+
+    for _ in range(args.depth - 1):
+        _, cursor = fetch_page(user, filters, cursor, args.page_size)
+    deep_time, (deep, _) = best_time(lambda: fetch_page(user, filters, cursor, args.page_size), args.repeat)
+    offset = args.depth * args.page_size
+    assert [tx['date_time'] for tx in deep] == [tx['date_time'] for tx in legacy[offset:offset + args.page_size]], "deep pages differ"
+
+    print(f"{args.rows:,} transactions, {len(legacy):,} in the receiver history")
+    print(f"{'full history (legacy)':<28} {legacy_time:>9.3f}s")
+    print(f"{'first page':<28} {first_time:>9.4f}s")
+    print(f"{f'page {args.depth + 1}':<28} {deep_time:>9.4f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+"""
+Micro-benchmark for the single-pass SMS classifier in
+``transactions/utils/sms_parser.py``.
+
+Runs ``parse_sms`` over a synthetic corpus containing every category the
+parser handles and reports messages/second overall and per category, so
+throughput can be tracked over time.
+
+    python benchmarks/bench_sms_parser.py [--messages 200000] [--repeat 5]
+"""
+
+import argparse
+import os
+import sys
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.synthetic import TEMPLATES, generate_bodies  # noqa: E402
+from transactions.utils.sms_parser import parse_sms  # noqa: E402
+
+
+def best_rate(bodies, repeat):
+    best = 0.0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for body in bodies:
+            parse_sms(body)
+        elapsed = time.perf_counter() - start
+        best = max(best, len(bodies) / elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=200_000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    bodies = [body for _, body in generate_bodies(args.messages)]
+    categories = list(TEMPLATES)
+    by_category = defaultdict(list)
+    for i, body in enumerate(bodies):
+        by_category[categories[i % len(categories)]].append(body)
+
+    print(f"{'category':>16} {'messages/s':>12}")
+    for category in categories:
+        print(f"{category:>16} {best_rate(by_category[category], args.repeat):>12,.0f}")
+    print(f"{'all':>16} {best_rate(bodies, args.repeat):>12,.0f}")
+
+
+if __name__ == '__main__':
+    main()
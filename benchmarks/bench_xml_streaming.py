@@ -0,0 +1,69 @@
+"""
+Compare peak RSS and wall time of the two XML ingestion paths:
+
+* ``tree``   - ``parse_xml``: builds the whole ElementTree, then ``findall``
+* ``stream`` - ``iter_sms``: incremental ``iterparse`` that clears each <sms>
+
+Each measurement runs in a fresh subprocess so peak RSS isn't polluted by the
+previous run. Only parsing and reading the ``body`` attribute is timed, which
+is the part of ``process_xml_file`` that differs between the two paths.
+
+    python benchmarks/bench_xml_streaming.py [--sizes 10000 100000 1000000]
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import _django  # noqa: E402
+from benchmarks.synthetic import cached_backup  # noqa: E402
+
+
+def run_child(mode, path):
+    _django.setup()
+    from transactions.utils.process_data import iter_sms, parse_xml
+
+    start = time.perf_counter()
+    with open(path, 'rb') as f:
+        elements = parse_xml(f) if mode == 'tree' else iter_sms(f)
+        count = 0
+        for sms in elements:
+            sms.attrib.get("body", "")
+            count += 1
+    elapsed = time.perf_counter() - start
+    # ru_maxrss is reported in kilobytes on Linux
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(json.dumps({'mode': mode, 'count': count, 'seconds': elapsed, 'peak_rss_mb': peak_rss_mb}))
+
+
+def measure(mode, path):
+    output = subprocess.check_output([sys.executable, __file__, '--child', mode, path])
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', nargs='+', type=int, default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--child', nargs=2, metavar=('MODE', 'PATH'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(*args.child)
+        return
+
+    print(f"{'messages':>10} {'mode':>7} {'seconds':>9} {'peak RSS (MB)':>14}")
+    for size in args.sizes:
+        path = cached_backup(size)
+        for mode in ('tree', 'stream'):
+            result = measure(mode, path)
+            print(f"{size:>10} {mode:>7} {result['seconds']:>9.2f} {result['peak_rss_mb']:>14.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""
+Seeded SQLite databases of synthetic transactions for the query benchmarks.
+
+``seeded_database`` must be called before Django is set up: it points Django
+at ``benchmarks/.data/transactions-<rows>-<seed>.sqlite3`` and, on first use,
+migrates it and inserts ``rows`` transactions for one user spread over the
+nine dated transaction models, then builds the ledger, its running balances,
+its rollups, the counterparties and their totals. Later runs reuse the file.
+
+Counterparties are drawn from the ten ``NAMES`` with random phone numbers,
+unless ``counterparties`` asks for that many distinct generated names (each
+with its own phone number), which are part of the file name.
+"""
+
+import os
+import random
+from datetime import datetime, timedelta, timezone
+
+from benchmarks import _django
+from benchmarks.synthetic import AGENTS, MERCHANTS, NAMES, data_directory
+
+BENCH_EMAIL = 'bench@example.com'
+BATCH_SIZE = 5000
+
+
+def seeded_database(rows, seed=0, counterparties=None):
+    """Set up Django on a seeded database and return the benchmark user."""
+    suffix = f"-{counterparties}cp" if counterparties else ''
+    path = os.path.join(data_directory(), f"transactions-{rows}-{seed}{suffix}.sqlite3")
+    _django.setup(path)
+
+    from django.contrib.auth import get_user_model
+    from django.core.management import call_command
+
+    call_command('migrate', verbosity=0)
+    user_model = get_user_model()
+    user = user_model.objects.filter(email=BENCH_EMAIL).first()
+    if user is None:
+        user = user_model.objects.create_user(email=BENCH_EMAIL, password='bench')
+        print(f"Seeding {rows:,} transactions into {path} ...")
+        names = counterparty_names(counterparties, seed) if counterparties else None
+        seed_transactions(user, rows, seed, names=names)
+    return user
+
+
+# Syllables of the generated counterparty names
+SYLLABLES = ['ka', 'mu', 'ga', 'ri', 'se', 'ba', 'ni', 'ho', 'zi', 'ye', 'tu', 'mi', 'na', 'bo', 'ke', 'ra']
+
+
+def counterparty_names(count, seed=0):
+    """``count`` distinct "First Last" names made of random syllables."""
+    rng = random.Random(seed)
+    names = set()
+    while len(names) < count:
+        first = ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 3))).capitalize()
+        last = ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(3, 4))).capitalize()
+        names.add(f"{first} {last}")
+    return sorted(names)
+
+
+def seed_transactions(user, rows, seed=0, start=datetime(2020, 1, 1, tzinfo=timezone.utc), names=None):
+    from django.db import transaction
+
+    from transactions.utils import counterparties, counterparty_totals, rollups, transaction_counts
+    from transactions.utils.ledger import LEDGER_SOURCES, rebuild, update_balances
+    from transactions.utils.process_data import TRANSACTION_MODELS
+
+    rng = random.Random(seed)
+    kinds = list(LEDGER_SOURCES)
+    buffers = {kind: [] for kind in kinds}
+    moment = start
+    with transaction.atomic():
+        for i in range(rows):
+            # A transaction every ~2.5 minutes on average: 1M rows span ~5 years
+            moment += timedelta(seconds=rng.randint(5, 300))
+            kind = kinds[i % len(kinds)]
+            buffers[kind].append(LEDGER_SOURCES[kind].model(user=user, **transaction_fields(kind, rng, moment, i, names)))
+            if len(buffers[kind]) >= BATCH_SIZE:
+                LEDGER_SOURCES[kind].model.objects.bulk_create(buffers[kind])
+                buffers[kind] = []
+        for kind, buffer in buffers.items():
+            LEDGER_SOURCES[kind].model.objects.bulk_create(buffer)
+        rebuild(user=user, batch_size=BATCH_SIZE)
+        update_balances(user=user, batch_size=BATCH_SIZE)
+        rollups.rebuild(user=user, batch_size=BATCH_SIZE)
+        counterparties.rebuild(user=user, batch_size=BATCH_SIZE)
+        counterparty_totals.rebuild(user=user, batch_size=BATCH_SIZE)
+        transaction_counts.rebuild(TRANSACTION_MODELS)
+
+
+def transaction_fields(kind, rng, moment, i, names=None):
+    amount = rng.randint(1, 500) * 100
+    fee = rng.choice([0, 20, 100, 250])
+    txid = str(10000000000 + i)
+    if names is None:
+        name = rng.choice(NAMES)
+        phone = f"25078{rng.randint(1000000, 9999999)}"
+    else:
+        # One phone number per generated name
+        index = rng.randrange(len(names))
+        name = names[index]
+        phone = f"25078{1000000 + index}"
+    return {
+        'incoming': {'amount': amount, 'sender': name, 'date_time': moment, 'transaction_id': txid},
+        'payment_to_code': {'transaction_id': txid, 'amount': amount, 'recipient': name, 'date_time': moment},
+        'mobile_transfer': {'amount': amount, 'recipient': name, 'recipient_number': phone, 'date_time': moment, 'fee': fee},
+        'bank_deposit': {'amount': amount, 'date_time': moment},
+        'airtime_bill': {'transaction_id': txid, 'amount': amount, 'date_time': moment, 'fee': fee},
+        'cash_power_bill': {'transaction_id': txid, 'amount': amount, 'date_time': moment, 'fee': fee},
+        'third_party': {'amount': amount, 'initiated_by': rng.choice(MERCHANTS), 'date_time': moment, 'transaction_id': txid},
+        'withdrawal': {'user_name': name, 'agent_name': rng.choice(AGENTS), 'agent_number': phone, 'amount': amount, 'date_time': moment},
+        'bank_transfer': {'amount': amount, 'recipient': name, 'date_time': moment},
+    }[kind]
@@ -0,0 +1,131 @@
+"""
+Synthetic SMS backup generator shared by the benchmark scripts.
+
+Produces files in the same layout as the "SMS Backup & Restore" exports users
+upload, with one message template per category the ingestion parser handles.
+"""
+
+import os
+import random
+from datetime import datetime, timedelta
+from xml.sax.saxutils import quoteattr
+
+NAMES = [
+    "Jane Smith", "Samuel Carter", "Alex Doe", "Linda Green", "Robert Brown",
+    "Grace Uwase", "Eric Mugisha", "Aline Ingabire", "Patrick Habimana", "Diane Mukamana",
+]
+AGENTS = ["Agent Sophia", "Agent Bob", "Agent Claire", "Agent Didier"]
+MERCHANTS = ["DIRECT PAYMENT LTD", "ESICIA LTD", "KPAY"]
+
+TEMPLATES = {
+    "incoming": (
+        "You have received {amount} RWF from {name} (*********013) on your mobile money account "
+        "at {date}. Message from sender: . Your new balance:{balance} RWF. "
+        "Financial Transaction Id: {txid}."
+    ),
+    "payment_to_code": (
+        "TxId: {txid}. Your payment of {amount_commas} RWF to {name} {code} has been completed "
+        "at {date}. Your new balance: {balance} RWF. Fee was 0 RWF."
+    ),
+    "mobile_transfer": (
+        "*165*S*{amount} RWF transferred to {name} ({phone}) from 36521838 at {date} . "
+        "Fee was: {fee} RWF. New balance: {balance} RWF. Kugura ama inite cg interineti kuri MoMo, "
+        "Kanda *182*2*1# .*EN#"
+    ),
+    "bank_deposit": (
+        "*113*R*A bank deposit of {amount} RWF has been added to your mobile money account at {date}. "
+        "Your NEW BALANCE :{balance} RWF. Cash Deposit::CASH::::0::250795963036."
+        "Thank you for using MTN MobileMoney.*EN#"
+    ),
+    "airtime_bill": (
+        "*162*TxId:{txid}*S*Your payment of {amount} RWF to Airtime with token  has been completed "
+        "at {date}. Fee was {fee} RWF. Your new balance: {balance} RWF . *EN#"
+    ),
+    "cash_power_bill": (
+        "*162*TxId:{txid}*S*Your payment of {amount} RWF to MTN Cash Power with token {token} "
+        "has been completed at {date}. Fee was {fee} RWF. Your new balance: {balance} RWF . *EN#"
+    ),
+    "third_party": (
+        "*164*S*Y'ello,A transaction of {amount} RWF by {merchant} on your MOMO account was "
+        "successfully completed at {date}. Message from debit receiver: . Your new balance:{balance} RWF. "
+        "Fee was 0 RWF. Financial Transaction Id: {txid}.*EN#"
+    ),
+    "withdrawal": (
+        "You {name} (*********036) have via agent: {agent} ({phone}), withdrawn {amount} RWF from your "
+        "mobile money account: 36521838 at {date} and you can now collect your money in cash. "
+        "Your new balance: {balance} RWF. Fee paid: {fee} RWF. Message from agent: 1. "
+        "Financial Transaction Id: {txid}."
+    ),
+    "bank_transfer": (
+        "You have transferred {amount} RWF to {name} ({phone}) from your mobile money account 36521838 "
+        "imbank.bank at {date}. Your new balance: {balance} RWF."
+    ),
+    "internet_bundle": (
+        "Yello!Umaze kugura {amount_commas}FRW({size}GB) igura {amount_commas} RWF, "
+        "ikazarangira {date}"
+    ),
+    "voice_bundle": "Yello!Umaze kugura {amount_commas}Frw={minutes}Mins+{smses}SMS, bimara iminsi 7.",
+    "system": "*143*R*You have been successfully registered for MTN Mobile Money.",
+    "ignored": "Y'ello! Kanda *345# ugure ama pack ya interineti ku giciro gito.",
+}
+
+
+def generate_bodies(count, seed=0, start=datetime(2023, 1, 1)):
+    """Yield ``(timestamp_ms, body)`` pairs cycling through every category."""
+    rng = random.Random(seed)
+    categories = list(TEMPLATES)
+    moment = start
+    for i in range(count):
+        moment += timedelta(seconds=rng.randint(30, 3600))
+        amount = rng.randint(1, 500) * 100
+        values = {
+            "amount": amount,
+            "amount_commas": f"{amount:,}",
+            "name": rng.choice(NAMES),
+            "agent": rng.choice(AGENTS),
+            "merchant": rng.choice(MERCHANTS),
+            "code": rng.randint(10000, 99999),
+            "phone": f"25078{rng.randint(1000000, 9999999)}",
+            "fee": rng.choice([0, 20, 100, 250]),
+            "balance": rng.randint(0, 10000) * 100,
+            "txid": 10000000000 + i,
+            "token": f"{rng.randint(10000, 99999)}-{rng.randint(10000, 99999)}",
+            "size": rng.choice([1, 2, 5]),
+            "minutes": rng.choice([30, 60, 120]),
+            "smses": rng.choice([20, 50, 100]),
+            "date": moment.strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        body = TEMPLATES[categories[i % len(categories)]].format(**values)
+        yield int(moment.timestamp() * 1000), body
+
+
+def write_backup(path, count, seed=0):
+    """Write a synthetic SMS backup with ``count`` messages to ``path``."""
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("<?xml version='1.0' encoding='UTF-8' standalone='yes' ?>\n")
+        f.write(f'<smses count="{count}" backup_set="synthetic">\n')
+        for timestamp, body in generate_bodies(count, seed=seed):
+            f.write(
+                f'  <sms protocol="0" address="M-Money" date="{timestamp}" type="1" '
+                f'subject="null" body={quoteattr(body)} read="1" status="-1" locked="0" '
+                f'readable_date="" contact_name="(Unknown)" />\n'
+            )
+        f.write("</smses>\n")
+    return path
+
+
+def data_directory():
+    """Directory generated benchmark data is cached in."""
+    directory = os.environ.get("BENCH_DATA_DIR", os.path.join(os.path.dirname(__file__), ".data"))
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def cached_backup(count, directory=None, seed=0):
+    """Return the path of a synthetic backup, generating it on first use."""
+    directory = directory or data_directory()
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"sms-{count}-{seed}.xml")
+    if not os.path.exists(path):
+        write_backup(path, count, seed=seed)
+    return path
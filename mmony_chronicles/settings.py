@@ -39,6 +39,7 @@ AUTH_USER_MODEL = 'users.CustomUser'
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
+    'transactions.middleware.RequestMetricsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -98,6 +99,54 @@ else:
             'NAME': BASE_DIR / 'db.sqlite3',
         }
     }
+# Cache
+# File-based so that web and background worker processes share it
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, '.cache'),
+    },
+    # Progress of running ingestion jobs, kept apart from the result cache so
+    # that culling the latter (MAX_ENTRIES defaults to 300) can't drop it
+    'ingestion': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, '.cache', 'ingestion'),
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
+}
+
+# Seconds dashboard and analysis results stay cached per user; an upload
+# invalidates the user's results as soon as it commits
+RESULT_CACHE_TIMEOUT = 24 * 60 * 60
+
+# Seconds the landing page's transaction counts stay cached; uploads
+# invalidate them as soon as they commit
+TRANSACTION_COUNTS_CACHE_TIMEOUT = 5 * 60
+
+# Maximum number of points of the balance chart; longer histories are
+# downsampled
+BALANCE_SERIES_POINTS = 1000
+
+# Transactions per page of the receiver history; further pages load as the
+# user scrolls
+RECEIVER_HISTORY_PAGE_SIZE = 50
+
+# Request metrics served at /metrics: also trace the peak memory allocated
+# per request (tracemalloc slows every request down), and with DEBUG on, log
+# statements a request runs at least this many times
+REQUEST_METRICS_TRACE_ALLOCATIONS = False
+REQUEST_METRICS_REPEATED_QUERIES = 5
+
+# Addresses allowed to scrape /metrics without a staff login, compared with
+# the connection's REMOTE_ADDR. Behind a reverse proxy on the same host
+# every request comes from loopback, so listing 127.0.0.1 would make the
+# metrics public. In that case set METRICS_CLIENT_IP_HEADER to the header
+# the proxy sets to the client address (e.g. 'HTTP_X_REAL_IP'); only do so
+# when the proxy overwrites it, as clients can send it themselves. For
+# X-Forwarded-For the last address, the one the proxy appended, is used
+METRICS_ALLOWED_IPS = []
+METRICS_CLIENT_IP_HEADER = None
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -145,6 +194,38 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Number of parsed rows buffered per model before they are written with
+# bulk_create during XML ingestion
+INGESTION_BATCH_SIZE = 1000
+
+# Worker processes used to parse uploads (1 parses in-process) and the size
+# of the XML chunks handed to each worker
+INGESTION_WORKERS = 1
+INGESTION_CHUNK_BYTES = 1024 * 1024
+
+# Skip messages older than the user's previous uploads when processing a new
+# backup, instead of re-parsing the whole history
+INGESTION_INCREMENTAL = True
+
+# Running ingestion jobs whose worker hasn't sent a heartbeat for this many
+# seconds (killed or restarted mid-upload) are requeued, or marked failed
+# once they have been attempted INGESTION_JOB_MAX_ATTEMPTS times
+INGESTION_JOB_STALE_AFTER = 10 * 60
+INGESTION_JOB_MAX_ATTEMPTS = 2
+
+# Record the peak memory of each background ingestion run in its report.
+# tracemalloc makes parsing about 3-4 times slower, so it is off by default
+INGESTION_TRACE_MEMORY = False
+
+# Anomaly detectors run over a user's ledger after each upload, with options
+# overriding their defaults (see transactions/utils/detectors.py)
+ANOMALY_DETECTORS = {
+    'threshold': {},
+    'mad': {'threshold': 3.5},
+    'rolling_zscore': {'window': 20, 'threshold': 3.0},
+    'burst': {'count': 5, 'minutes': 10},
+}
+
 # Crispy Forms
 CRISPY_TEMPLATE_PACK = 'bootstrap4'
 
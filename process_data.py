@@ -1,286 +1,232 @@
-import xml.etree.ElementTree as ET
-import re
-import pandas as pd
+import csv
+import json
 import sqlite3
+import sys
+import xml.etree.ElementTree as ET
+from collections import Counter
 
-# Load and parse the XML file
-def parse_xml(file_path):
-    tree = ET.parse(file_path)
-    root = tree.getroot()
-    return root.findall("sms")
+import pandas as pd
 
-# Extract and categorize SMS messages
-def extract_transaction_data(sms_elements):
+# The web app's classifier, so the script and the app agree on what every
+# message is. It has no Django dependencies
+from transactions.utils import sms_parser
+
+# Stream <sms> elements one at a time instead of building the whole tree,
+# clearing each one (and the root) once it has been processed
+def iter_sms(file_path):
+    context = ET.iterparse(file_path, events=("start", "end"))
+    _, root = next(context)
+    for event, elem in context:
+        if event == "end" and elem.tag == "sms":
+            yield elem
+            elem.clear()
+            root.clear()
+
+# Row layout of each extracted kind in the DataFrame and CSV: its "Type" and
+# the column each of sms_parser's fields goes in
+ROW_FORMATS = {
+    sms_parser.INCOMING: ("Incoming Money", {
+        "Amount": "amount", "Sender": "sender", "DateTime": "date_time", "TransactionID": "transaction_id",
+    }),
+    sms_parser.PAYMENT_TO_CODE: ("Payment to Code Holder", {
+        "TransactionID": "transaction_id", "Amount": "amount", "Recipient": "recipient", "DateTime": "date_time",
+    }),
+    sms_parser.MOBILE_TRANSFER: ("Transfer to Mobile Number", {
+        "Amount": "amount", "Recipient": "recipient", "RecipientNumber": "recipient_number",
+        "DateTime": "date_time", "Fee": "fee",
+    }),
+    sms_parser.BANK_DEPOSIT: ("Bank Deposit", {"Amount": "amount", "DateTime": "date_time"}),
+    sms_parser.AIRTIME_BILL: ("Airtime Bill Payment", {
+        "TransactionID": "transaction_id", "Amount": "amount", "DateTime": "date_time", "Fee": "fee",
+    }),
+    sms_parser.CASH_POWER_BILL: ("MTN Cash Power Bill Payment", {
+        "TransactionID": "transaction_id", "Amount": "amount", "DateTime": "date_time", "Fee": "fee",
+    }),
+    sms_parser.THIRD_PARTY: ("Transaction Initiated by Another Party", {
+        "Amount": "amount", "Initiator": "initiated_by", "DateTime": "date_time", "TransactionID": "transaction_id",
+    }),
+    sms_parser.WITHDRAWAL: ("Withdrawal from Agent", {
+        "UserName": "user_name", "AgentName": "agent_name", "AgentNumber": "agent_number",
+        "Amount": "amount", "DateTime": "date_time",
+    }),
+    sms_parser.BANK_TRANSFER: ("Bank Transfer", {"Amount": "amount", "Recipient": "recipient", "DateTime": "date_time"}),
+    sms_parser.INTERNET_BUNDLE: ("Internet Bundle Purchase", {
+        "Amount": "amount", "BundleSize": "bundle_size", "Unit": "unit",
+    }),
+    sms_parser.VOICE_BUNDLE: ("Voice Bundle Purchase", {"Amount": "amount", "Minutes": "minutes", "SMS": "smses"}),
+}
+
+BILL_TYPES = {sms_parser.AIRTIME_BILL: "Airtime", sms_parser.CASH_POWER_BILL: "MTN Cash Power"}
+
+# Table each row "Type" is inserted in, and the columns filled from the row
+SQLITE_TABLES = {
+    "Incoming Money": ("incoming_money", {
+        "amount": "Amount", "sender": "Sender", "date_time": "DateTime", "transaction_id": "TransactionID",
+    }),
+    "Payment to Code Holder": ("payment_to_code_holder", {
+        "transaction_id": "TransactionID", "amount": "Amount", "recipient": "Recipient", "date_time": "DateTime",
+    }),
+    "Transfer to Mobile Number": ("transfer_to_mobile", {
+        "amount": "Amount", "recipient": "Recipient", "recipient_number": "RecipientNumber",
+        "date_time": "DateTime", "fee": "Fee",
+    }),
+    "Bank Deposit": ("bank_deposits", {"amount": "Amount", "date_time": "DateTime"}),
+    "Airtime Bill Payment": ("airtime_bill_payments", {
+        "transaction_id": "TransactionID", "amount": "Amount", "date_time": "DateTime", "fee": "Fee",
+    }),
+    "MTN Cash Power Bill Payment": ("cash_power_bill_payments", {
+        "transaction_id": "TransactionID", "amount": "Amount", "date_time": "DateTime", "fee": "Fee",
+    }),
+    "Transaction Initiated by Another Party": ("third_party_transactions", {
+        "amount": "Amount", "initiated_by": "Initiator", "date_time": "DateTime", "transaction_id": "TransactionID",
+    }),
+    "Withdrawal from Agent": ("withdrawals_from_agents", {
+        "user_name": "UserName", "agent_name": "AgentName", "agent_number": "AgentNumber",
+        "amount": "Amount", "date_time": "DateTime",
+    }),
+    "Bank Transfer": ("bank_transfers", {"amount": "Amount", "recipient": "Recipient", "date_time": "DateTime"}),
+    "Internet Bundle Purchase": ("internet_bundle_purchases", {
+        "amount": "Amount", "bundle_size": "BundleSize", "unit": "Unit", "duration": "Duration",
+    }),
+    "Voice Bundle Purchase": ("voice_bundle_purchases", {"amount": "Amount", "minutes": "Minutes", "smses": "SMS"}),
+}
+
+
+# Counts and totals of one run: what was read is counted as messages are
+# classified, what was written is read back from the CSV file and the
+# SQLite tables, so the reconciliation compares two independent sources
+class Accounting:
+    def __init__(self):
+        self.messages = 0
+        # Messages per sms_parser category
+        self.categories = Counter()
+        # Failed extractions per category
+        self.failed = Counter()
+        # Rows extracted, and their amount and fee totals, per row "Type"
+        self.extracted = Counter()
+        self.amounts = Counter()
+        self.fees = Counter()
+        # Rows read back from SQLite, and their amount totals, per row "Type"
+        self.written = Counter()
+        self.written_amounts = Counter()
+        # Rows and amount total read back from the CSV file
+        self.csv_rows = None
+        self.csv_amount = None
+
+    def count_message(self, result, row):
+        self.messages += 1
+        self.categories[result.kind] += 1
+        if row is not None:
+            self.extracted[row["Type"]] += 1
+            self.amounts[row["Type"]] += row["Amount"]
+            self.fees[row["Type"]] += row.get("Fee") or 0
+        elif result.kind not in (sms_parser.SYSTEM, sms_parser.IGNORED):
+            self.failed[result.kind] += 1
+
+    def count_written(self, row_type, count, amount):
+        self.written[row_type] += count
+        self.written_amounts[row_type] += amount
+
+    def discrepancies(self):
+        # Every message lands in exactly one bucket, and every extracted row
+        # must have been written once, with the same amount
+        found = []
+        accounted = (sum(self.extracted.values()) + sum(self.failed.values())
+                     + self.categories[sms_parser.SYSTEM] + self.categories[sms_parser.IGNORED])
+        if accounted != self.messages:
+            found.append(f"{self.messages} messages but {accounted} accounted for")
+        if self.csv_rows is not None and self.csv_rows != sum(self.extracted.values()):
+            found.append(f"{sum(self.extracted.values())} rows extracted but {self.csv_rows} written to the CSV")
+        elif self.csv_amount is not None and self.csv_amount != sum(self.amounts.values()):
+            found.append(f"{sum(self.amounts.values())} RWF extracted but {self.csv_amount} RWF written to the CSV")
+        for row_type in sorted(set(self.extracted) | set(self.written)):
+            if self.written[row_type] != self.extracted[row_type]:
+                found.append(f"{row_type}: {self.extracted[row_type]} rows extracted but {self.written[row_type]} written")
+            elif self.written_amounts[row_type] != self.amounts[row_type]:
+                found.append(
+                    f"{row_type}: {self.amounts[row_type]} RWF extracted but {self.written_amounts[row_type]} RWF written"
+                )
+        return found
+
+    def as_dict(self):
+        return {
+            "messages": self.messages,
+            "transactions": sum(self.extracted.values()),
+            "failed": sum(self.failed.values()),
+            "system": self.categories[sms_parser.SYSTEM],
+            "ignored": self.categories[sms_parser.IGNORED],
+            "categories": {
+                kind: {"messages": count, "failed": self.failed[kind]}
+                for kind, count in sorted(self.categories.items())
+            },
+            "types": {
+                row_type: {
+                    "extracted": self.extracted[row_type],
+                    "written": self.written[row_type],
+                    "amount": self.amounts[row_type],
+                    "fees": self.fees[row_type],
+                }
+                for row_type in sorted(self.extracted)
+            },
+            "csv_rows": self.csv_rows,
+            "csv_amount": self.csv_amount,
+            "discrepancies": self.discrepancies(),
+        }
+
+    def print_summary(self):
+        report = self.as_dict()
+        print(f"Total SMS: {report['messages']}")
+        print(f"Processed Transactions: {report['transactions']}")
+        print(f"Failed to process: {report['failed']}, system: {report['system']}, ignored: {report['ignored']}")
+        for row_type, totals in report["types"].items():
+            print(f"  {row_type}: {totals['extracted']} rows, {totals['amount']} RWF, {totals['fees']} RWF fees")
+        for discrepancy in report["discrepancies"]:
+            print(f"Discrepancy: {discrepancy}")
+
+
+# Build the DataFrame row of a parsed message, or None when nothing was
+# extracted from it
+def transaction_row(result):
+    if result.fields is None or result.kind not in ROW_FORMATS:
+        return None
+    row_type, columns = ROW_FORMATS[result.kind]
+    row = {"Type": row_type}
+    for column, field in columns.items():
+        row[column] = result.fields[field]
+    if result.kind in BILL_TYPES:
+        row["BillType"] = BILL_TYPES[result.kind]
+    return row
+
+# Classify, extract and count every message in one pass. Ignored messages and
+# failed extractions are written to the given open log files as they are met
+def extract_transaction_data(sms_elements, accounting=None, ignored_log=None, failed_log=None):
+    if accounting is None:
+        accounting = Accounting()
     data = []
-    failed_sms = []
-    
+
     for sms in sms_elements:
         body = sms.attrib.get("body", "")
-        
-        # 1. System Notifications
-        if body.startswith("*143*R*"):
-            if "successfully registered" in body:
-                continue  # Skip registration messages
-            if "failed" in body:
-                continue  # Skip failure messages for now
-        
-        # 2. Incoming Money
-        elif body.startswith("You have received"):
-            match = re.search(r"received (\d+) RWF from (.+?) \(", body)
-            date_time_match = re.search(r"at (\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})", body)
-            txn_id_match = re.search(r"Financial Transaction Id: (\d+)", body)
-            
-            if match and date_time_match and txn_id_match:
-                amount = int(match.group(1))
-                sender = match.group(2)
-                date_time = date_time_match.group(1)
-                txn_id = txn_id_match.group(1)
-                
-                data.append({
-                    "Type": "Incoming Money",
-                    "Amount": amount,
-                    "Sender": sender,
-                    "DateTime": date_time,
-                    "TransactionID": txn_id
-                })
-        
-        # 3. Payments to Code Holders
-        elif body.startswith("TxId"):
-
-           # Generalized matching
-            txn_id_match = re.search(r"TxId: (\d+)", body)
-            amount_match = re.search(r"payment\s+of\s+([\d,]+)\s+RWF", body)  # Adjusted regex
-            recipient_match = re.search(r"to (.+?) (\d+)", body)
-            date_time_match = re.search(r"at (\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})", body)
-
-            # Extract matched components
-            txn_id = txn_id_match.group(1) if txn_id_match else None
-            amount = int(amount_match.group(1).replace(",", "")) if amount_match else None  # Remove commas from amount
-            recipient = recipient_match.group(1).strip() if recipient_match else None
-            recipient_code = recipient_match.group(2) if recipient_match else None
-            date_time = date_time_match.group(1) if date_time_match else None
-
-            if txn_id and amount and recipient and date_time:
-                data.append({
-                    "Type": "Payment to Code Holder",
-                    "TransactionID": txn_id,
-                    "Amount": amount,
-                    "Recipient": recipient,
-                    "RecipientCode": recipient_code,
-                    "DateTime": date_time
-                })
-            else:
-                failed_sms.append(body)
-                
-        # 4. Transfers to Mobile Numbers
-        elif body.startswith("*165*S*"):
-            match = re.search(r"(\d+) RWF transferred to (.+?) \((250\d+)\)", body)
-            date_time_match = re.search(r"at (\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})", body)
-            fee_match = re.search(r"Fee was: (\d+) RWF", body)
-            
-            if match and date_time_match and fee_match:
-                amount = int(match.group(1))
-                recipient = match.group(2)
-                recipient_number = match.group(3)
-                date_time = date_time_match.group(1)
-                fee = int(fee_match.group(1))
-                
-                data.append({
-                    "Type": "Transfer to Mobile Number",
-                    "Amount": amount,
-                    "Recipient": recipient,
-                    "RecipientNumber": recipient_number,
-                    "DateTime": date_time,
-                    "Fee": fee
-                })
-        
-        # 5. Bank Deposits
-        elif body.startswith("*113*R*"):
-            match = re.search(r"deposit of (\d+) RWF", body)
-            date_time_match = re.search(r"at (\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})", body)
-            
-            if match and date_time_match:
-                amount = int(match.group(1))
-                date_time = date_time_match.group(1)
-                
-                data.append({
-                    "Type": "Bank Deposit",
-                    "Amount": amount,
-                    "DateTime": date_time
-                })
-        # 6. Bill Purchases (Airtime and Cash Power)
-        elif body.startswith("*162*"):
-            match = re.search(r"TxId:(\d+)\*S\*Your payment of (\d+) RWF to (Airtime|MTN Cash Power) with token.*?at (\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})", body)
-            fee_match = re.search(r"Fee was (\d+) RWF", body)
-            
-            if match and fee_match:
-                txn_id = match.group(1)
-                amount = int(match.group(2))
-                bill_type = match.group(3)
-                date_time = match.group(4)
-                fee = int(fee_match.group(1))
-                
-                data.append({
-                    "Type": f"{bill_type} Bill Payment",
-                    "TransactionID": txn_id,
-                    "Amount": amount,
-                    "BillType": bill_type,
-                    "DateTime": date_time,
-                    "Fee": fee
-                })
-
-        # 7. Transactions Initiated by Another Party
-        elif body.startswith("*164*S*"):
-            match = re.search(r"A transaction of (\d+) RWF by (.*?) on your MOMO account was successfully completed at (\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})", body)
-            txn_id_match = re.search(r"Financial Transaction Id: (\d+)", body)
-            
-            if match and txn_id_match:
-                amount = int(match.group(1))
-                initiator = match.group(2)
-                date_time = match.group(3)
-                txn_id = txn_id_match.group(1)
-                
-                data.append({
-                    "Type": "Transaction Initiated by Another Party",
-                    "Amount": amount,
-                    "Initiator": initiator,
-                    "DateTime": date_time,
-                    "TransactionID": txn_id
-                })
-
-        # 8. Withdrawals from Agents
-        elif body.startswith("You Wakuma Tekalign DEBELA"):
-            match = re.search(r"You (.*?)\(\*+\d{3}\) have via agent: (.*?) \((\d+)\), withdrawn (\d+) RWF.*?at (\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})", body)
-            if match:
-                user_name = match.group(1)
-                agent_name = match.group(2)
-                agent_number = match.group(3)
-                amount = int(match.group(4))
-                date_time = match.group(5)
-                
-                data.append({
-                    "Type": "Withdrawal from Agent",
-                    "UserName": user_name.strip(),
-                    "AgentName": agent_name.strip(),
-                    "AgentNumber": agent_number,
-                    "Amount": amount,
-                    "DateTime": date_time
-                })
-        
-        # 9. Bank Transfers - Sending money to self or others from a bank
-        elif body.startswith("You have transferred"):
-            match = re.search(r"You have transferred (\d+) RWF to (.*?) from your .*? at (\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})", body)
-            if match:
-                amount = int(match.group(1))
-                recipient = match.group(2)
-                date_time = match.group(3)
-                
-                data.append({
-                    "Type": "Bank Transfer",
-                    "Amount": amount,
-                    "Recipient": recipient.strip(),
-                    "DateTime": date_time
-                })
-
-        # 10. Internet or Voice Bundle Purchases
-        elif body.startswith("Yello!Umaze kugura"):
-            if "FRW" in body or "Rwf" in body:  # Internet bundle
-                match = re.search(r"Yello!Umaze kugura ([\d,]+)(?:Rwf|FRW)\((\d+)(GB|MB)\)", body)
-                if match:
-                    amount = int(match.group(1).replace(",", ""))  # Remove commas and convert to integer
-                    bundle_size = int(match.group(2))
-                    unit = match.group(3)
-
-                    data.append({
-                        "Type": "Internet Bundle Purchase",
-                        "Amount": amount,
-                        "BundleSize": bundle_size,
-                        "Unit": unit
-                    })
-            elif "Frw=" in body:  # Voice bundle
-                match = re.search(r"Yello!Umaze kugura ([\d,]+)Frw=(\d+)Mins\+(\d+)SMS", body)
-                if match:
-                    amount = int(match.group(1).replace(",", ""))
-                    minutes = int(match.group(2))
-                    sms = int(match.group(3))
-
-                    data.append({
-                        "Type": "Voice Bundle Purchase",
-                        "Amount": amount,
-                        "Minutes": minutes,
-                        "SMS": sms
-                    })
+        result = sms_parser.parse_sms(body)
+        row = transaction_row(result)
+        accounting.count_message(result, row)
+        if row is not None:
+            data.append(row)
+        elif result.kind == sms_parser.IGNORED:
+            if ignored_log is not None:
+                ignored_log.write(f"{body}\n")
+        elif result.reason and failed_log is not None:
+            failed_log.write(f"{result.reason}: {body}\n")
 
     print(f"Processed {len(data)} SMS messages.")
-    print(f"Failed to process {len(failed_sms)} SMS messages.")
+    print(f"Failed to process {sum(accounting.failed.values())} SMS messages.")
     return data
 
-def verify_processed_transactions(file_path):
-    sms_elements = parse_xml(file_path)
-    total_sms = len(sms_elements)
-    
-    # Track counts for all transaction types
-    processed_count = {
-        "Incoming Money": 0,
-        "Payment to Code Holder": 0,
-        "Transfer to Mobile Number": 0,
-        "Bank Deposit": 0,
-        "Airtime Bill Payment": 0,
-        "Cash Power Bill Payment": 0,
-        "Transaction Initiated by Another Party": 0,
-        "Withdrawal from Agent": 0,
-        "Bank Transfer": 0,
-        "Internet Bundle Purchase": 0,
-        "Voice Bundle Purchase": 0,
-        "Ignored": 0,
-    }
 
-    for sms in sms_elements:
-        body = sms.attrib.get("body", "")
-        
-        # Categorize and count transactions
-
-        if body.startswith("You have received"):
-            processed_count["Incoming Money"] += 1
-        elif body.startswith("TxId"):
-            processed_count["Payment to Code Holder"] += 1
-        elif body.startswith("*165*S*"):
-            processed_count["Transfer to Mobile Number"] += 1
-        elif body.startswith("*113*R*"):
-            processed_count["Bank Deposit"] += 1
-        elif body.startswith("*162*"):  # Bill payments
-            if "Airtime" in body:
-                processed_count["Airtime Bill Payment"] += 1
-            elif "Cash Power" in body:
-                processed_count["Cash Power Bill Payment"] += 1
-        elif body.startswith("*164*S*"):
-            processed_count["Transaction Initiated by Another Party"] += 1
-        elif body.startswith("You Wakuma Tekalign DEBELA"):  # Withdrawals from agents
-            processed_count["Withdrawal from Agent"] += 1
-        elif body.startswith("You have transferred"):  # Bank transfers
-            processed_count["Bank Transfer"] += 1
-        elif body.startswith("Yello!Umaze kugura"):  # Internet/Voice Bundle Purchases
-            if "FRW" in body or "Rwf" in body:
-                processed_count["Internet Bundle Purchase"] += 1
-            elif "Frw" in body:
-                processed_count["Voice Bundle Purchase"] += 1
-        else:
-            processed_count["Ignored"] += 1  # Messages not fitting known patterns
-
-    processed_total = sum(v for k, v in processed_count.items() if k != "Ignored")
-    print(f"Total SMS: {total_sms}")
-    print(f"Processed Transactions: {processed_total}")
-    print(f"Processed Breakdown: {processed_count}")
-    print(f"Discrepancy: {total_sms - processed_total - processed_count['Ignored']} (unprocessed messages)")
-
-    return processed_count, total_sms, processed_total
-
-
-def push_to_sqlite_by_type(df, db_path="db/transactions_by_type_v3.db"):
+def push_to_sqlite_by_type(transactions, db_path="db/transactions_by_type_v3.db", accounting=None):
     # Connect to SQLite database (or create it if it doesn't exist)
     conn = sqlite3.connect(db_path)
     cursor = conn.cursor()
-    
+
     # Define table creation queries for each transaction type
     table_definitions = {
         "incoming_money": """
@@ -385,149 +331,82 @@ def push_to_sqlite_by_type(df, db_path="db/transactions_by_type_v3.db"):
     # Create tables
     for table, query in table_definitions.items():
         cursor.execute(query)
-    
-    # Insert data into respective tables based on `Type`
-    for _, row in df.iterrows():
-        if row["Type"] == "Incoming Money":
-            cursor.execute("""
-            INSERT INTO incoming_money (amount, sender, date_time, transaction_id)
-            VALUES (?, ?, ?, ?)
-            """, (row["Amount"], row.get("Sender"), row["DateTime"], row.get("TransactionID")))
-        
-        elif row["Type"] == "Payment to Code Holder":
-            cursor.execute("""
-            INSERT INTO payment_to_code_holder (transaction_id, amount, recipient, date_time)
-            VALUES (?, ?, ?, ?)
-            """, (row.get("TransactionID"), row["Amount"], row.get("Recipient"), row["DateTime"]))
-        
-        elif row["Type"] == "Transfer to Mobile Number":
-            cursor.execute("""
-            INSERT INTO transfer_to_mobile (amount, recipient, recipient_number, date_time, fee)
-            VALUES (?, ?, ?, ?, ?)
-            """, (row["Amount"], row["Recipient"], row["RecipientNumber"], row["DateTime"], row.get("Fee")))
-        
-        elif row["Type"] == "Bank Deposit":
-            cursor.execute("""
-            INSERT INTO bank_deposits (amount, date_time)
-            VALUES (?, ?)
-            """, (row["Amount"], row["DateTime"]))
-        
-        elif row["Type"] == "Airtime Bill Payment":
-            cursor.execute("""
-            INSERT INTO airtime_bill_payments (transaction_id, amount, date_time, fee)
-            VALUES (?, ?, ?, ?)
-            """, (row.get("TransactionID"), row["Amount"], row["DateTime"], row.get("Fee")))
-        
-        elif row["Type"] == "MTN Cash Power Bill Payment":
-            cursor.execute("""
-            INSERT INTO cash_power_bill_payments (transaction_id, amount, date_time, fee)
-            VALUES (?, ?, ?, ?)
-            """, (row.get("TransactionID"), row["Amount"], row["DateTime"], row.get("Fee")))
-        
-        elif row["Type"] == "Transaction Initiated by Another Party":
-            cursor.execute("""
-            INSERT INTO third_party_transactions (amount, initiated_by, date_time, transaction_id)
-            VALUES (?, ?, ?, ?)
-            """, (row["Amount"], row.get("Initiator"), row["DateTime"], row.get("TransactionID")))
-        
-        elif row["Type"] == "Withdrawal from Agent":
-            cursor.execute("""
-            INSERT INTO withdrawals_from_agents (user_name, agent_name, agent_number, amount, date_time)
-            VALUES (?, ?, ?, ?, ?)
-            """, (row.get("UserName"), row.get("AgentName"), row.get("AgentNumber"), row["Amount"], row["DateTime"]))
-        
-        elif row["Type"] == "Bank Transfer":
-            cursor.execute("""
-            INSERT INTO bank_transfers (amount, recipient, date_time)
-            VALUES (?, ?, ?)
-            """, (row["Amount"], row["Recipient"], row["DateTime"]))
-        
-        elif row["Type"] == "Internet Bundle Purchase":
-            cursor.execute("""
-            INSERT INTO internet_bundle_purchases (amount, bundle_size, unit, duration)
-            VALUES (?, ?, ?, ?)
-            """, (row["Amount"], row.get("BundleSize"), row.get("Unit"), row.get("Duration")))
-        
-        elif row["Type"] == "Voice Bundle Purchase":
-            cursor.execute("""
-            INSERT INTO voice_bundle_purchases (amount, minutes, smses)
-            VALUES (?, ?, ?)
-            """, (row["Amount"], row.get("Minutes"), row.get("SMS")))
-    
-    # Commit and close connection
+
+    # Insert the rows of each `Type` into its table, one statement per table.
+    # The tables keep the rows of earlier runs: ids are AUTOINCREMENT, so this
+    # run's rows are those after the table's last id before the insert
+    rows_by_type = {}
+    for row in transactions:
+        rows_by_type.setdefault(row["Type"], []).append(row)
+    last_ids = {}
+    for row_type, rows in rows_by_type.items():
+        table, columns = SQLITE_TABLES[row_type]
+        cursor.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}")
+        last_ids[row_type] = cursor.fetchone()[0]
+        cursor.executemany(
+            f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+            [tuple(row.get(key) for key in columns.values()) for row in rows],
+        )
+
+    # Commit, then read back what this run stored
     conn.commit()
+    if accounting is not None:
+        for row_type, last_id in last_ids.items():
+            table, _ = SQLITE_TABLES[row_type]
+            cursor.execute(f"SELECT COUNT(*), COALESCE(SUM(amount), 0) FROM {table} WHERE id > ?", (last_id,))
+            count, amount = cursor.fetchone()
+            accounting.count_written(row_type, count, amount)
     conn.close()
     print(f"Data successfully pushed to {db_path}")
 
-# def extract_payment_to_code_holder_sms(file_path, output_file="payment_to_code_holder_sms.log"):
-#     sms_elements = parse_xml(file_path)
-#     txid_sms = []
-
-#     for sms in sms_elements:
-#         body = sms.attrib.get("body", "")
-#         if body.startswith("TxId"):
-#             txid_sms.append(body)
-
-#     with open(output_file, "w") as f:
-#         for message in txid_sms:
-#             f.write(f"{message}\n")
-
-#     print(f"Extracted {len(txid_sms)} 'Payment to Code Holder' SMS messages.")
-
 
 def write_to_csv(df, output_file):
     df.to_csv(output_file, index=False)
 
+# Count the rows of a written CSV file and total their Amount column
+def read_back_csv(output_file):
+    rows = 0
+    amount = 0
+    with open(output_file, newline="") as f:
+        for row in csv.DictReader(f):
+            rows += 1
+            amount += int(row.get("Amount") or 0)
+    return rows, amount
+
 # def write_to_json(df, output_file):
 #     df.to_json(output_file, orient="records")
 
-def log_ignored_messages(file_path, output_log="ignored_messages.log"):
-    sms_elements = parse_xml(file_path)
-    ignored_messages = []
+def write_report(accounting, output_file):
+    with open(output_file, "w") as f:
+        json.dump(accounting.as_dict(), f, indent=2)
 
-    for sms in sms_elements:
-        body = sms.attrib.get("body", "")
-        
-        # Check for ignored messages based on their patterns
-        if not (
-            
-            body.startswith("You have received")
-            or body.startswith("TxId")
-            or body.startswith("*165*S*")
-            or body.startswith("*113*R*")
-            or body.startswith("*162*")  # Bill payments
-            or body.startswith("*164*S*")  # Transactions initiated by another party
-            or body.startswith("You ")  # Withdrawals from agents
-            or body.startswith("Yello!Umaze kugura")  # Internet/Voice Bundle purchases
-        ):
-            ignored_messages.append(body)
-
-    # Write ignored messages to the log file
-    with open(output_log, "w") as log_file:
-        for message in ignored_messages:
-            log_file.write(f"{message}\n")
-    
-    print(f"{len(ignored_messages)} ignored messages written to {output_log}")
-
-
-# Convert data to DataFrame and display
-def main(file_path):
-    sms_elements = parse_xml(file_path)
-    transactions = extract_transaction_data(sms_elements)
+
+# Read the backup once: classify and extract each message, log the ignored
+# and failed ones, then write the CSV and SQLite database and reconcile what
+# was written with what was read
+def main(file_path, output_file="cleaned_data_v3.csv", db_path="db/transactions_by_type_v3.db",
+         ignored_log="ignored_messages.log", failed_log="failed_messages.log",
+         report_file="accounting_report.json"):
+    accounting = Accounting()
+    with open(ignored_log, "w") as ignored, open(failed_log, "w") as failed:
+        transactions = extract_transaction_data(iter_sms(file_path), accounting, ignored, failed)
     df = pd.DataFrame(transactions)
-    
+
     print(df)
 
-    output_file = "cleaned_data_v3.csv"
     # output_file = "cleaned_data.json"
     write_to_csv(df, output_file)
+    accounting.csv_rows, accounting.csv_amount = read_back_csv(output_file)
     # write_to_json(df, output_file)
 
-    verify_processed_transactions(file_path)
-    # log_ignored_messages(file_path)
-    push_to_sqlite_by_type(df)
+    push_to_sqlite_by_type(transactions, db_path, accounting)
+
+    accounting.print_summary()
+    write_report(accounting, report_file)
+    print(f"Accounting report written to {report_file}")
     return df
 
 # Run the script with the provided file
-file_path = "sms-20250116123406.xml"
-df = main(file_path)
+if __name__ == "__main__":
+    file_path = sys.argv[1] if len(sys.argv) > 1 else "sms-20250116123406.xml"
+    df = main(file_path)
@@ -0,0 +1,13 @@
+#!/bin/bash
+# App Service startup command (see .github/workflows/master_momony.yml).
+# Uploads are only queued by the web app, so run the ingestion worker in the
+# background, restarting it if it exits, and the web server in the foreground
+(
+    while true; do
+        python manage.py run_ingestion_worker
+        echo "Ingestion worker exited with status $?, restarting" >&2
+        sleep 5
+    done
+) &
+
+exec gunicorn --bind=0.0.0.0:${PORT:-8000} --timeout 600 mmony_chronicles.wsgi
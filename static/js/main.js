@@ -63,6 +63,67 @@ const plotlyTheme = {
     }
 };
 
+// Apply the custom Plotly theme to a chart that has been drawn
+function applyPlotlyTheme(chart) {
+    if (typeof Plotly !== 'undefined' && chart && chart._fullData) {
+        Plotly.relayout(chart.id, plotlyTheme);
+    }
+}
+
+// Widget payloads are columnar: {field: [value of each row]}. Rebuild the
+// rows as objects for the code that needs them
+function columnRows(columns) {
+    const fields = Object.keys(columns);
+    const count = fields.length ? columns[fields[0]].length : 0;
+    const rows = [];
+    for (let i = 0; i < count; i++) {
+        const row = {};
+        fields.forEach(field => {
+            row[field] = columns[field][i];
+        });
+        rows.push(row);
+    }
+    return rows;
+}
+
+// Fetch the data of a page's widgets in parallel and draw each one as soon as
+// its data arrives, so no widget waits for the slowest. Each widget is
+// {url, targets: [element ids it draws into], render(data)}; its targets
+// show a spinner until then, or an error if the request fails
+function loadWidgets(widgets) {
+    widgets.forEach(widget => {
+        const targets = widget.targets.map(id => document.getElementById(id)).filter(Boolean);
+        const show = (target, html) => {
+            // Table bodies can only hold rows
+            target.innerHTML = target.tagName === 'TBODY' ? `<tr><td colspan="100">${html}</td></tr>` : html;
+        };
+        targets.forEach(target => {
+            show(target, '<div class="text-center my-4"><div class="spinner-border" role="status">' +
+                '<span class="visually-hidden">Loading...</span></div></div>');
+        });
+        fetch(widget.url, {headers: {'Accept': 'application/json'}, credentials: 'same-origin'})
+            .then(response => {
+                if (!response.ok) {
+                    throw new Error(`${widget.url}: ${response.status}`);
+                }
+                return response.json();
+            })
+            .then(data => {
+                targets.forEach(target => {
+                    target.innerHTML = '';
+                });
+                widget.render(data);
+                targets.forEach(applyPlotlyTheme);
+            })
+            .catch(error => {
+                console.error(error);
+                targets.forEach(target => {
+                    show(target, '<div class="alert alert-danger mb-0">Could not load this data. Please reload the page.</div>');
+                });
+            });
+    });
+}
+
 // Wait for the DOM to be fully loaded
 document.addEventListener('DOMContentLoaded', function() {
     // Enable Bootstrap tooltips
@@ -127,12 +188,9 @@ document.addEventListener('DOMContentLoaded', function() {
             displaylogo: false
         });
 
-        // Apply theme to all charts
+        // Apply theme to all charts drawn so far; widget charts get it when
+        // their data arrives
         const charts = document.querySelectorAll('[id$="-chart"]');
-        charts.forEach(chart => {
-            if (chart._fullData) {
-                Plotly.relayout(chart.id, plotlyTheme);
-            }
-        });
+        charts.forEach(applyPlotlyTheme);
     }
 });
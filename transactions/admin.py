@@ -1,8 +1,12 @@
+import json
+
 from django.contrib import admin
+from django.utils.html import format_html
 from .models import (
     IncomingMoney, PaymentToCodeHolder, TransferToMobile, BankDeposit,
     AirtimeBillPayment, CashPowerBillPayment, ThirdPartyTransaction,
-    WithdrawalFromAgent, BankTransfer, InternetBundlePurchase, VoiceBundlePurchase
+    WithdrawalFromAgent, BankTransfer, InternetBundlePurchase, VoiceBundlePurchase,
+    IngestionJob, LedgerEntry, DetectedAnomaly, Counterparty, CounterpartyTotal
 )
 
 # Register models
@@ -16,4 +20,54 @@ admin.site.register(ThirdPartyTransaction)
 admin.site.register(WithdrawalFromAgent)
 admin.site.register(BankTransfer)
 admin.site.register(InternetBundlePurchase)
-admin.site.register(VoiceBundlePurchase)
\ No newline at end of file
+admin.site.register(VoiceBundlePurchase)
+
+@admin.register(IngestionJob)
+class IngestionJobAdmin(admin.ModelAdmin):
+    list_display = (
+        'id', 'user', 'status', 'message_count', 'transaction_count', 'failed_count', 'created_at', 'duration',
+        'messages_per_second', 'write_seconds', 'peak_memory',
+    )
+    list_filter = ('status',)
+    readonly_fields = ('created_at', 'started_at', 'finished_at', 'run_report')
+    exclude = ('report',)
+
+    # Figures of the run report, to compare runs in the list
+    @admin.display(description='Messages/s')
+    def messages_per_second(self, job):
+        return job.report.get('messages_per_second')
+
+    @admin.display(description='Write time (s)')
+    def write_seconds(self, job):
+        return job.report.get('seconds', {}).get('write')
+
+    @admin.display(description='Peak memory (MB)')
+    def peak_memory(self, job):
+        peak = job.report.get('peak_memory_bytes')
+        return None if peak is None else round(peak / (1024 * 1024), 1)
+
+    @admin.display(description='Run report')
+    def run_report(self, job):
+        return format_html('<pre>{}</pre>', json.dumps(job.report, indent=2))
+
+@admin.register(LedgerEntry)
+class LedgerEntryAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'kind', 'direction', 'amount', 'fee', 'counterparty', 'date_time')
+    list_filter = ('kind', 'direction')
+
+@admin.register(DetectedAnomaly)
+class DetectedAnomalyAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'detector', 'anomaly_type', 'date_time')
+    list_filter = ('detector',)
+    raw_id_fields = ('entry',)
+
+@admin.register(Counterparty)
+class CounterpartyAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'name', 'normalized_name', 'number')
+    search_fields = ('name', 'number')
+
+@admin.register(CounterpartyTotal)
+class CounterpartyTotalAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'counterparty', 'kind', 'count', 'amount')
+    list_filter = ('kind',)
+    raw_id_fields = ('counterparty',)
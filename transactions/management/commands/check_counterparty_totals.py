@@ -0,0 +1,49 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from transactions.utils import counterparty_totals, result_cache
+
+
+class Command(BaseCommand):
+    help = "Recompute the counterparty totals from the transaction rows and report any drift from the stored ones."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user',
+            help="Only check the totals of the user with this email address.",
+        )
+        parser.add_argument(
+            '--fix', action='store_true',
+            help="Rebuild the totals when they have drifted.",
+        )
+
+    def handle(self, *args, **options):
+        user = None
+        if options['user']:
+            try:
+                user = get_user_model().objects.get(email=options['user'])
+            except get_user_model().DoesNotExist:
+                raise CommandError(f"No user with email {options['user']!r}.")
+
+        drifts = counterparty_totals.check(user)
+        for drift in drifts:
+            self.stdout.write(
+                f"user {drift.user_id}, counterparty {drift.counterparty_id}, {drift.kind}: "
+                f"expected {self.describe(drift.expected)}, stored {self.describe(drift.stored)}"
+            )
+        if not drifts:
+            self.stdout.write(self.style.SUCCESS("Counterparty totals are consistent."))
+            return
+        if not options['fix']:
+            raise CommandError(f"{len(drifts)} counterparty total{'' if len(drifts) == 1 else 's'} drifted; rerun with --fix to rebuild them.")
+        with transaction.atomic():
+            count = counterparty_totals.rebuild(user=user)
+        result_cache.invalidate(user)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {count} counterparty total{'' if count == 1 else 's'}."))
+
+    def describe(self, total):
+        if total is None:
+            return "none"
+        count, amount = total
+        return f"{count} for {amount}"
@@ -0,0 +1,49 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from transactions.models import LedgerEntry
+from transactions.utils import detectors, result_cache
+
+
+class Command(BaseCommand):
+    help = "Run the anomaly detectors over the ledger and store their results."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user',
+            help="Only run the detectors for the user with this email address.",
+        )
+        parser.add_argument(
+            '--detector', action='append', choices=list(detectors.DETECTORS),
+            help="Only run this detector, with its configured options (may be repeated).",
+        )
+        parser.add_argument(
+            '--batch-size', type=int,
+            help="Ledger entries read per batch (defaults to INGESTION_BATCH_SIZE).",
+        )
+
+    def handle(self, *args, **options):
+        if options['user']:
+            try:
+                users = [get_user_model().objects.get(email=options['user'])]
+            except get_user_model().DoesNotExist:
+                raise CommandError(f"No user with email {options['user']!r}.")
+        else:
+            users = get_user_model().objects.filter(
+                pk__in=LedgerEntry.objects.values('user_id').distinct()
+            )
+
+        enabled = detectors.enabled_detectors()
+        if options['detector']:
+            enabled = [d for d in enabled if d.name in options['detector']]
+            missing = set(options['detector']) - {d.name for d in enabled}
+            enabled += [detectors.DETECTORS[name]() for name in sorted(missing)]
+
+        total = 0
+        for user in users:
+            counts = detectors.run(user, enabled, batch_size=options['batch_size'])
+            result_cache.invalidate(user)
+            total += sum(counts.values())
+            summary = ', '.join(f"{d.name}: {counts[d.name]}" for d in enabled)
+            self.stdout.write(f"{user.email}: {summary}")
+        self.stdout.write(self.style.SUCCESS(f"Stored {total} anomal{'y' if total == 1 else 'ies'}."))
@@ -0,0 +1,97 @@
+import json
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from transactions.models import IngestionJob
+
+
+class Command(BaseCommand):
+    help = "Compare the reports of recent ingestion runs, or show the full report of given jobs."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'job_ids', nargs='*', type=int,
+            help="Show the full report of these jobs.",
+        )
+        parser.add_argument(
+            '--user',
+            help="Only list the runs of the user with this email address.",
+        )
+        parser.add_argument(
+            '--limit', type=int, default=20,
+            help="Number of recent runs listed (default 20).",
+        )
+        parser.add_argument(
+            '--json', action='store_true',
+            help="Print the reports as JSON.",
+        )
+
+    def handle(self, *args, **options):
+        jobs = IngestionJob.objects.exclude(report={}).order_by('-finished_at', '-id')
+        if options['job_ids']:
+            jobs = jobs.filter(pk__in=options['job_ids'])
+            missing = set(options['job_ids']) - set(jobs.values_list('pk', flat=True))
+            if missing:
+                raise CommandError(f"No report for job{'' if len(missing) == 1 else 's'} {', '.join(map(str, sorted(missing)))}.")
+        if options['user']:
+            try:
+                jobs = jobs.filter(user=get_user_model().objects.get(email=options['user']))
+            except get_user_model().DoesNotExist:
+                raise CommandError(f"No user with email {options['user']!r}.")
+        if not options['job_ids']:
+            jobs = jobs[:options['limit']]
+        jobs = list(jobs)
+
+        if options['json']:
+            self.stdout.write(json.dumps({job.pk: job.report for job in jobs}, indent=2))
+        elif options['job_ids']:
+            for job in jobs:
+                self.write_report(job)
+        elif not jobs:
+            self.stdout.write("No ingestion runs with a report.")
+        else:
+            self.write_runs(jobs)
+
+    def write_runs(self, jobs):
+        self.stdout.write(
+            f"{'job':>6} {'finished':<16} {'status':<9} {'messages':>9} {'msg/s':>9} {'parse':>8} "
+            f"{'classify':>8} {'write':>8} {'post':>8} {'total':>8} {'peak MB':>8}"
+        )
+        for job in jobs:
+            report = job.report
+            timings = report['seconds']
+            finished = f"{job.finished_at:%Y-%m-%d %H:%M}" if job.finished_at else '-'
+            self.stdout.write(
+                f"{job.pk:>6} {finished:<16} {job.status:<9} {report['messages']:>9} "
+                f"{self.number(report['messages_per_second'], 0):>9} {timings['parse']:>8.2f} {timings['classify']:>8.2f} "
+                f"{timings['write']:>8.2f} {timings['post_processing']:>8.2f} {timings['total']:>8.2f} "
+                f"{self.megabytes(report['peak_memory_bytes']):>8}"
+            )
+
+    def write_report(self, job):
+        report = job.report
+        timings = report['seconds']
+        self.stdout.write(self.style.MIGRATE_HEADING(f"Job {job.pk} ({job.status}, {job.xml_file.file.name})"))
+        self.stdout.write(
+            f"{report['messages']} messages, {report['transactions']} transactions, {report['failed']} failed, "
+            f"{report['skipped']} skipped, {report['duplicates']} duplicates, {report['workers']} worker(s)"
+            f"{'' if report.get('committed', True) else ', rolled back'}"
+        )
+        self.stdout.write(
+            f"{self.number(report['messages_per_second'], 0)} messages/s, peak memory "
+            f"{self.megabytes(report['peak_memory_bytes'])} MB"
+        )
+        self.stdout.write('  ' + ', '.join(f"{phase} {value:.3f}s" for phase, value in timings.items()))
+        self.stdout.write(f"  {'category':<20} {'messages':>9} {'failed':>7} {'seconds':>9}")
+        for kind, category in report['categories'].items():
+            self.stdout.write(f"  {kind:<20} {category['messages']:>9} {category['failed']:>7} {category['seconds']:>9.3f}")
+        self.stdout.write(f"  {'model':<28} {'rows':>9} {'duplicates':>10} {'write s':>9}")
+        for name, model in report['models'].items():
+            self.stdout.write(f"  {name:<28} {model['rows']:>9} {model['duplicates']:>10} {model['write_seconds']:>9.3f}")
+
+    def number(self, value, digits):
+        return '-' if value is None else f"{value:.{digits}f}"
+
+    def megabytes(self, value):
+        return '-' if value is None else f"{value / (1024 * 1024):.1f}"
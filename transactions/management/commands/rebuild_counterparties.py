@@ -0,0 +1,34 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from transactions.utils import counterparty_totals, result_cache
+from transactions.utils.counterparties import rebuild
+
+
+class Command(BaseCommand):
+    help = "Create the counterparties missing for existing transactions, link the rows without one and recompute the counterparty totals."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user',
+            help="Only rebuild the counterparties of the user with this email address.",
+        )
+        parser.add_argument(
+            '--batch-size', type=int,
+            help="Counterparties inserted per batch (defaults to INGESTION_BATCH_SIZE).",
+        )
+
+    def handle(self, *args, **options):
+        user = None
+        if options['user']:
+            try:
+                user = get_user_model().objects.get(email=options['user'])
+            except get_user_model().DoesNotExist:
+                raise CommandError(f"No user with email {options['user']!r}.")
+
+        with transaction.atomic():
+            count = rebuild(user=user, batch_size=options['batch_size'])
+            counterparty_totals.rebuild(user=user, batch_size=options['batch_size'])
+        result_cache.invalidate(user)
+        self.stdout.write(self.style.SUCCESS(f"{count} counterpart{'y' if count == 1 else 'ies'}."))
@@ -0,0 +1,44 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from transactions.models import LedgerEntry
+from transactions.utils import result_cache
+from transactions.utils.ledger import rebuild, update_balances
+
+
+class Command(BaseCommand):
+    help = "Backfill the unified transaction ledger from the transaction tables."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user',
+            help="Only rebuild the ledger of the user with this email address.",
+        )
+        parser.add_argument(
+            '--clear', action='store_true',
+            help="Delete existing ledger entries first instead of only adding missing ones.",
+        )
+        parser.add_argument(
+            '--batch-size', type=int,
+            help="Rows read and written per batch (defaults to INGESTION_BATCH_SIZE).",
+        )
+
+    def handle(self, *args, **options):
+        user = None
+        if options['user']:
+            try:
+                user = get_user_model().objects.get(email=options['user'])
+            except get_user_model().DoesNotExist:
+                raise CommandError(f"No user with email {options['user']!r}.")
+
+        entries = LedgerEntry.objects.all() if user is None else LedgerEntry.objects.filter(user=user)
+        before = 0 if options['clear'] else entries.count()
+        with transaction.atomic():
+            scanned = rebuild(user=user, clear=options['clear'], batch_size=options['batch_size'])
+            update_balances(user=user, batch_size=options['batch_size'])
+        result_cache.invalidate(user)
+        created = entries.count() - before
+        self.stdout.write(self.style.SUCCESS(
+            f"Scanned {scanned} transaction(s), created {created} ledger entr{'y' if created == 1 else 'ies'}."
+        ))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from transactions.utils.process_data import TRANSACTION_MODELS
+from transactions.utils.transaction_counts import rebuild
+
+
+class Command(BaseCommand):
+    help = "Recount the transactions of every kind shown on the landing page."
+
+    def handle(self, *args, **options):
+        counts = rebuild(TRANSACTION_MODELS)
+        total = sum(counts.values())
+        self.stdout.write(self.style.SUCCESS(f"Counted {total} transaction{'' if total == 1 else 's'}."))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from transactions.utils.ingestion_jobs import run_worker
+
+
+class Command(BaseCommand):
+    help = "Poll the database queue and process uploaded SMS backups in the background."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--poll-interval', type=float, default=2.0,
+            help="Seconds to wait between polls when the queue is empty.",
+        )
+        parser.add_argument(
+            '--once', action='store_true',
+            help="Process the jobs currently queued, then exit.",
+        )
+
+    def handle(self, *args, **options):
+        ran = run_worker(poll_interval=options['poll_interval'], once=options['once'])
+        if options['once']:
+            self.stdout.write(self.style.SUCCESS(f"Processed {ran} ingestion job(s)."))
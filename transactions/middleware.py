@@ -0,0 +1,123 @@
+import logging
+import os
+import sys
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+from .utils import request_metrics
+
+logger = logging.getLogger(__name__)
+
+
+class QueryRecorder:
+    # Execute wrapper counting and timing the queries of a request; with
+    # ``trace`` it also keeps each query's SQL, parameters and call site
+    def __init__(self, trace=False):
+        self.trace = trace
+        self.count = 0
+        self.time = 0.0
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.time += time.perf_counter() - start
+            self.count += 1
+            if self.trace:
+                self.queries.append((sql, repr(params), call_site()))
+
+
+def call_site():
+    # The innermost frame of the project's own code (not Django's or this
+    # module's) that led to the query, as "path:line in function"
+    base = str(settings.BASE_DIR)
+    frame = sys._getframe(1)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if (filename.startswith(base) and filename != __file__
+                and f'{os.sep}site-packages{os.sep}' not in filename):
+            return f"{os.path.relpath(filename, base)}:{frame.f_lineno} in {frame.f_code.co_name}"
+        frame = frame.f_back
+    return 'unknown'
+
+
+def repeated_queries(queries, threshold):
+    """
+    Find the N+1 patterns and duplicates among a request's ``queries`` (SQL,
+    parameters, call site). Returns a list of (kind, SQL, count, call sites)
+    for statements run ``threshold`` times or more with any parameters
+    ('similar'), and for the other statements run more than once with the
+    same parameters ('duplicate').
+    """
+    by_sql = defaultdict(list)
+    exact = Counter()
+    for sql, params, site in queries:
+        by_sql[sql].append(site)
+        exact[(sql, params)] += 1
+    found = []
+    for sql, sites in by_sql.items():
+        if len(sites) >= threshold:
+            found.append(('similar', sql, len(sites), sorted(set(sites))))
+    similar = {sql for _, sql, _, _ in found}
+    for (sql, _), count in exact.items():
+        if count > 1 and sql not in similar:
+            found.append(('duplicate', sql, count, sorted(set(by_sql[sql]))))
+    return found
+
+
+class RequestMetricsMiddleware:
+    """
+    Record the query count, SQL and Python time, response size and peak
+    allocations of each request in ``request_metrics``, per view. With
+    DEBUG on, also log the queries a request repeats, with where they were
+    run from.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.trace_allocations = getattr(settings, 'REQUEST_METRICS_TRACE_ALLOCATIONS', False)
+        if self.trace_allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def __call__(self, request):
+        recorder = QueryRecorder(trace=settings.DEBUG)
+        if self.trace_allocations:
+            # The peak is process-wide, so concurrent requests in other
+            # threads are included
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            response = self.get_response(request)
+        duration = time.perf_counter() - start
+
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match is not None else 'unresolved'
+        values = {
+            'duration': duration,
+            'sql_time': recorder.time,
+            'python_time': max(duration - recorder.time, 0),
+            'queries': recorder.count,
+        }
+        if not response.streaming:
+            values['response_size'] = len(response.content)
+        if self.trace_allocations:
+            values['peak_allocations'] = max(tracemalloc.get_traced_memory()[1] - baseline, 0)
+        request_metrics.observe(view, values)
+
+        if recorder.trace:
+            threshold = getattr(settings, 'REQUEST_METRICS_REPEATED_QUERIES', 5)
+            for kind, sql, count, sites in repeated_queries(recorder.queries, threshold):
+                logger.warning(
+                    "%s: %s query run %d times, from %s: %s", view, kind, count, ', '.join(sites), sql,
+                )
+        return response
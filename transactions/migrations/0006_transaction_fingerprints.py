@@ -0,0 +1,205 @@
+# Generated by Django 4.2 on 2026-10-18 13:57
+
+import hashlib
+from datetime import datetime
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.utils import timezone
+
+# Kind of each transaction model, the fields that identify a transaction of
+# each kind and the kinds without a date in the SMS body, as in
+# transactions/utils/dedup.py at the time of this migration. The fingerprint
+# is copied below too, so later changes there don't change what this
+# migration computes
+MODEL_KINDS = {
+    'IncomingMoney': 'incoming',
+    'PaymentToCodeHolder': 'payment_to_code',
+    'TransferToMobile': 'mobile_transfer',
+    'BankDeposit': 'bank_deposit',
+    'AirtimeBillPayment': 'airtime_bill',
+    'CashPowerBillPayment': 'cash_power_bill',
+    'ThirdPartyTransaction': 'third_party',
+    'WithdrawalFromAgent': 'withdrawal',
+    'BankTransfer': 'bank_transfer',
+    'InternetBundlePurchase': 'internet_bundle',
+    'VoiceBundlePurchase': 'voice_bundle',
+}
+
+FINGERPRINT_FIELDS = {
+    'incoming': ('amount', 'sender', 'date_time', 'transaction_id'),
+    'payment_to_code': ('transaction_id', 'amount', 'recipient', 'date_time'),
+    'mobile_transfer': ('amount', 'recipient', 'recipient_number', 'date_time', 'fee'),
+    'bank_deposit': ('amount', 'date_time'),
+    'airtime_bill': ('transaction_id', 'amount', 'date_time', 'fee'),
+    'cash_power_bill': ('transaction_id', 'amount', 'date_time', 'fee'),
+    'third_party': ('amount', 'initiated_by', 'date_time', 'transaction_id'),
+    'withdrawal': ('user_name', 'agent_name', 'agent_number', 'amount', 'date_time'),
+    'bank_transfer': ('amount', 'recipient', 'date_time'),
+    'internet_bundle': ('amount', 'bundle_size', 'unit'),
+    'voice_bundle': ('amount', 'minutes', 'smses'),
+}
+
+UNDATED_KINDS = {'internet_bundle', 'voice_bundle'}
+
+
+def _canonical(value):
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        if timezone.is_aware(value):
+            value = timezone.make_naive(value)
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(value, (int, Decimal)):
+        return format(Decimal(value).normalize(), 'f')
+    return str(value)
+
+
+def fingerprint(kind, values, sms_date=None):
+    parts = [kind]
+    parts.extend(_canonical(values.get(field)) for field in FINGERPRINT_FIELDS[kind])
+    if kind in UNDATED_KINDS:
+        parts.append(str(sms_date or ''))
+    return hashlib.sha1('\x1f'.join(parts).encode('utf-8')).hexdigest()
+
+
+BATCH_SIZE = 2000
+
+
+def backfill_fingerprints(apps, schema_editor):
+    # Fingerprint existing rows the same way ingestion does, and delete rows
+    # that duplicate an earlier one for the same user so the unique
+    # constraint can be added. Bundle rows predate the SMS date being
+    # recorded, so they get a fingerprint unique to the row instead.
+    for model_name, kind in MODEL_KINDS.items():
+        model = apps.get_model('transactions', model_name)
+        fields = FINGERPRINT_FIELDS[kind]
+        seen = set()
+        updates = []
+        duplicate_ids = []
+        for row in model.objects.order_by('id').iterator(chunk_size=BATCH_SIZE):
+            sms_date = f'legacy-{row.pk}' if kind in UNDATED_KINDS else None
+            row.fingerprint = fingerprint(kind, {field: getattr(row, field) for field in fields}, sms_date)
+            key = (row.user_id, row.fingerprint)
+            if row.user_id is not None and key in seen:
+                duplicate_ids.append(row.pk)
+                continue
+            seen.add(key)
+            updates.append(row)
+            if len(updates) >= BATCH_SIZE:
+                model.objects.bulk_update(updates, ['fingerprint'])
+                updates = []
+        if updates:
+            model.objects.bulk_update(updates, ['fingerprint'])
+        for start in range(0, len(duplicate_ids), BATCH_SIZE):
+            model.objects.filter(pk__in=duplicate_ids[start:start + BATCH_SIZE]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0005_ingestionjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='airtimebillpayment',
+            name='fingerprint',
+            field=models.CharField(blank=True, editable=False, max_length=40, null=True),
+        ),
+        migrations.AddField(
+            model_name='bankdeposit',
+            name='fingerprint',
+            field=models.CharField(blank=True, editable=False, max_length=40, null=True),
+        ),
+        migrations.AddField(
+            model_name='banktransfer',
+            name='fingerprint',
+            field=models.CharField(blank=True, editable=False, max_length=40, null=True),
+        ),
+        migrations.AddField(
+            model_name='cashpowerbillpayment',
+            name='fingerprint',
+            field=models.CharField(blank=True, editable=False, max_length=40, null=True),
+        ),
+        migrations.AddField(
+            model_name='incomingmoney',
+            name='fingerprint',
+            field=models.CharField(blank=True, editable=False, max_length=40, null=True),
+        ),
+        migrations.AddField(
+            model_name='internetbundlepurchase',
+            name='fingerprint',
+            field=models.CharField(blank=True, editable=False, max_length=40, null=True),
+        ),
+        migrations.AddField(
+            model_name='paymenttocodeholder',
+            name='fingerprint',
+            field=models.CharField(blank=True, editable=False, max_length=40, null=True),
+        ),
+        migrations.AddField(
+            model_name='thirdpartytransaction',
+            name='fingerprint',
+            field=models.CharField(blank=True, editable=False, max_length=40, null=True),
+        ),
+        migrations.AddField(
+            model_name='transfertomobile',
+            name='fingerprint',
+            field=models.CharField(blank=True, editable=False, max_length=40, null=True),
+        ),
+        migrations.AddField(
+            model_name='voicebundlepurchase',
+            name='fingerprint',
+            field=models.CharField(blank=True, editable=False, max_length=40, null=True),
+        ),
+        migrations.AddField(
+            model_name='withdrawalfromagent',
+            name='fingerprint',
+            field=models.CharField(blank=True, editable=False, max_length=40, null=True),
+        ),
+        migrations.RunPython(backfill_fingerprints, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='airtimebillpayment',
+            constraint=models.UniqueConstraint(fields=('user', 'fingerprint'), name='transactions_airtimebillpayment_unique_fingerprint'),
+        ),
+        migrations.AddConstraint(
+            model_name='bankdeposit',
+            constraint=models.UniqueConstraint(fields=('user', 'fingerprint'), name='transactions_bankdeposit_unique_fingerprint'),
+        ),
+        migrations.AddConstraint(
+            model_name='banktransfer',
+            constraint=models.UniqueConstraint(fields=('user', 'fingerprint'), name='transactions_banktransfer_unique_fingerprint'),
+        ),
+        migrations.AddConstraint(
+            model_name='cashpowerbillpayment',
+            constraint=models.UniqueConstraint(fields=('user', 'fingerprint'), name='transactions_cashpowerbillpayment_unique_fingerprint'),
+        ),
+        migrations.AddConstraint(
+            model_name='incomingmoney',
+            constraint=models.UniqueConstraint(fields=('user', 'fingerprint'), name='transactions_incomingmoney_unique_fingerprint'),
+        ),
+        migrations.AddConstraint(
+            model_name='internetbundlepurchase',
+            constraint=models.UniqueConstraint(fields=('user', 'fingerprint'), name='transactions_internetbundlepurchase_unique_fingerprint'),
+        ),
+        migrations.AddConstraint(
+            model_name='paymenttocodeholder',
+            constraint=models.UniqueConstraint(fields=('user', 'fingerprint'), name='transactions_paymenttocodeholder_unique_fingerprint'),
+        ),
+        migrations.AddConstraint(
+            model_name='thirdpartytransaction',
+            constraint=models.UniqueConstraint(fields=('user', 'fingerprint'), name='transactions_thirdpartytransaction_unique_fingerprint'),
+        ),
+        migrations.AddConstraint(
+            model_name='transfertomobile',
+            constraint=models.UniqueConstraint(fields=('user', 'fingerprint'), name='transactions_transfertomobile_unique_fingerprint'),
+        ),
+        migrations.AddConstraint(
+            model_name='voicebundlepurchase',
+            constraint=models.UniqueConstraint(fields=('user', 'fingerprint'), name='transactions_voicebundlepurchase_unique_fingerprint'),
+        ),
+        migrations.AddConstraint(
+            model_name='withdrawalfromagent',
+            constraint=models.UniqueConstraint(fields=('user', 'fingerprint'), name='transactions_withdrawalfromagent_unique_fingerprint'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2 on 2026-10-18 14:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0006_transaction_fingerprints'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='xmlfile',
+            name='last_sms_date',
+            field=models.BigIntegerField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 4.2 on 2026-10-18 14:03
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('transactions', '0007_xmlfile_last_sms_date'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LedgerEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('incoming', 'Incoming Money'), ('payment_to_code', 'Payment to Code Holder'), ('mobile_transfer', 'Transfer to Mobile'), ('bank_deposit', 'Bank Deposit'), ('airtime_bill', 'Airtime Bill Payment'), ('cash_power_bill', 'Cash Power Bill Payment'), ('third_party', 'Third Party Transaction'), ('withdrawal', 'Withdrawal from Agent'), ('bank_transfer', 'Bank Transfer')], max_length=32)),
+                ('direction', models.CharField(choices=[('in', 'Incoming'), ('out', 'Outgoing')], max_length=3)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('fee', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('counterparty', models.CharField(blank=True, max_length=255)),
+                ('date_time', models.DateTimeField()),
+                ('source_model', models.CharField(max_length=64)),
+                ('source_id', models.BigIntegerField()),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='ledger_entries', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='ledgerentry',
+            index=models.Index(fields=['user', 'date_time'], name='transaction_user_id_7a7baf_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ledgerentry',
+            index=models.Index(fields=['user', 'kind', 'date_time'], name='transaction_user_id_677899_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='ledgerentry',
+            constraint=models.UniqueConstraint(fields=('source_model', 'source_id'), name='transactions_ledgerentry_unique_source'),
+        ),
+    ]
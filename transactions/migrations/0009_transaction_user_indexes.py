@@ -0,0 +1,65 @@
+# Generated by Django 4.2 on 2026-10-18 14:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0008_ledgerentry'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='airtimebillpayment',
+            index=models.Index(fields=['user', 'date_time'], name='transaction_user_id_d81d29_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bankdeposit',
+            index=models.Index(fields=['user', 'date_time'], name='transaction_user_id_36aa31_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='banktransfer',
+            index=models.Index(fields=['user', 'date_time'], name='transaction_user_id_3be73b_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='banktransfer',
+            index=models.Index(fields=['user', 'recipient'], name='transaction_user_id_47ba15_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cashpowerbillpayment',
+            index=models.Index(fields=['user', 'date_time'], name='transaction_user_id_9b6f2a_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='incomingmoney',
+            index=models.Index(fields=['user', 'date_time'], name='transaction_user_id_a3b69e_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='paymenttocodeholder',
+            index=models.Index(fields=['user', 'date_time'], name='transaction_user_id_fac062_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='paymenttocodeholder',
+            index=models.Index(fields=['user', 'recipient'], name='transaction_user_id_3e805a_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='thirdpartytransaction',
+            index=models.Index(fields=['user', 'date_time'], name='transaction_user_id_c65a0d_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transfertomobile',
+            index=models.Index(fields=['user', 'date_time'], name='transaction_user_id_6ea4da_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transfertomobile',
+            index=models.Index(fields=['user', 'recipient'], name='transaction_user_id_141d52_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='withdrawalfromagent',
+            index=models.Index(fields=['user', 'date_time'], name='transaction_user_id_a6eb67_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='withdrawalfromagent',
+            index=models.Index(fields=['user', 'agent_name'], name='transaction_user_id_959888_idx'),
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 4.2 on 2026-10-18 14:14
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('transactions', '0009_transaction_user_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonthlyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.DateField()),
+                ('kind', models.CharField(choices=[('incoming', 'Incoming Money'), ('payment_to_code', 'Payment to Code Holder'), ('mobile_transfer', 'Transfer to Mobile'), ('bank_deposit', 'Bank Deposit'), ('airtime_bill', 'Airtime Bill Payment'), ('cash_power_bill', 'Cash Power Bill Payment'), ('third_party', 'Third Party Transaction'), ('withdrawal', 'Withdrawal from Agent'), ('bank_transfer', 'Bank Transfer')], max_length=32)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('fee', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.DateField()),
+                ('kind', models.CharField(choices=[('incoming', 'Incoming Money'), ('payment_to_code', 'Payment to Code Holder'), ('mobile_transfer', 'Transfer to Mobile'), ('bank_deposit', 'Bank Deposit'), ('airtime_bill', 'Airtime Bill Payment'), ('cash_power_bill', 'Cash Power Bill Payment'), ('third_party', 'Third Party Transaction'), ('withdrawal', 'Withdrawal from Agent'), ('bank_transfer', 'Bank Transfer')], max_length=32)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('fee', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='monthlyrollup',
+            constraint=models.UniqueConstraint(fields=('user', 'period', 'kind'), name='transactions_monthlyrollup_unique_period'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailyrollup',
+            constraint=models.UniqueConstraint(fields=('user', 'period', 'kind'), name='transactions_dailyrollup_unique_period'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.2 on 2026-10-18 14:31
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('transactions', '0010_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DetectedAnomaly',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('detector', models.CharField(max_length=32)),
+                ('anomaly_type', models.CharField(max_length=100)),
+                ('date_time', models.DateTimeField()),
+                ('details', models.JSONField(default=dict)),
+                ('entry', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='anomalies', to='transactions.ledgerentry')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='detectedanomaly',
+            index=models.Index(fields=['user', 'detector'], name='transaction_user_id_d34ddc_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='detectedanomaly',
+            constraint=models.UniqueConstraint(fields=('detector', 'entry'), name='transactions_detectedanomaly_unique_entry'),
+        ),
+    ]
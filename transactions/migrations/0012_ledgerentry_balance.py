@@ -0,0 +1,40 @@
+# Generated by Django 4.2 on 2026-10-18 14:34
+
+from django.db import migrations, models
+
+BATCH_SIZE = 2000
+
+
+def backfill_balances(apps, schema_editor):
+    # Running balance of every existing entry, per user in (date_time, id)
+    # order, as ingestion maintains it
+    LedgerEntry = apps.get_model('transactions', 'LedgerEntry')
+    user_ids = LedgerEntry.objects.values_list('user_id', flat=True).distinct()
+    for user_id in list(user_ids):
+        balance = 0
+        updates = []
+        entries = LedgerEntry.objects.filter(user_id=user_id).order_by('date_time', 'id').values_list('id', 'amount')
+        for pk, amount in list(entries):
+            balance += amount
+            updates.append(LedgerEntry(id=pk, balance=balance))
+            if len(updates) >= BATCH_SIZE:
+                LedgerEntry.objects.bulk_update(updates, ['balance'])
+                updates = []
+        if updates:
+            LedgerEntry.objects.bulk_update(updates, ['balance'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0011_detectedanomaly'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ledgerentry',
+            name='balance',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=14, null=True),
+        ),
+        migrations.RunPython(backfill_balances, migrations.RunPython.noop),
+    ]
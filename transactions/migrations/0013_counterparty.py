@@ -0,0 +1,134 @@
+# Generated by Django 4.2 on 2026-10-18 14:46
+
+from django.conf import settings
+from django.db import DatabaseError, migrations, models, transaction
+import django.db.models.deletion
+
+BATCH_SIZE = 2000
+
+# Copies of the search index statements and sources of
+# transactions/utils/counterparties.py as of this migration, so later edits
+# there don't change what it does
+
+# Transaction models with a counterparty: (name field, number field or None)
+SOURCES = {
+    'IncomingMoney': ('sender', None),
+    'PaymentToCodeHolder': ('recipient', None),
+    'TransferToMobile': ('recipient', 'recipient_number'),
+    'ThirdPartyTransaction': ('initiated_by', None),
+    'WithdrawalFromAgent': ('agent_name', 'agent_number'),
+    'BankTransfer': ('recipient', None),
+}
+
+SQLITE_INDEX = [
+    "CREATE VIRTUAL TABLE transactions_counterparty_search USING fts5("
+    "name, number, content='transactions_counterparty', content_rowid='id', tokenize='trigram')",
+    "CREATE TRIGGER transactions_counterparty_search_insert AFTER INSERT ON transactions_counterparty BEGIN "
+    "INSERT INTO transactions_counterparty_search(rowid, name, number) VALUES (new.id, new.name, new.number); END",
+    "CREATE TRIGGER transactions_counterparty_search_delete AFTER DELETE ON transactions_counterparty BEGIN "
+    "INSERT INTO transactions_counterparty_search(transactions_counterparty_search, rowid, name, number) "
+    "VALUES ('delete', old.id, old.name, old.number); END",
+    "CREATE TRIGGER transactions_counterparty_search_update AFTER UPDATE ON transactions_counterparty BEGIN "
+    "INSERT INTO transactions_counterparty_search(transactions_counterparty_search, rowid, name, number) "
+    "VALUES ('delete', old.id, old.name, old.number); "
+    "INSERT INTO transactions_counterparty_search(rowid, name, number) VALUES (new.id, new.name, new.number); END",
+    "INSERT INTO transactions_counterparty_search(transactions_counterparty_search) VALUES ('rebuild')",
+]
+SQLITE_DROP_INDEX = [
+    "DROP TRIGGER IF EXISTS transactions_counterparty_search_insert",
+    "DROP TRIGGER IF EXISTS transactions_counterparty_search_delete",
+    "DROP TRIGGER IF EXISTS transactions_counterparty_search_update",
+    "DROP TABLE IF EXISTS transactions_counterparty_search",
+]
+POSTGRESQL_INDEX = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS transactions_counterparty_name_trgm "
+    "ON transactions_counterparty USING gin (UPPER(name) gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS transactions_counterparty_number_trgm "
+    "ON transactions_counterparty USING gin (UPPER(number) gin_trgm_ops)",
+]
+POSTGRESQL_DROP_INDEX = [
+    "DROP INDEX IF EXISTS transactions_counterparty_name_trgm",
+    "DROP INDEX IF EXISTS transactions_counterparty_number_trgm",
+]
+ANALYZE_TABLES = [
+    'transactions_incomingmoney', 'transactions_paymenttocodeholder', 'transactions_transfertomobile',
+    'transactions_thirdpartytransaction', 'transactions_withdrawalfromagent', 'transactions_banktransfer',
+    'transactions_counterparty',
+]
+
+
+def create_index(apps, schema_editor):
+    # Without the index (SQLite builds without FTS5's trigram tokenizer, or
+    # PostgreSQL databases where pg_trgm can't be created) searches fall
+    # back to icontains. Each attempt runs in a savepoint, as a failed
+    # statement aborts the whole transaction on PostgreSQL
+    statements = {'sqlite': SQLITE_INDEX, 'postgresql': POSTGRESQL_INDEX}.get(schema_editor.connection.vendor)
+    if not statements:
+        return
+    try:
+        with transaction.atomic(using=schema_editor.connection.alias), schema_editor.connection.cursor() as cursor:
+            for statement in statements:
+                cursor.execute(statement)
+    except DatabaseError:
+        drop_index(apps, schema_editor)
+
+
+def drop_index(apps, schema_editor):
+    statements = {'sqlite': SQLITE_DROP_INDEX, 'postgresql': POSTGRESQL_DROP_INDEX}
+    with schema_editor.connection.cursor() as cursor:
+        for statement in statements.get(schema_editor.connection.vendor, []):
+            cursor.execute(statement)
+
+
+def update_statistics(connection):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("PRAGMA analysis_limit=1000")
+        for table in ANALYZE_TABLES:
+            cursor.execute(f"ANALYZE {table}")
+
+
+def backfill_counterparties(apps, schema_editor):
+    # One counterparty per distinct recipient (and number) of existing rows;
+    # the search index is filled by its triggers
+    Counterparty = apps.get_model('transactions', 'Counterparty')
+    for model_name, (name_field, number_field) in SOURCES.items():
+        rows = apps.get_model('transactions', model_name).objects.all()
+        fields = ['user_id', name_field] + ([number_field] if number_field else [])
+        counterparties = [
+            Counterparty(user_id=values[0], name=values[1], number=values[2] if number_field else '')
+            for values in rows.values_list(*fields).distinct()
+        ]
+        Counterparty.objects.bulk_create(counterparties, batch_size=BATCH_SIZE, ignore_conflicts=True)
+    update_statistics(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('transactions', '0012_ledgerentry_balance'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Counterparty',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+                ('number', models.CharField(blank=True, max_length=255)),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='counterparties', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'counterparties',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='counterparty',
+            constraint=models.UniqueConstraint(fields=('user', 'name', 'number'), name='transactions_counterparty_unique_name'),
+        ),
+        migrations.RunPython(create_index, drop_index),
+        migrations.RunPython(backfill_counterparties, migrations.RunPython.noop),
+    ]
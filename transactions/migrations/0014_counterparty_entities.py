@@ -0,0 +1,278 @@
+# Generated by Django 4.2 on 2026-10-18 14:59
+
+import unicodedata
+from collections import defaultdict
+
+from django.db import DatabaseError, migrations, models, transaction
+import django.db.models.deletion
+
+BATCH_SIZE = 2000
+
+# Copies of the search index statements, sources and normalization of
+# transactions/utils/counterparties.py as of this migration, so later edits
+# there don't change what it does
+
+# Transaction models with a counterparty: (name field, number field or None)
+SOURCES = {
+    'IncomingMoney': ('sender', None),
+    'PaymentToCodeHolder': ('recipient', None),
+    'TransferToMobile': ('recipient', 'recipient_number'),
+    'ThirdPartyTransaction': ('initiated_by', None),
+    'WithdrawalFromAgent': ('agent_name', 'agent_number'),
+    'BankTransfer': ('recipient', None),
+}
+
+SQLITE_INDEX = [
+    "CREATE VIRTUAL TABLE transactions_counterparty_search USING fts5("
+    "name, number, content='transactions_counterparty', content_rowid='id', tokenize='trigram')",
+    "CREATE TRIGGER transactions_counterparty_search_insert AFTER INSERT ON transactions_counterparty BEGIN "
+    "INSERT INTO transactions_counterparty_search(rowid, name, number) VALUES (new.id, new.name, new.number); END",
+    "CREATE TRIGGER transactions_counterparty_search_delete AFTER DELETE ON transactions_counterparty BEGIN "
+    "INSERT INTO transactions_counterparty_search(transactions_counterparty_search, rowid, name, number) "
+    "VALUES ('delete', old.id, old.name, old.number); END",
+    "CREATE TRIGGER transactions_counterparty_search_update AFTER UPDATE ON transactions_counterparty BEGIN "
+    "INSERT INTO transactions_counterparty_search(transactions_counterparty_search, rowid, name, number) "
+    "VALUES ('delete', old.id, old.name, old.number); "
+    "INSERT INTO transactions_counterparty_search(rowid, name, number) VALUES (new.id, new.name, new.number); END",
+    "INSERT INTO transactions_counterparty_search(transactions_counterparty_search) VALUES ('rebuild')",
+]
+SQLITE_DROP_INDEX = [
+    "DROP TRIGGER IF EXISTS transactions_counterparty_search_insert",
+    "DROP TRIGGER IF EXISTS transactions_counterparty_search_delete",
+    "DROP TRIGGER IF EXISTS transactions_counterparty_search_update",
+    "DROP TABLE IF EXISTS transactions_counterparty_search",
+]
+POSTGRESQL_INDEX = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS transactions_counterparty_name_trgm "
+    "ON transactions_counterparty USING gin (UPPER(name) gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS transactions_counterparty_number_trgm "
+    "ON transactions_counterparty USING gin (UPPER(number) gin_trgm_ops)",
+]
+POSTGRESQL_DROP_INDEX = [
+    "DROP INDEX IF EXISTS transactions_counterparty_name_trgm",
+    "DROP INDEX IF EXISTS transactions_counterparty_number_trgm",
+]
+ANALYZE_TABLES = [
+    'transactions_incomingmoney', 'transactions_paymenttocodeholder', 'transactions_transfertomobile',
+    'transactions_thirdpartytransaction', 'transactions_withdrawalfromagent', 'transactions_banktransfer',
+    'transactions_counterparty',
+]
+
+
+def create_index(apps, schema_editor):
+    # Without the index (SQLite builds without FTS5's trigram tokenizer, or
+    # PostgreSQL databases where pg_trgm can't be created) searches fall
+    # back to icontains. In a savepoint, as a failed statement aborts the
+    # whole transaction on PostgreSQL
+    statements = {'sqlite': SQLITE_INDEX, 'postgresql': POSTGRESQL_INDEX}.get(schema_editor.connection.vendor)
+    if not statements:
+        return
+    try:
+        with transaction.atomic(using=schema_editor.connection.alias), schema_editor.connection.cursor() as cursor:
+            for statement in statements:
+                cursor.execute(statement)
+    except DatabaseError:
+        drop_index(apps, schema_editor)
+
+
+def drop_index(apps, schema_editor):
+    # SQLite remakes the counterparty table to add a column, which drops the
+    # search index triggers; the index is recreated at the end
+    statements = {'sqlite': SQLITE_DROP_INDEX, 'postgresql': POSTGRESQL_DROP_INDEX}
+    with schema_editor.connection.cursor() as cursor:
+        for statement in statements.get(schema_editor.connection.vendor, []):
+            cursor.execute(statement)
+
+
+def update_statistics(connection):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("PRAGMA analysis_limit=1000")
+        for table in ANALYZE_TABLES:
+            cursor.execute(f"ANALYZE {table}")
+
+
+def normalize_number(number):
+    # Digits only, with the 250 country code on Rwandan mobile numbers
+    digits = ''.join(c for c in number or '' if c in '0123456789')
+    if len(digits) == 10 and digits.startswith('07'):
+        return '250' + digits[1:]
+    if len(digits) == 9 and digits.startswith('7'):
+        return '250' + digits
+    return digits
+
+
+def identity(user_id, name, number):
+    # (user id, casefolded name, number) identifying a counterparty, and the
+    # name to display
+    display = ' '.join(unicodedata.normalize('NFKC', name or '').split())
+    return (user_id, display.casefold(), normalize_number(number)), display
+
+
+def normalize_counterparties(apps, schema_editor):
+    # Normalize the existing counterparties, keeping the first of those that
+    # become the same. No transaction row points at them yet
+    Counterparty = apps.get_model('transactions', 'Counterparty')
+    seen = set()
+    duplicates = []
+    counterparties = []
+    for counterparty in Counterparty.objects.order_by('id').iterator(chunk_size=BATCH_SIZE):
+        key, display = identity(counterparty.user_id, counterparty.name, counterparty.number)
+        if key in seen:
+            duplicates.append(counterparty.id)
+            continue
+        seen.add(key)
+        counterparty.name = display
+        counterparty.normalized_name = key[1]
+        counterparty.number = key[2]
+        counterparties.append(counterparty)
+    for start in range(0, len(duplicates), BATCH_SIZE):
+        Counterparty.objects.filter(id__in=duplicates[start:start + BATCH_SIZE]).delete()
+    Counterparty.objects.bulk_update(counterparties, ['name', 'normalized_name', 'number'], batch_size=BATCH_SIZE)
+
+
+def resolve(Counterparty, ids, keys):
+    # Fill ``ids`` with the counterparty id of each (key, display name),
+    # creating the counterparties missing
+    missing = {}
+    for key, display in keys:
+        if key not in ids:
+            missing.setdefault(key, display)
+    if not missing:
+        return
+    Counterparty.objects.bulk_create(
+        [Counterparty(user_id=user_id, name=display, normalized_name=normalized_name, number=number)
+         for (user_id, normalized_name, number), display in missing.items()],
+        ignore_conflicts=True,
+    )
+    stored = Counterparty.objects.filter(
+        user_id__in={key[0] for key in missing}, normalized_name__in={key[1] for key in missing},
+    ).values_list('user_id', 'normalized_name', 'number', 'id')
+    for user_id, normalized_name, number, pk in stored:
+        if (user_id, normalized_name, number) in missing:
+            ids[(user_id, normalized_name, number)] = pk
+
+
+def link_transactions(apps, schema_editor):
+    # Point every transaction row with a user at its counterparty, in batches
+    # by id, with one UPDATE per counterparty of a batch
+    Counterparty = apps.get_model('transactions', 'Counterparty')
+    ids = {}
+    for model_name, (name_field, number_field) in SOURCES.items():
+        model = apps.get_model('transactions', model_name)
+        rows = model.objects.filter(counterparty__isnull=True, user__isnull=False)
+        fields = ['id', 'user_id', name_field] + ([number_field] if number_field else [])
+        last_id = 0
+        while True:
+            batch = list(rows.filter(id__gt=last_id).order_by('id').values_list(*fields)[:BATCH_SIZE])
+            if not batch:
+                break
+            last_id = batch[-1][0]
+            keys = [identity(row[1], row[2], row[3] if number_field else '') for row in batch]
+            resolve(Counterparty, ids, keys)
+            by_counterparty = defaultdict(list)
+            for row, (key, _) in zip(batch, keys):
+                by_counterparty[ids[key]].append(row[0])
+            for pk, row_ids in by_counterparty.items():
+                model.objects.filter(id__in=row_ids).update(counterparty_id=pk)
+    update_statistics(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0013_counterparty'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_index, create_index),
+        migrations.RemoveConstraint(
+            model_name='counterparty',
+            name='transactions_counterparty_unique_name',
+        ),
+        migrations.RemoveIndex(
+            model_name='banktransfer',
+            name='transaction_user_id_47ba15_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='paymenttocodeholder',
+            name='transaction_user_id_3e805a_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='transfertomobile',
+            name='transaction_user_id_141d52_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='withdrawalfromagent',
+            name='transaction_user_id_959888_idx',
+        ),
+        migrations.AddField(
+            model_name='banktransfer',
+            name='counterparty',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='transactions.counterparty'),
+        ),
+        migrations.AddField(
+            model_name='counterparty',
+            name='normalized_name',
+            field=models.CharField(default='', editable=False, max_length=255),
+            preserve_default=False,
+        ),
+        migrations.RunPython(normalize_counterparties, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='counterparty',
+            constraint=models.UniqueConstraint(fields=('user', 'normalized_name', 'number'), name='transactions_counterparty_unique_identity'),
+        ),
+        migrations.AddField(
+            model_name='incomingmoney',
+            name='counterparty',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='transactions.counterparty'),
+        ),
+        migrations.AddField(
+            model_name='paymenttocodeholder',
+            name='counterparty',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='transactions.counterparty'),
+        ),
+        migrations.AddField(
+            model_name='thirdpartytransaction',
+            name='counterparty',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='transactions.counterparty'),
+        ),
+        migrations.AddField(
+            model_name='transfertomobile',
+            name='counterparty',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='transactions.counterparty'),
+        ),
+        migrations.AddField(
+            model_name='withdrawalfromagent',
+            name='counterparty',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='transactions.counterparty'),
+        ),
+        migrations.AddIndex(
+            model_name='banktransfer',
+            index=models.Index(fields=['user', 'counterparty'], name='transaction_user_id_31037d_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='incomingmoney',
+            index=models.Index(fields=['user', 'counterparty'], name='transaction_user_id_9b621c_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='paymenttocodeholder',
+            index=models.Index(fields=['user', 'counterparty'], name='transaction_user_id_88b18d_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='thirdpartytransaction',
+            index=models.Index(fields=['user', 'counterparty'], name='transaction_user_id_e2b2eb_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transfertomobile',
+            index=models.Index(fields=['user', 'counterparty'], name='transaction_user_id_bc4b5a_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='withdrawalfromagent',
+            index=models.Index(fields=['user', 'counterparty'], name='transaction_user_id_6874eb_idx'),
+        ),
+        migrations.RunPython(link_transactions, migrations.RunPython.noop),
+        migrations.RunPython(create_index, drop_index),
+    ]
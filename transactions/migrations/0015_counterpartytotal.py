@@ -0,0 +1,62 @@
+# Generated by Django 4.2 on 2026-10-18 15:03
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+BATCH_SIZE = 2000
+
+# Kind of the transactions of each model with a counterparty, as in
+# transactions/utils/counterparty_totals.py at the time of this migration
+KINDS = {
+    'IncomingMoney': 'incoming',
+    'PaymentToCodeHolder': 'payment_to_code',
+    'TransferToMobile': 'mobile_transfer',
+    'ThirdPartyTransaction': 'third_party',
+    'WithdrawalFromAgent': 'withdrawal',
+    'BankTransfer': 'bank_transfer',
+}
+
+
+def backfill_totals(apps, schema_editor):
+    CounterpartyTotal = apps.get_model('transactions', 'CounterpartyTotal')
+    for model_name, kind in KINDS.items():
+        rows = apps.get_model('transactions', model_name).objects.filter(counterparty__isnull=False)
+        grouped = rows.values('user_id', 'counterparty_id').annotate(
+            count=models.Count('id'), amount=models.Sum('amount')
+        ).order_by()
+        CounterpartyTotal.objects.bulk_create(
+            [CounterpartyTotal(kind=kind, **row) for row in grouped],
+            batch_size=BATCH_SIZE,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('transactions', '0014_counterparty_entities'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CounterpartyTotal',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('incoming', 'Incoming Money'), ('payment_to_code', 'Payment to Code Holder'), ('mobile_transfer', 'Transfer to Mobile'), ('bank_deposit', 'Bank Deposit'), ('airtime_bill', 'Airtime Bill Payment'), ('cash_power_bill', 'Cash Power Bill Payment'), ('third_party', 'Third Party Transaction'), ('withdrawal', 'Withdrawal from Agent'), ('bank_transfer', 'Bank Transfer')], max_length=32)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('counterparty', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='totals', to='transactions.counterparty')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='counterpartytotal',
+            index=models.Index(fields=['user', 'kind', '-amount'], name='transaction_user_id_66e5cd_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='counterpartytotal',
+            constraint=models.UniqueConstraint(fields=('counterparty', 'kind'), name='transactions_counterpartytotal_unique_kind'),
+        ),
+        migrations.RunPython(backfill_totals, migrations.RunPython.noop),
+    ]
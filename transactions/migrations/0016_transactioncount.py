@@ -0,0 +1,46 @@
+# Generated by Django 4.2 on 2026-10-18 15:05
+
+from django.db import migrations, models
+
+# Model of each transaction kind, as in transactions/utils/process_data.py at
+# the time of this migration
+TRANSACTION_MODELS = {
+    'incoming': 'IncomingMoney',
+    'payment_to_code': 'PaymentToCodeHolder',
+    'mobile_transfer': 'TransferToMobile',
+    'bank_deposit': 'BankDeposit',
+    'airtime_bill': 'AirtimeBillPayment',
+    'cash_power_bill': 'CashPowerBillPayment',
+    'third_party': 'ThirdPartyTransaction',
+    'withdrawal': 'WithdrawalFromAgent',
+    'bank_transfer': 'BankTransfer',
+    'internet_bundle': 'InternetBundlePurchase',
+    'voice_bundle': 'VoiceBundlePurchase',
+}
+
+
+def count_transactions(apps, schema_editor):
+    TransactionCount = apps.get_model('transactions', 'TransactionCount')
+    TransactionCount.objects.bulk_create([
+        TransactionCount(kind=kind, count=apps.get_model('transactions', model_name).objects.count())
+        for kind, model_name in TRANSACTION_MODELS.items()
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0015_counterpartytotal'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TransactionCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=32, unique=True)),
+                ('count', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(count_transactions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2 on 2026-10-18 15:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0016_transactioncount'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingestionjob',
+            name='report',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
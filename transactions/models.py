@@ -1,20 +1,42 @@
 from django.db import models
 from django.conf import settings
 
+from .utils import sms_parser
+
 class XMLFile(models.Model):
     file = models.FileField(upload_to='xml_files/')
     uploaded_at = models.DateTimeField(auto_now_add=True)
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True, related_name='xml_files')
+    # Latest SMS ``date`` attribute (milliseconds since the epoch) ingested
+    # from this file; the user's watermark is the maximum over their files
+    last_sms_date = models.BigIntegerField(null=True, blank=True, editable=False)
 
     def __str__(self):
         return f"XML file uploaded by {self.user} on {self.uploaded_at}"
 
+    @classmethod
+    def watermark_for(cls, user):
+        return cls.objects.filter(user=user).aggregate(models.Max('last_sms_date'))['last_sms_date__max']
+
 class IncomingMoney(models.Model):
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     sender = models.CharField(max_length=255)
+    # Normalized counterparty, resolved at ingestion (see ``transactions.utils.counterparties``)
+    counterparty = models.ForeignKey('Counterparty', on_delete=models.SET_NULL, null=True, blank=True, db_index=False, related_name='+')
     date_time = models.DateTimeField()
     transaction_id = models.CharField(max_length=255)
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True, related_name='incoming_money')
+    # Content hash used to skip transactions already stored for the user
+    fingerprint = models.CharField(max_length=40, null=True, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'date_time']),
+            models.Index(fields=['user', 'counterparty']),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'fingerprint'], name='%(app_label)s_%(class)s_unique_fingerprint'),
+        ]
 
     def __str__(self):
         return f"{self.amount} from {self.sender} on {self.date_time}"
@@ -23,8 +45,19 @@ class PaymentToCodeHolder(models.Model):
     transaction_id = models.CharField(max_length=255)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     recipient = models.CharField(max_length=255)
+    counterparty = models.ForeignKey('Counterparty', on_delete=models.SET_NULL, null=True, blank=True, db_index=False, related_name='+')
     date_time = models.DateTimeField()
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True, related_name='payments_to_code_holder')
+    fingerprint = models.CharField(max_length=40, null=True, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'date_time']),
+            models.Index(fields=['user', 'counterparty']),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'fingerprint'], name='%(app_label)s_%(class)s_unique_fingerprint'),
+        ]
 
     def __str__(self):
         return f"{self.amount} to {self.recipient} on {self.date_time}"
@@ -33,9 +66,20 @@ class TransferToMobile(models.Model):
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     recipient = models.CharField(max_length=255)
     recipient_number = models.CharField(max_length=255)
+    counterparty = models.ForeignKey('Counterparty', on_delete=models.SET_NULL, null=True, blank=True, db_index=False, related_name='+')
     date_time = models.DateTimeField()
     fee = models.DecimalField(max_digits=10, decimal_places=2)
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True, related_name='transfers_to_mobile')
+    fingerprint = models.CharField(max_length=40, null=True, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'date_time']),
+            models.Index(fields=['user', 'counterparty']),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'fingerprint'], name='%(app_label)s_%(class)s_unique_fingerprint'),
+        ]
 
     def __str__(self):
         return f"{self.amount} to {self.recipient} ({self.recipient_number}) on {self.date_time}"
@@ -44,6 +88,15 @@ class BankDeposit(models.Model):
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     date_time = models.DateTimeField()
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True, related_name='bank_deposits')
+    fingerprint = models.CharField(max_length=40, null=True, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'date_time']),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'fingerprint'], name='%(app_label)s_%(class)s_unique_fingerprint'),
+        ]
 
     def __str__(self):
         return f"{self.amount} on {self.date_time}"
@@ -54,6 +107,15 @@ class AirtimeBillPayment(models.Model):
     date_time = models.DateTimeField()
     fee = models.DecimalField(max_digits=10, decimal_places=2)
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True, related_name='airtime_bill_payments')
+    fingerprint = models.CharField(max_length=40, null=True, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'date_time']),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'fingerprint'], name='%(app_label)s_%(class)s_unique_fingerprint'),
+        ]
 
     def __str__(self):
         return f"Airtime: {self.amount} on {self.date_time}"
@@ -64,6 +126,15 @@ class CashPowerBillPayment(models.Model):
     date_time = models.DateTimeField()
     fee = models.DecimalField(max_digits=10, decimal_places=2)
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True, related_name='cash_power_bill_payments')
+    fingerprint = models.CharField(max_length=40, null=True, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'date_time']),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'fingerprint'], name='%(app_label)s_%(class)s_unique_fingerprint'),
+        ]
 
     def __str__(self):
         return f"Cash Power: {self.amount} on {self.date_time}"
@@ -71,9 +142,20 @@ class CashPowerBillPayment(models.Model):
 class ThirdPartyTransaction(models.Model):
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     initiated_by = models.CharField(max_length=255)
+    counterparty = models.ForeignKey('Counterparty', on_delete=models.SET_NULL, null=True, blank=True, db_index=False, related_name='+')
     date_time = models.DateTimeField()
     transaction_id = models.CharField(max_length=255)
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True, related_name='third_party_transactions')
+    fingerprint = models.CharField(max_length=40, null=True, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'date_time']),
+            models.Index(fields=['user', 'counterparty']),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'fingerprint'], name='%(app_label)s_%(class)s_unique_fingerprint'),
+        ]
 
     def __str__(self):
         return f"{self.amount} initiated by {self.initiated_by} on {self.date_time}"
@@ -82,9 +164,20 @@ class WithdrawalFromAgent(models.Model):
     user_name = models.CharField(max_length=255)
     agent_name = models.CharField(max_length=255)
     agent_number = models.CharField(max_length=255)
+    counterparty = models.ForeignKey('Counterparty', on_delete=models.SET_NULL, null=True, blank=True, db_index=False, related_name='+')
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     date_time = models.DateTimeField()
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True, related_name='withdrawals_from_agent')
+    fingerprint = models.CharField(max_length=40, null=True, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'date_time']),
+            models.Index(fields=['user', 'counterparty']),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'fingerprint'], name='%(app_label)s_%(class)s_unique_fingerprint'),
+        ]
 
     def __str__(self):
         return f"{self.amount} from {self.agent_name} on {self.date_time}"
@@ -92,8 +185,19 @@ class WithdrawalFromAgent(models.Model):
 class BankTransfer(models.Model):
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     recipient = models.CharField(max_length=255)
+    counterparty = models.ForeignKey('Counterparty', on_delete=models.SET_NULL, null=True, blank=True, db_index=False, related_name='+')
     date_time = models.DateTimeField()
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True, related_name='bank_transfers')
+    fingerprint = models.CharField(max_length=40, null=True, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'date_time']),
+            models.Index(fields=['user', 'counterparty']),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'fingerprint'], name='%(app_label)s_%(class)s_unique_fingerprint'),
+        ]
 
     def __str__(self):
         return f"{self.amount} to {self.recipient} on {self.date_time}"
@@ -104,6 +208,12 @@ class InternetBundlePurchase(models.Model):
     unit = models.CharField(max_length=10)
     duration = models.CharField(max_length=255, null=True, blank=True)
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True, related_name='internet_bundle_purchases')
+    fingerprint = models.CharField(max_length=40, null=True, blank=True, editable=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'fingerprint'], name='%(app_label)s_%(class)s_unique_fingerprint'),
+        ]
 
     def __str__(self):
         return f"{self.bundle_size}{self.unit} for {self.amount}"
@@ -113,6 +223,12 @@ class VoiceBundlePurchase(models.Model):
     minutes = models.CharField(max_length=255)
     smses = models.CharField(max_length=255)
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True, related_name='voice_bundle_purchases')
+    fingerprint = models.CharField(max_length=40, null=True, blank=True, editable=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'fingerprint'], name='%(app_label)s_%(class)s_unique_fingerprint'),
+        ]
 
     def __str__(self):
         return f"{self.minutes} minutes + {self.smses} SMS for {self.amount}"
@@ -125,3 +241,221 @@ class FailedSMSLog(models.Model):
 
     def __str__(self):
         return f"Failed SMS for {self.user} at {self.processed_at}: {self.sms_body[:50]}..."
+
+class LedgerEntry(models.Model):
+    # One row per dated transaction across all transaction models, so
+    # aggregate views can read a single indexed table. Rows are written at
+    # ingestion time and can be rebuilt with ``manage.py rebuild_ledger``.
+    KIND_CHOICES = [
+        (sms_parser.INCOMING, 'Incoming Money'),
+        (sms_parser.PAYMENT_TO_CODE, 'Payment to Code Holder'),
+        (sms_parser.MOBILE_TRANSFER, 'Transfer to Mobile'),
+        (sms_parser.BANK_DEPOSIT, 'Bank Deposit'),
+        (sms_parser.AIRTIME_BILL, 'Airtime Bill Payment'),
+        (sms_parser.CASH_POWER_BILL, 'Cash Power Bill Payment'),
+        (sms_parser.THIRD_PARTY, 'Third Party Transaction'),
+        (sms_parser.WITHDRAWAL, 'Withdrawal from Agent'),
+        (sms_parser.BANK_TRANSFER, 'Bank Transfer'),
+    ]
+    KIND_LABELS = dict(KIND_CHOICES)
+    DIRECTION_IN = 'in'
+    DIRECTION_OUT = 'out'
+    DIRECTION_CHOICES = [
+        (DIRECTION_IN, 'Incoming'),
+        (DIRECTION_OUT, 'Outgoing'),
+    ]
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True, related_name='ledger_entries')
+    kind = models.CharField(max_length=32, choices=KIND_CHOICES)
+    direction = models.CharField(max_length=3, choices=DIRECTION_CHOICES)
+    # Negative for money leaving the account
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
+    fee = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    counterparty = models.CharField(max_length=255, blank=True)
+    date_time = models.DateTimeField()
+    # Row of the transaction model this entry was derived from
+    source_model = models.CharField(max_length=64)
+    source_id = models.BigIntegerField()
+    # Running sum of the user's amounts up to and including this entry, in
+    # (date_time, id) order; None until ``ledger.update_balances`` fills it
+    balance = models.DecimalField(max_digits=14, decimal_places=2, null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'date_time']),
+            models.Index(fields=['user', 'kind', 'date_time']),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['source_model', 'source_id'], name='transactions_ledgerentry_unique_source'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()}: {self.amount} on {self.date_time}"
+
+
+class Counterparty(models.Model):
+    # A person, agent or merchant the user exchanges money with, identified
+    # by their normalized name and phone number. Transaction rows point at
+    # it (resolved at ingestion), so per-counterparty GROUP BYs are keyed by
+    # an integer, and the receiver history is searched through a trigram
+    # index on it instead of LIKE scans over the transaction tables. See
+    # ``transactions.utils.counterparties``.
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True, related_name='counterparties')
+    # Name as first seen, with whitespace collapsed
+    name = models.CharField(max_length=255)
+    # Case-folded ``name``: spellings differing only in case or spacing are
+    # the same counterparty
+    normalized_name = models.CharField(max_length=255, editable=False)
+    # Digits only, in international form for Rwandan mobile numbers
+    number = models.CharField(max_length=255, blank=True)
+
+    class Meta:
+        verbose_name_plural = 'counterparties'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'normalized_name', 'number'], name='transactions_counterparty_unique_identity'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.number})" if self.number else self.name
+
+
+class CounterpartyTotal(models.Model):
+    # Per-user count and sum of the transactions of one kind with a
+    # counterparty, kept up to date at ingestion time so the top-N lists
+    # read a few rows of a small table instead of grouping the history.
+    # Check against the transaction rows with
+    # ``manage.py check_counterparty_totals``.
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    counterparty = models.ForeignKey(Counterparty, on_delete=models.CASCADE, related_name='totals')
+    kind = models.CharField(max_length=32, choices=LedgerEntry.KIND_CHOICES)
+    count = models.PositiveIntegerField(default=0)
+    # Sum of the transaction amounts, unsigned
+    amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'kind', '-amount']),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['counterparty', 'kind'], name='transactions_counterpartytotal_unique_kind'),
+        ]
+
+    def __str__(self):
+        return f"{self.counterparty} ({self.get_kind_display()}): {self.count} for {self.amount}"
+
+
+class TransactionCount(models.Model):
+    # Number of stored transactions of one kind across all users, kept up
+    # to date at ingestion time so the landing page reads a handful of rows
+    # instead of counting every table. Recount with
+    # ``manage.py rebuild_transaction_counts``.
+    kind = models.CharField(max_length=32, unique=True)
+    count = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.kind}: {self.count}"
+
+
+class Rollup(models.Model):
+    # Per-user totals of ledger entries of one kind over a period, kept up to
+    # date at ingestion time so aggregate views don't scan the ledger.
+    # Periods are calendar days/months in the TIME_ZONE setting; rebuild
+    # with ``manage.py rebuild_rollups`` after changing it.
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    # First day of the period
+    period = models.DateField()
+    kind = models.CharField(max_length=32, choices=LedgerEntry.KIND_CHOICES)
+    count = models.PositiveIntegerField(default=0)
+    # Sum of the signed ledger amounts and of the fees
+    amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    fee = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        abstract = True
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'period', 'kind'], name='%(app_label)s_%(class)s_unique_period'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} {self.period}: {self.count} for {self.amount}"
+
+class DailyRollup(Rollup):
+    pass
+
+class MonthlyRollup(Rollup):
+    pass
+
+class DetectedAnomaly(models.Model):
+    # A ledger entry flagged by one of the anomaly detectors in
+    # ``transactions.utils.detectors``. Detectors run over the user's ledger
+    # after each upload and their results are stored here, so the analysis
+    # page reads them instead of rescanning the history. Recompute with
+    # ``manage.py detect_anomalies``.
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    detector = models.CharField(max_length=32)
+    entry = models.ForeignKey(LedgerEntry, on_delete=models.CASCADE, related_name='anomalies')
+    anomaly_type = models.CharField(max_length=100)
+    date_time = models.DateTimeField()
+    # Detector-specific values explaining the flag (thresholds, scores, ...)
+    details = models.JSONField(default=dict)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'detector']),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['detector', 'entry'], name='transactions_detectedanomaly_unique_entry'),
+        ]
+
+    def __str__(self):
+        return f"{self.anomaly_type} on {self.date_time}"
+
+class IngestionJob(models.Model):
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_SUCCEEDED = 'succeeded'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'Queued'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_SUCCEEDED, 'Succeeded'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    xml_file = models.ForeignKey(XMLFile, on_delete=models.CASCADE, related_name='ingestion_jobs')
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True, related_name='ingestion_jobs')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    total_bytes = models.PositiveBigIntegerField(default=0)
+    message_count = models.PositiveIntegerField(default=0)
+    transaction_count = models.PositiveIntegerField(default=0)
+    failed_count = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    # Times the job was claimed by a worker, including retries after a
+    # worker stopped mid-run
+    attempts = models.PositiveSmallIntegerField(default=0)
+    # Refreshed by the worker while it runs the job; a running job whose
+    # heartbeat has lapsed was abandoned by a worker that stopped
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    # Timings and counts of the run (see ``transactions.utils.ingestion_report``)
+    report = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+        ]
+
+    @property
+    def is_finished(self):
+        return self.status in (self.STATUS_SUCCEEDED, self.STATUS_FAILED)
+
+    @property
+    def duration(self):
+        if self.started_at and self.finished_at:
+            return self.finished_at - self.started_at
+        return None
+
+    def __str__(self):
+        return f"Ingestion of {self.xml_file} ({self.status})"
@@ -1,11 +1,84 @@
-from django.test import TestCase, Client
+import importlib
+import io
+import math
+import shutil
+import tempfile
+import tracemalloc
+from unittest import mock, skipUnless
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from xml.sax.saxutils import quoteattr
+
+import numpy as np
+
+from django.apps import apps as django_apps
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, connection
+from django.db.models import Count, Q, Sum
+from django.http import HttpResponse
+from django.test import TestCase, Client, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils import timezone
+from users.models import CustomUser
 from .models import (
     IncomingMoney, PaymentToCodeHolder, TransferToMobile, BankDeposit,
     AirtimeBillPayment, CashPowerBillPayment, ThirdPartyTransaction,
-    WithdrawalFromAgent, BankTransfer, InternetBundlePurchase, VoiceBundlePurchase
+    WithdrawalFromAgent, BankTransfer, InternetBundlePurchase, VoiceBundlePurchase,
+    FailedSMSLog, IngestionJob, LedgerEntry, DailyRollup, MonthlyRollup, XMLFile, DetectedAnomaly,
+    Counterparty, CounterpartyTotal,
 )
+from .utils import (
+    anomalies, balance_series, counterparties, counterparty_totals, dedup, detectors, parallel_ingest, process_data,
+    receiver_history, request_metrics, result_cache, rollups, sms_parser, transaction_counts,
+)
+from .middleware import RequestMetricsMiddleware
+from .utils.ingestion_jobs import recover_stale_jobs, run_pending_jobs
+from .utils.process_data import iter_sms, parse_xml, process_xml_file
+from .views import AnalysisView, DashboardView
+
+# One message per category handled by the parser, plus messages that fail
+# extraction, system notifications and unrelated SMS
+SAMPLE_BODIES = [
+    "*143*R*You have been successfully registered for MTN Mobile Money.",
+    "You have received 5000 RWF from Jane Smith (*********013) on your mobile money account at 2024-05-10 16:30:51. Message from sender: . Your new balance:15000 RWF. Financial Transaction Id: 76662021700.",
+    "You have received 2000 RWF from Alex Doe (*********013) on your mobile money account. Financial Transaction Id: 76662021701.",
+    "TxId: 73214484437. Your payment of 1,000 RWF to Jane Smith 12845 has been completed at 2024-05-10 21:32:32. Your new balance: 1,000 RWF. Fee was 0 RWF.",
+    "TxId: 73214484438. Your payment has been completed at 2024-05-10 21:40:00.",
+    "*165*S*10000 RWF transferred to Samuel Carter (250791666666) from 36521838 at 2024-05-11 20:34:47 . Fee was: 100 RWF. New balance: 28300 RWF.",
+    "*113*R*A bank deposit of 40000 RWF has been added to your mobile money account at 2024-05-11 18:43:49. Your NEW BALANCE :40400 RWF.",
+    "*162*TxId:13913173274*S*Your payment of 2000 RWF to Airtime with token  has been completed at 2024-05-12 11:41:28. Fee was 0 RWF. Your new balance: 25280 RWF . *EN#",
+    "*162*TxId:13913173275*S*Your payment of 5000 RWF to MTN Cash Power with token 12345-67890 has been completed at 2024-05-13 09:00:00. Fee was 20 RWF. Your new balance: 20260 RWF . *EN#",
+    "*162*TxId:13913173276*S*Your payment of 700 RWF to Water with token  has been completed at 2024-05-13 09:30:00. Fee was 0 RWF.",
+    "*164*S*Y'ello,A transaction of 3500 RWF by DIRECT PAYMENT LTD on your MOMO account was successfully completed at 2024-05-14 10:12:13. Message from debit receiver: . Your new balance:21780 RWF. Fee was 0 RWF. Financial Transaction Id: 14098463509.*EN#",
+    "You Jane Smith (*********036) have via agent: Agent Sophia (250790777777), withdrawn 20000 RWF from your mobile money account: 36521838 at 2024-05-26 02:10:27 and you can now collect your money in cash. Your new balance: 6400 RWF. Fee paid: 350 RWF. Financial Transaction Id: 14106846245.",
+    "You have transferred 30000 RWF to Jane Smith (250790777777) from your mobile money account 36521838 imbank.bank at 2024-06-01 10:00:00. Your new balance: 100 RWF.",
+    "Yello!Umaze kugura 2,000FRW(1GB) igura 2,000 RWF, ikazarangira 2024-06-09",
+    "Yello!Umaze kugura 1,000Frw=30Mins+20SMS, bimara iminsi 7.",
+    "Y'ello! Kanda *345# ugure ama pack ya interineti ku giciro gito.",
+]
+
+
+def get_widget(client, page, name):
+    # Columnar payload of one widget of the dashboard or analysis page
+    response = client.get(reverse(f'{page}_widget', args=[name]))
+    assert response.status_code == 200, response.status_code
+    return response.json()
+
+
+def build_backup(bodies, start_date=1700000000000):
+    # Wrap SMS bodies in the "SMS Backup & Restore" XML layout users upload
+    sms = "".join(
+        f'<sms date="{start_date + i}" body={quoteattr(body)} />' for i, body in enumerate(bodies)
+    )
+    return io.BytesIO(f"<smses count=\"{len(bodies)}\">{sms}</smses>".encode())
+
+
+def utc(*args):
+    return datetime(*args, tzinfo=dt_timezone.utc)
 
 class ModelTestCase(TestCase):
     def setUp(self):
@@ -159,4 +232,1357 @@ class ViewTestCase(TestCase):
     def test_analysis_view(self):
         response = self.client.get(reverse('analysis'))
         self.assertEqual(response.status_code, 200)
-        self.assertTemplateUsed(response, 'transactions/analysis.html')
\ No newline at end of file
+        self.assertTemplateUsed(response, 'transactions/analysis.html')
+
+class IterSMSTestCase(TestCase):
+    xml = (
+        b"<?xml version='1.0' encoding='UTF-8' standalone='yes' ?>"
+        b'<smses count="3">'
+        b'<sms date="1" body="first" />'
+        b'<mms date="2"><parts><part text="ignored" /></parts></mms>'
+        b'<sms date="3" body="second" />'
+        b'<sms date="4" body="third" />'
+        b'</smses>'
+    )
+
+    def test_yields_same_messages_as_parse_xml(self):
+        streamed = [sms.attrib.get("body") for sms in iter_sms(io.BytesIO(self.xml))]
+        parsed = [sms.attrib.get("body") for sms in parse_xml(io.BytesIO(self.xml))]
+        self.assertEqual(streamed, ["first", "second", "third"])
+        self.assertEqual(streamed, parsed)
+
+    def test_clears_elements_after_use(self):
+        seen = []
+        for sms in iter_sms(io.BytesIO(self.xml)):
+            seen.append(sms)
+        self.assertTrue(all(not sms.attrib for sms in seen))
+
+class ProcessXMLFileTestCase(TestCase):
+    # Rows produced by the original one-INSERT-per-message implementation
+    expected_rows = {
+        IncomingMoney: [
+            {'amount': Decimal('5000'), 'sender': 'Jane Smith', 'date_time': utc(2024, 5, 10, 16, 30, 51),
+             'transaction_id': '76662021700'},
+        ],
+        PaymentToCodeHolder: [
+            {'transaction_id': '73214484437', 'amount': Decimal('1000'), 'recipient': 'Jane Smith',
+             'date_time': utc(2024, 5, 10, 21, 32, 32)},
+        ],
+        TransferToMobile: [
+            {'amount': Decimal('10000'), 'recipient': 'Samuel Carter', 'recipient_number': '250791666666',
+             'date_time': utc(2024, 5, 11, 20, 34, 47), 'fee': Decimal('100')},
+        ],
+        BankDeposit: [
+            {'amount': Decimal('40000'), 'date_time': utc(2024, 5, 11, 18, 43, 49)},
+        ],
+        AirtimeBillPayment: [
+            {'transaction_id': '13913173274', 'amount': Decimal('2000'), 'date_time': utc(2024, 5, 12, 11, 41, 28),
+             'fee': Decimal('0')},
+        ],
+        CashPowerBillPayment: [
+            {'transaction_id': '13913173275', 'amount': Decimal('5000'), 'date_time': utc(2024, 5, 13, 9, 0, 0),
+             'fee': Decimal('20')},
+        ],
+        ThirdPartyTransaction: [
+            {'amount': Decimal('3500'), 'initiated_by': 'DIRECT PAYMENT LTD', 'date_time': utc(2024, 5, 14, 10, 12, 13),
+             'transaction_id': '14098463509'},
+        ],
+        WithdrawalFromAgent: [
+            {'user_name': 'Jane Smith', 'agent_name': 'Agent Sophia', 'agent_number': '250790777777',
+             'amount': Decimal('20000'), 'date_time': utc(2024, 5, 26, 2, 10, 27)},
+        ],
+        BankTransfer: [
+            {'amount': Decimal('30000'), 'recipient': 'Jane Smith (250790777777)', 'date_time': utc(2024, 6, 1, 10, 0, 0)},
+        ],
+        InternetBundlePurchase: [
+            {'amount': Decimal('2000'), 'bundle_size': '1', 'unit': 'GB', 'duration': None},
+        ],
+        VoiceBundlePurchase: [
+            {'amount': Decimal('1000'), 'minutes': '30', 'smses': '20'},
+        ],
+        FailedSMSLog: [
+            {'sms_body': SAMPLE_BODIES[4],
+             'reason': 'Missing data for Payment to Code Holder (TxId, amount, recipient, or date)'},
+            {'sms_body': SAMPLE_BODIES[9],
+             'reason': 'Missing data for Bill Purchase (TxId, amount, bill type, date, or fee)'},
+        ],
+    }
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email='ingest@example.com', password='secret')
+
+    def assertRowsEqual(self, expected_rows):
+        for model, expected in expected_rows.items():
+            fields = list(expected[0]) if expected else ['id']
+            rows = list(model.objects.filter(user=self.user).order_by('id').values(*fields))
+            self.assertEqual(rows, expected, model.__name__)
+
+    def test_produces_same_rows_as_per_message_inserts(self):
+        process_xml_file(build_backup(SAMPLE_BODIES), self.user)
+        self.assertRowsEqual(self.expected_rows)
+
+    def test_extract_transaction_data_reports_what_it_stored(self):
+        stats = process_data.extract_transaction_data(parse_xml(build_backup(SAMPLE_BODIES)), self.user)
+        self.assertEqual((stats['messages'], stats['transactions'], stats['failed']), (len(SAMPLE_BODIES), 11, 3))
+        self.assertRowsEqual(self.expected_rows)
+
+    def repeated_rows(self, times):
+        # Repeated messages are deduplicated, except bundles (whose fingerprint
+        # includes the SMS date) and failure logs, which are not fingerprinted
+        repeated = (InternetBundlePurchase, VoiceBundlePurchase, FailedSMSLog)
+        return {
+            model: rows * times if model in repeated else rows
+            for model, rows in self.expected_rows.items()
+        }
+
+    def test_batch_size_does_not_change_rows(self):
+        process_xml_file(build_backup(SAMPLE_BODIES * 3), self.user, batch_size=2)
+        self.assertRowsEqual(self.repeated_rows(3))
+
+    def test_upload_is_written_in_one_transaction(self):
+        broken = build_backup(SAMPLE_BODIES)
+        broken.seek(0, io.SEEK_END)
+        broken.truncate(broken.tell() - len(b"</smses>"))
+        broken.seek(0)
+        with self.assertRaises(Exception):
+            process_xml_file(broken, self.user, batch_size=1)
+        self.assertFalse(IncomingMoney.objects.filter(user=self.user).exists())
+
+    def test_upload_locks_the_user_before_reading_the_watermark(self):
+        with CaptureQueriesContext(connection) as queries, \
+                mock.patch.object(process_data, 'lock_user', wraps=process_data.lock_user) as lock_user:
+            process_xml_file(build_backup(SAMPLE_BODIES), self.user, incremental=True)
+        lock_user.assert_called_once_with(self.user)
+        sql = [query['sql'] for query in queries.captured_queries]
+        user_table = CustomUser._meta.db_table
+        first_lock = next(i for i, query in enumerate(sql) if f'FROM "{user_table}"' in query)
+        first_watermark = next(i for i, query in enumerate(sql) if f'FROM "{XMLFile._meta.db_table}"' in query)
+        self.assertLess(first_lock, first_watermark)
+        if connection.features.has_select_for_update:
+            self.assertIn('FOR UPDATE', sql[first_lock])
+
+    @override_settings(INGESTION_CHUNK_BYTES=512)
+    def test_process_pool_matches_single_process(self):
+        process_xml_file(build_backup(SAMPLE_BODIES * 3), self.user, workers=2)
+        self.assertRowsEqual(self.repeated_rows(3))
+
+    def test_xml_chunks_hold_complete_messages(self):
+        backup = build_backup(SAMPLE_BODIES).getvalue()
+        chunks = list(parallel_ingest.iter_xml_chunks(io.BytesIO(backup), chunk_bytes=100))
+        self.assertGreater(len(chunks), 1)
+        results = [result for chunk in chunks for _, _, result in parallel_ingest.parse_xml_chunk(chunk)]
+        self.assertEqual(results, [sms_parser.parse_sms(body) for body in SAMPLE_BODIES])
+
+class DeduplicationTestCase(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email='dedup@example.com', password='secret')
+
+    def count_rows(self):
+        return sum(
+            model.objects.filter(user=self.user).count()
+            for model in process_data.TRANSACTION_MODELS.values()
+        )
+
+    def test_reupload_adds_no_rows(self):
+        first = process_xml_file(build_backup(SAMPLE_BODIES), self.user)
+        count = self.count_rows()
+        second = process_xml_file(build_backup(SAMPLE_BODIES), self.user)
+        self.assertEqual(self.count_rows(), count)
+        self.assertEqual(second['duplicates'], first['transactions'])
+
+    def test_overlapping_upload_adds_only_new_messages(self):
+        process_xml_file(build_backup(SAMPLE_BODIES[:8]), self.user)
+        stats = process_xml_file(build_backup(SAMPLE_BODIES), self.user)
+        self.assertEqual(stats['duplicates'], 5)
+        self.assertEqual(IncomingMoney.objects.filter(user=self.user).count(), 1)
+        self.assertEqual(WithdrawalFromAgent.objects.filter(user=self.user).count(), 1)
+
+    def test_same_messages_are_kept_for_other_users(self):
+        other = CustomUser.objects.create_user(email='other@example.com', password='secret')
+        process_xml_file(build_backup(SAMPLE_BODIES), self.user)
+        process_xml_file(build_backup(SAMPLE_BODIES), other)
+        self.assertEqual(IncomingMoney.objects.filter(user=other).count(), 1)
+
+    def test_stored_rows_match_parsed_fingerprints(self):
+        # Fingerprints computed from a stored row (as the migration backfill
+        # does) must match those computed from freshly parsed fields
+        process_xml_file(build_backup(SAMPLE_BODIES), self.user)
+        for kind, model in process_data.TRANSACTION_MODELS.items():
+            if kind in dedup.UNDATED_KINDS:
+                continue
+            for row in model.objects.filter(user=self.user):
+                values = {field: getattr(row, field) for field in dedup.FINGERPRINT_FIELDS[kind]}
+                self.assertEqual(dedup.fingerprint(kind, values), row.fingerprint, model.__name__)
+
+    def test_watermark_skips_messages_in_every_mode(self):
+        since = 1700000000008
+        serial = list(process_data.parse_sms_elements(iter_sms(build_backup(SAMPLE_BODIES)), since=since))
+        chunked = [
+            parsed
+            for chunk in parallel_ingest.iter_xml_chunks(build_backup(SAMPLE_BODIES))
+            for parsed in parallel_ingest.parse_xml_chunk(chunk, since=since)
+        ]
+        for parsed in (serial, chunked):
+            self.assertEqual([result is None for _, _, result in parsed], [True] * 8 + [False] * 8)
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class LedgerTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(email='ledger@example.com', password='secret')
+
+    def ledger(self):
+        return list(
+            LedgerEntry.objects.filter(user=self.user).order_by('date_time')
+            .values_list('kind', 'direction', 'amount', 'fee', 'counterparty')
+        )
+
+    def test_ingestion_writes_ledger_entries(self):
+        process_xml_file(build_backup(SAMPLE_BODIES), self.user, batch_size=2)
+        self.assertEqual(self.ledger(), [
+            (sms_parser.INCOMING, 'in', Decimal('5000'), Decimal('0'), 'Jane Smith'),
+            (sms_parser.PAYMENT_TO_CODE, 'out', Decimal('-1000'), Decimal('0'), 'Jane Smith'),
+            (sms_parser.BANK_DEPOSIT, 'in', Decimal('40000'), Decimal('0'), ''),
+            (sms_parser.MOBILE_TRANSFER, 'out', Decimal('-10000'), Decimal('100'), 'Samuel Carter'),
+            (sms_parser.AIRTIME_BILL, 'out', Decimal('-2000'), Decimal('0'), ''),
+            (sms_parser.CASH_POWER_BILL, 'out', Decimal('-5000'), Decimal('20'), ''),
+            (sms_parser.THIRD_PARTY, 'out', Decimal('-3500'), Decimal('0'), 'DIRECT PAYMENT LTD'),
+            (sms_parser.WITHDRAWAL, 'out', Decimal('-20000'), Decimal('0'), 'Agent Sophia'),
+            (sms_parser.BANK_TRANSFER, 'out', Decimal('-30000'), Decimal('0'), 'Jane Smith (250790777777)'),
+        ])
+        entry = LedgerEntry.objects.get(user=self.user, kind=sms_parser.INCOMING)
+        self.assertEqual(entry.source_model, 'IncomingMoney')
+        self.assertEqual(entry.source_id, IncomingMoney.objects.get(user=self.user).pk)
+
+    def test_reupload_does_not_duplicate_entries(self):
+        process_xml_file(build_backup(SAMPLE_BODIES), self.user)
+        process_xml_file(build_backup(SAMPLE_BODIES), self.user)
+        self.assertEqual(LedgerEntry.objects.filter(user=self.user).count(), 9)
+
+    def test_rebuild_command_backfills_entries(self):
+        process_xml_file(build_backup(SAMPLE_BODIES), self.user)
+        expected = self.ledger()
+        LedgerEntry.objects.filter(kind=sms_parser.WITHDRAWAL).delete()
+        call_command('rebuild_ledger', stdout=io.StringIO())
+        self.assertEqual(self.ledger(), expected)
+        call_command('rebuild_ledger', '--clear', '--user', self.user.email, stdout=io.StringIO())
+        self.assertEqual(self.ledger(), expected)
+
+    def test_analysis_view_reads_the_ledger(self):
+        process_xml_file(build_backup(SAMPLE_BODIES), self.user)
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('analysis'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(get_widget(self.client, 'analysis', 'balance_trends')['balance'][-1], -26500)
+        self.assertEqual(sum(get_widget(self.client, 'analysis', 'transaction_frequency')['count']), 9)
+        monthly = get_widget(self.client, 'analysis', 'monthly_trends')
+        may = [amount for kind, amount in zip(monthly['type'], monthly['total_amount']) if kind == 'Transfer to Mobile']
+        self.assertEqual(may, [10000])
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class BalanceTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(email='balance@example.com', password='secret')
+
+    def balances(self):
+        return list(LedgerEntry.objects.filter(user=self.user).order_by('date_time', 'id').values_list('amount', 'balance'))
+
+    def assertRunningBalances(self):
+        balance = 0
+        for amount, stored in self.balances():
+            balance += amount
+            self.assertEqual(stored, balance)
+        return balance
+
+    def test_ingestion_stores_running_balances(self):
+        process_xml_file(build_backup(SAMPLE_BODIES), self.user)
+        self.assertEqual(self.assertRunningBalances(), Decimal('-26500'))
+
+    def test_out_of_order_upload_repairs_later_balances(self):
+        # The first incoming transfer arrives in a later upload, after
+        # everything dated after it
+        first_incoming = SAMPLE_BODIES[1]
+        process_xml_file(build_backup([body for body in SAMPLE_BODIES if body != first_incoming]), self.user)
+        self.assertEqual(self.assertRunningBalances(), Decimal('-31500'))
+        process_xml_file(build_backup([first_incoming]), self.user)
+        self.assertEqual(self.assertRunningBalances(), Decimal('-26500'))
+
+        LedgerEntry.objects.filter(user=self.user).update(balance=None)
+        call_command('rebuild_ledger', stdout=io.StringIO())
+        self.assertEqual(self.assertRunningBalances(), Decimal('-26500'))
+
+    def test_lttb_keeps_endpoints_and_peaks(self):
+        x = list(range(1000))
+        y = [0.0] * 1000
+        y[500] = 100.0
+        selected = balance_series.lttb(x, y, 10).tolist()
+        self.assertEqual(len(selected), 10)
+        self.assertEqual((selected[0], selected[-1]), (0, 999))
+        self.assertIn(500, selected)
+        self.assertEqual(selected, sorted(selected))
+        self.assertEqual(balance_series.lttb(x[:5], y[:5], 10).tolist(), [0, 1, 2, 3, 4])
+
+    def test_balance_series_endpoint(self):
+        process_xml_file(build_backup(SAMPLE_BODIES), self.user)
+        self.client.force_login(self.user)
+        url = reverse('balance_series')
+
+        series = self.client.get(url).json()['series']
+        self.assertEqual(len(series), 9)
+        self.assertEqual(series[-1]['balance'], '-26500.00')
+        series = self.client.get(url, {'points': 3}).json()['series']
+        self.assertEqual([point['balance'] for point in series][::2], ['5000.00', '-26500.00'])
+        self.assertEqual(len(series), 3)
+
+        daily = self.client.get(url, {'method': 'daily'}).json()['series']
+        self.assertEqual(daily[0]['date_time'], '2024-05-10T00:00:00Z')
+        self.assertEqual([Decimal(daily[0]['balance']), Decimal(daily[-1]['balance'])], [4000, -26500])
+        self.assertEqual(len(daily), 7)
+
+        self.assertEqual(self.client.get(url, {'method': 'hourly'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'points': 'many'}).status_code, 400)
+
+    def test_balance_series_is_cached_per_method_and_points(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            process_xml_file(build_backup(SAMPLE_BODIES[:4]), self.user)
+        self.client.force_login(self.user)
+        url = reverse('balance_series')
+        result_cache.stats.clear()
+        first = self.client.get(url).json()
+        self.assertEqual(self.client.get(url).json(), first)
+        self.client.get(url, {'points': 3})
+        self.client.get(url, {'method': 'daily'})
+        self.assertEqual(result_cache.stats['BalanceSeriesView.get_series:hits'], 1)
+        self.assertEqual(result_cache.stats['BalanceSeriesView.get_series:misses'], 3)
+
+        # An upload invalidates the cached series
+        with self.captureOnCommitCallbacks(execute=True):
+            process_xml_file(build_backup(SAMPLE_BODIES), self.user)
+        self.assertEqual(len(self.client.get(url).json()['series']), 9)
+
+class RollupTestCase(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email='rollups@example.com', password='secret')
+
+    def rollups(self, model):
+        return list(model.objects.filter(user=self.user).order_by('period', 'kind').values_list(
+            'period', 'kind', 'count', 'amount', 'fee'
+        ))
+
+    def test_ingestion_updates_rollups_incrementally(self):
+        second_incoming = SAMPLE_BODIES[1].replace('5000 RWF', '2500 RWF').replace('76662021700', '76662021701')
+        process_xml_file(build_backup(SAMPLE_BODIES[:8]), self.user, batch_size=1)
+        process_xml_file(build_backup(SAMPLE_BODIES + [second_incoming]), self.user, batch_size=2)
+
+        daily = self.rollups(DailyRollup)
+        self.assertEqual(daily[0], (date(2024, 5, 10), sms_parser.INCOMING, 2, Decimal('7500'), Decimal('0')))
+        self.assertEqual(sum(row[2] for row in daily), 10)
+        monthly = self.rollups(MonthlyRollup)
+        self.assertIn((date(2024, 5, 1), sms_parser.MOBILE_TRANSFER, 1, Decimal('-10000'), Decimal('100')), monthly)
+        self.assertIn((date(2024, 6, 1), sms_parser.BANK_TRANSFER, 1, Decimal('-30000'), Decimal('0')), monthly)
+        self.assertEqual(len(monthly), 9)
+
+        # Incremental maintenance matches a rebuild from the ledger
+        call_command('rebuild_rollups', '--user', self.user.email, stdout=io.StringIO())
+        self.assertEqual(self.rollups(DailyRollup), daily)
+        self.assertEqual(self.rollups(MonthlyRollup), monthly)
+
+    def test_add_entries_adds_to_stored_totals_in_the_database(self):
+        # Totals another upload stored after this one aggregated its entries
+        # are added to, not overwritten: there is no read to go stale
+        DailyRollup.objects.create(
+            user=self.user, period=date(2024, 5, 10), kind=sms_parser.INCOMING, count=3, amount=Decimal('300'), fee=0,
+        )
+        entries = [
+            LedgerEntry(user=self.user, kind=sms_parser.INCOMING, direction=LedgerEntry.DIRECTION_IN,
+                        amount=Decimal('50.25'), fee=Decimal('1'), date_time=utc(2024, 5, 10, 12)),
+            LedgerEntry(user=self.user, kind=sms_parser.INCOMING, direction=LedgerEntry.DIRECTION_IN,
+                        amount=Decimal('20'), fee=0, date_time=utc(2024, 5, 11, 12)),
+        ]
+        with self.assertNumQueries(2):
+            rollups.add_entries(entries)
+        self.assertEqual(self.rollups(DailyRollup), [
+            (date(2024, 5, 10), sms_parser.INCOMING, 4, Decimal('350.25'), Decimal('1')),
+            (date(2024, 5, 11), sms_parser.INCOMING, 1, Decimal('20'), Decimal('0')),
+        ])
+        self.assertEqual(self.rollups(MonthlyRollup), [(date(2024, 5, 1), sms_parser.INCOMING, 2, Decimal('70.25'), Decimal('1'))])
+
+    def test_rebuild_command_restores_rollups(self):
+        process_xml_file(build_backup(SAMPLE_BODIES), self.user)
+        expected = self.rollups(DailyRollup)
+        DailyRollup.objects.all().delete()
+        call_command('rebuild_rollups', stdout=io.StringIO())
+        self.assertEqual(self.rollups(DailyRollup), expected)
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class DashboardAggregationTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(email='dashboard@example.com', password='secret')
+        self.client.force_login(self.user)
+
+    def test_daily_transactions_grouped_by_day_and_type(self):
+        # Two incoming transfers on the same day are summed into one row
+        second_incoming = SAMPLE_BODIES[1].replace('5000 RWF', '2500 RWF').replace('76662021700', '76662021701')
+        process_xml_file(build_backup(SAMPLE_BODIES + [second_incoming]), self.user)
+        response = self.client.get(reverse('dashboard'))
+        self.assertEqual(response.status_code, 200)
+        daily = get_widget(self.client, 'dashboard', 'daily_transactions')
+        rows = list(zip(daily['day'], daily['type'], daily['total_amount'], daily['transaction_count']))
+        self.assertEqual(rows[:3], [
+            ('2024-05-10T00:00:00Z', 'incoming', 7500.0, 2),
+            ('2024-05-10T00:00:00Z', 'payment_to_code', 1000.0, 1),
+            ('2024-05-11T00:00:00Z', 'bank_deposit', 40000.0, 1),
+        ])
+        self.assertEqual(len(rows), 9)
+        self.assertEqual(rows, sorted(rows, key=lambda row: (row[0], row[1])))
+
+    def test_page_is_a_shell_and_widgets_are_columnar(self):
+        process_xml_file(build_backup(SAMPLE_BODIES), self.user)
+        result_cache.stats.clear()
+        # Session, user and whether there is anything to show
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('dashboard'))
+        self.assertEqual(result_cache.stats['misses'], 0)
+        for name in DashboardView.widgets:
+            self.assertContains(response, reverse('dashboard_widget', args=[name]))
+
+        # Large enough for the gzip middleware to compress it
+        response = self.client.get(reverse('dashboard_widget', args=['daily_transactions']), HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        top = self.client.get(reverse('dashboard_widget', args=['top_recipients'])).json()
+        self.assertEqual(top, {'recipient': ['Samuel Carter'], 'transaction_count': [1], 'total_amount': [10000.0]})
+        bundles = get_widget(self.client, 'dashboard', 'bundle_analysis')
+        self.assertEqual(bundles['voice'], {'minutes': ['30'], 'purchase_count': [1], 'total_amount': [1000.0]})
+
+        self.assertEqual(self.client.get(reverse('dashboard_widget', args=['unknown'])).status_code, 404)
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('dashboard_widget', args=['top_agents'])).status_code, 302)
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class AnalysisSummaryTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(email='summary@example.com', password='secret')
+
+    def test_summary_and_costs_read_the_users_rollups_in_one_query(self):
+        other = CustomUser.objects.create_user(email='summary-other@example.com', password='secret')
+        process_xml_file(build_backup(SAMPLE_BODIES), self.user)
+        process_xml_file(build_backup([body.replace('Fee was: 100', 'Fee was: 900') for body in SAMPLE_BODIES]), other)
+
+        request = RequestFactory().get(reverse('analysis'))
+        request.user = self.user
+        view = AnalysisView()
+        view.setup(request)
+        with self.assertNumQueries(1):
+            summary = view.get_transaction_summary()
+            costs = view.get_transaction_costs()
+
+        # Same totals as aggregating the user's transaction tables
+        expected_summary = {
+            label: process_data.TRANSACTION_MODELS[kind].objects.filter(user=self.user).aggregate(total=Sum('amount'))['total'] or 0
+            for kind, label in LedgerEntry.KIND_CHOICES
+        }
+        self.assertEqual(summary, expected_summary)
+        self.assertEqual(summary['Withdrawal from Agent'], Decimal('20000'))
+        self.assertEqual(costs, {
+            'Transfer to Mobile': Decimal('100'),
+            'Airtime Bill Payment': Decimal('0'),
+            'Cash Power Bill Payment': Decimal('20'),
+        })
+
+    def test_empty_account(self):
+        self.client.force_login(self.user)
+        self.assertNotContains(self.client.get(reverse('analysis')), 'analysis/widgets/')
+        self.assertEqual(set(get_widget(self.client, 'analysis', 'transaction_summary')['amount']), {0})
+        self.assertEqual(get_widget(self.client, 'analysis', 'transaction_costs'), {
+            'type': ['Transfer to Mobile', 'Airtime Bill Payment', 'Cash Power Bill Payment'], 'fee': [0, 0, 0],
+        })
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ResultCacheTestCase(TestCase):
+    dashboard_methods = 5
+
+    def setUp(self):
+        cache.clear()
+        result_cache.stats.clear()
+        self.user = CustomUser.objects.create_user(email='cache@example.com', password='secret')
+        self.client.force_login(self.user)
+
+    def load_dashboard(self):
+        # The page and the data of each of its widgets
+        result_cache.stats.clear()
+        self.client.get(reverse('dashboard'))
+        return {name: get_widget(self.client, 'dashboard', name) for name in DashboardView.widgets}
+
+    def test_repeat_loads_are_served_from_the_cache(self):
+        self.load_dashboard()
+        self.assertEqual(result_cache.stats['misses'], self.dashboard_methods)
+        self.assertEqual(result_cache.stats['hits'], 0)
+        self.load_dashboard()
+        self.assertEqual(result_cache.stats['misses'], 0)
+        self.assertEqual(result_cache.stats['hits'], self.dashboard_methods)
+        self.assertEqual(result_cache.stats['DashboardView.get_daily_transactions:hits'], 1)
+
+    def test_upload_invalidates_only_that_users_results(self):
+        other = CustomUser.objects.create_user(email='other@example.com', password='secret')
+        other_version = result_cache.get_version(other.pk)
+        self.assertEqual(self.load_dashboard()['daily_transactions']['day'], [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            process_xml_file(build_backup(SAMPLE_BODIES), self.user)
+        widgets = self.load_dashboard()
+        self.assertEqual(result_cache.stats['misses'], self.dashboard_methods)
+        self.assertEqual(len(widgets['daily_transactions']['day']), 9)
+        self.assertEqual(result_cache.get_version(other.pk), other_version)
+
+    def test_rolled_back_upload_keeps_the_cache(self):
+        self.load_dashboard()
+        broken = build_backup(SAMPLE_BODIES).getvalue()[:-len(b"</smses>")]
+        with self.captureOnCommitCallbacks(execute=True), self.assertRaises(Exception):
+            process_xml_file(io.BytesIO(broken), self.user)
+        self.load_dashboard()
+        self.assertEqual(result_cache.stats['misses'], 0)
+
+@skipUnless(connection.vendor == 'sqlite', "EXPLAIN QUERY PLAN output is SQLite specific")
+class QueryPlanTestCase(TestCase):
+    dated_models = [
+        IncomingMoney, PaymentToCodeHolder, TransferToMobile, BankDeposit, AirtimeBillPayment,
+        CashPowerBillPayment, ThirdPartyTransaction, WithdrawalFromAgent, BankTransfer, LedgerEntry,
+    ]
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email='plans@example.com', password='secret')
+        # Plan as on a large database: the statistics gathered after other
+        # tests' uploads describe tables of a few rows, which are scanned
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'")
+            if cursor.fetchone():
+                cursor.execute("DELETE FROM sqlite_stat1")
+                # Reloads the (now empty) statistics
+                cursor.execute("ANALYZE sqlite_master")
+
+    def index_name(self, model, fields):
+        for index in model._meta.indexes:
+            if index.fields == fields:
+                return index.name
+        self.fail(f"{model.__name__} has no index on {fields}")
+
+    def assertUsesIndex(self, queryset, fields):
+        plan = queryset.explain()
+        self.assertIn(f"USING INDEX {self.index_name(queryset.model, fields)}", plan)
+        return plan
+
+    def test_latest_transactions_use_user_date_index(self):
+        for model in self.dated_models:
+            with self.subTest(model=model.__name__):
+                plan = self.assertUsesIndex(
+                    model.objects.filter(user=self.user).order_by('-date_time'), ['user', 'date_time']
+                )
+                self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_date_ranges_use_user_date_index(self):
+        start = utc(2024, 5, 1)
+        for model in self.dated_models:
+            with self.subTest(model=model.__name__):
+                self.assertUsesIndex(
+                    model.objects.filter(user=self.user, date_time__gte=start, date_time__lt=utc(2024, 6, 1)),
+                    ['user', 'date_time'],
+                )
+
+    def test_top_n_groupings_use_their_index(self):
+        # Grouped by the integer counterparty key
+        for model in counterparties.SOURCES:
+            with self.subTest(model=model.__name__):
+                queryset = model.objects.filter(user=self.user).values('counterparty').annotate(
+                    transaction_count=Count('id'), total_amount=Sum('amount')
+                ).order_by('-total_amount')
+                plan = self.assertUsesIndex(queryset, ['user', 'counterparty'])
+                self.assertNotIn('GROUP BY', plan)
+
+class AnomalyEngineTestCase(TestCase):
+    def columns(self, rows):
+        # (amount, type, hour) rows on consecutive days, as detect_anomalies' columns
+        date_times = [utc(2024, 5, 1, hour) + timedelta(days=i) for i, (_, _, hour) in enumerate(rows)]
+        amounts = [amount for amount, _, _ in rows]
+        types = [kind for _, kind, _ in rows]
+        ids = list(range(1, len(rows) + 1))
+        return date_times, amounts, types, ids, [hour for _, _, hour in rows]
+
+    def test_reports_each_transaction_once_by_first_matching_rule(self):
+        rows = [(-100.0, 'Bank Transfer', 12)] * 20 + [(100.0, 'Bank Deposit', 12)] * 20
+        rows += [(400.0, 'Bank Deposit', 12)] + [(50.0, 'Incoming Money', 12)] * 5
+        rows += [(5000.0, 'Incoming Money', 23), (-1000.0, 'Bank Transfer', 3)]
+        records = anomalies.detect_anomalies(*self.columns(rows))
+
+        self.assertEqual([(r['id'], r['anomaly_type']) for r in records], [
+            (47, 'High Amount'), (41, 'High Amount for Bank Deposit'), (48, anomalies.UNUSUAL_TIME),
+        ])
+        # Every record has the keys of all the rules, with NaN where a rule
+        # doesn't apply; the 23:00 transaction is only reported once
+        self.assertEqual(list(records[0]), list(anomalies.BASE_KEYS) + [
+            'anomaly_type', 'threshold', 'deviation_percent', 'overall_mean', 'times_above_mean',
+            'type_mean', 'times_above_type_mean', 'hour', 'unusual_hour',
+        ])
+        self.assertAlmostEqual(records[0]['overall_mean'], sum(row[0] for row in rows) / len(rows))
+        self.assertEqual(records[0]['times_above_mean'], 51.61)
+        self.assertTrue(math.isnan(records[0]['type_mean']))
+        self.assertAlmostEqual(records[1]['type_mean'], 2400 / 21)
+        self.assertEqual(records[1]['times_above_type_mean'], 3.5)
+        self.assertEqual((records[2]['hour'], records[2]['amount']), (3.0, -1000.0))
+        self.assertEqual(records[2]['date_time'], utc(2024, 5, 1, 3) + timedelta(days=47))
+
+    def test_night_only_reports_keep_integer_hours(self):
+        rows = [(-100.0, 'Bank Transfer', 12), (-100.0, 'Bank Transfer', 22), (-100.0, 'Bank Transfer', 5)]
+        records = anomalies.detect_anomalies(*self.columns(rows))
+        self.assertEqual([(r['id'], r['hour'], r['unusual_hour']) for r in records], [(2, 22, 22), (3, 5, 5)])
+        self.assertEqual(list(records[0]), list(anomalies.BASE_KEYS) + list(anomalies.NIGHT_KEYS))
+        self.assertIsInstance(records[0]['hour'], int)
+
+    def test_no_transactions(self):
+        self.assertEqual(anomalies.detect_anomalies([], [], [], [], []), [])
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class DetectorTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(email='detectors@example.com', password='secret')
+
+    def ledger(self, rows):
+        # (minutes since the first transaction, kind, amount, counterparty) rows
+        date_times = [utc(2024, 5, 1, 12) + timedelta(minutes=minutes) for minutes, _, _, _ in rows]
+        return detectors.Ledger(
+            ids=list(range(len(rows))),
+            date_times=date_times,
+            amounts=np.array([amount for _, _, amount, _ in rows], dtype=float),
+            kinds=[kind for _, kind, _, _ in rows],
+            counterparties=[counterparty for _, _, _, counterparty in rows],
+            timestamps=np.array([d.timestamp() for d in date_times]),
+        )
+
+    def test_mad_is_not_masked_by_a_larger_outlier(self):
+        # The huge transfer inflates the standard deviation enough to hide the
+        # 5000 one from the mean + 3 sigma rules, but not from the median
+        amounts = [100, 110, 90, 105, 95, 100, 102, 98, 101, 99, 5000, 1000000]
+        rows = [(i * 600, sms_parser.BANK_TRANSFER, -amount, '') for i, amount in enumerate(amounts)]
+        ledger = self.ledger(rows)
+        flagged = detectors.MADDetector().detect(ledger)
+        self.assertEqual([row for row, _, _ in flagged], [10, 11])
+        self.assertEqual(flagged[0][1], 'Unusual Amount for Bank Transfer')
+        self.assertEqual(flagged[0][2]['median'], 100.5)
+        threshold = detectors.ThresholdDetector().detect(ledger)
+        self.assertNotIn(10, [row for row, _, _ in threshold])
+
+    def test_rolling_zscore_per_counterparty(self):
+        rows = []
+        for i in range(8):
+            rows.append((i * 600, sms_parser.MOBILE_TRANSFER, -1000 - i, 'Jane Smith'))
+            rows.append((i * 600 + 1, sms_parser.MOBILE_TRANSFER, -50000 - i, 'Alex Doe'))
+        # Usual for Alex, not for Jane
+        rows.append((9000, sms_parser.MOBILE_TRANSFER, -50000, 'Jane Smith'))
+        flagged = detectors.RollingZScoreDetector(window=5).detect(self.ledger(rows))
+        self.assertEqual([(row, details['counterparty'], details['window']) for row, _, details in flagged], [
+            (16, 'Jane Smith', 5),
+        ])
+
+    def test_burst_groups_transactions_within_the_window(self):
+        minutes = [0, 1, 2, 3, 4, 5, 60, 61, 62, 63, 120, 180]
+        rows = [(m, sms_parser.PAYMENT_TO_CODE, -100, 'Shop') for m in minutes]
+        flagged = detectors.BurstDetector(count=5, minutes=10).detect(self.ledger(rows))
+        self.assertEqual([row for row, _, _ in flagged], [0, 1, 2, 3, 4, 5])
+        self.assertEqual({details['burst_size'] for _, _, details in flagged}, {6})
+        self.assertEqual(flagged[0][2]['burst_end'], utc(2024, 5, 1, 12, 5).isoformat())
+
+    def test_ingestion_stores_anomalies_read_by_the_analysis_page(self):
+        process_xml_file(build_backup(SAMPLE_BODIES), self.user)
+        stored = DetectedAnomaly.objects.filter(user=self.user)
+        # The stored threshold anomalies are the records of the anomaly engine
+        entries = list(LedgerEntry.objects.filter(user=self.user).order_by('date_time', 'id'))
+        expected = anomalies.detect_anomalies(
+            [e.date_time for e in entries], [float(e.amount) for e in entries],
+            [LedgerEntry.KIND_LABELS[e.kind] for e in entries], [e.source_id for e in entries],
+            [e.date_time.hour for e in entries],
+        )
+        self.assertEqual(
+            [(a.entry.source_id, a.anomaly_type) for a in stored.filter(detector='threshold').order_by('id')],
+            [(r['id'], r['anomaly_type']) for r in expected],
+        )
+
+        request = RequestFactory().get(reverse('analysis'))
+        request.user = self.user
+        view = AnalysisView()
+        view.setup(request)
+        with self.assertNumQueries(1):
+            records = view.get_anomalies()
+        self.client.force_login(self.user)
+        self.assertEqual(len(records), stored.count())
+        payload = get_widget(self.client, 'analysis', 'anomalies')
+        self.assertEqual(payload['id'], [record['id'] for record in records])
+        self.assertEqual(payload['anomaly_type'], [record['anomaly_type'] for record in records])
+
+    def test_load_ledger_streams_the_entries_in_date_order(self):
+        process_xml_file(build_backup(SAMPLE_BODIES), self.user)
+        entries = list(LedgerEntry.objects.filter(user=self.user).order_by('date_time', 'id'))
+        ledger = detectors.load_ledger(self.user, batch_size=2)
+        self.assertEqual(ledger.ids, [e.id for e in entries])
+        self.assertEqual(ledger.amounts.tolist(), [float(e.amount) for e in entries])
+        self.assertEqual(ledger.timestamps.tolist(), [e.date_time.timestamp() for e in entries])
+        self.assertEqual(ledger.counterparties, [e.counterparty for e in entries])
+        empty = detectors.load_ledger(CustomUser.objects.create_user(email='empty@example.com', password='x'))
+        self.assertEqual((empty.ids, empty.amounts.size), ([], 0))
+
+    def test_detectors_run_after_the_upload_commits(self):
+        depth = len(connection.savepoint_ids)
+        depths = []
+        with mock.patch.object(detectors, 'run', side_effect=lambda *args, **kwargs: depths.append(len(connection.savepoint_ids))):
+            process_xml_file(build_backup(SAMPLE_BODIES), self.user)
+        self.assertEqual(depths, [depth])
+
+        # A failing detector doesn't undo the upload
+        other = CustomUser.objects.create_user(email='failing@example.com', password='secret')
+        with mock.patch.object(detectors, 'run', side_effect=RuntimeError('boom')), \
+                self.assertLogs('transactions.utils.process_data', 'ERROR'):
+            process_xml_file(build_backup(SAMPLE_BODIES), other)
+        self.assertTrue(LedgerEntry.objects.filter(user=other).exists())
+
+    def test_command_replaces_stored_anomalies(self):
+        process_xml_file(build_backup(SAMPLE_BODIES), self.user)
+        expected = list(DetectedAnomaly.objects.order_by('id').values_list('detector', 'entry_id', 'anomaly_type'))
+        DetectedAnomaly.objects.create(
+            user=self.user, detector='burst', entry=LedgerEntry.objects.first(),
+            anomaly_type='Burst of Transactions', date_time=utc(2024, 5, 1),
+        )
+        call_command('detect_anomalies', '--user', self.user.email, stdout=io.StringIO())
+        self.assertEqual(list(DetectedAnomaly.objects.order_by('id').values_list('detector', 'entry_id', 'anomaly_type')), expected)
+
+    @override_settings(ANOMALY_DETECTORS={'burst': {'size': 3}})
+    def test_unknown_detector_options_are_rejected(self):
+        with self.assertRaises(ImproperlyConfigured):
+            detectors.enabled_detectors()
+
+@override_settings(RECEIVER_HISTORY_PAGE_SIZE=4)
+class ReceiverHistoryTestCase(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email='history@example.com', password='secret')
+        other = CustomUser.objects.create_user(email='other@example.com', password='secret')
+        self.client.force_login(self.user)
+        # Three transfers of each source, some at the same instant
+        for i in range(3):
+            moment = utc(2024, 5, 1 + i, 12)
+            PaymentToCodeHolder.objects.create(user=self.user, transaction_id=f'T{i}', amount=100 + i, recipient='Shop', date_time=moment)
+            TransferToMobile.objects.create(
+                user=self.user, amount=200 + i, recipient='Jane Smith', recipient_number='250788000001',
+                date_time=moment if i else utc(2024, 4, 1), fee=0,
+            )
+            BankTransfer.objects.create(user=self.user, amount=300 + i, recipient='Bank', date_time=moment + timedelta(minutes=i))
+        BankTransfer.objects.create(user=other, amount=1, recipient='Bank', date_time=utc(2024, 5, 1))
+        # Rows created directly skip ingestion, so link their counterparties
+        counterparties.rebuild()
+
+    def expected(self):
+        rows = [
+            (tx.date_time, source, tx.pk, tx.amount)
+            for source, model in enumerate([PaymentToCodeHolder, TransferToMobile, BankTransfer])
+            for tx in model.objects.filter(user=self.user)
+        ]
+        return [amount for *_, amount in sorted(rows, reverse=True)]
+
+    def test_pages_follow_the_cursor_in_merged_order(self):
+        url = reverse('receiver_history_page')
+        amounts = []
+        cursor = None
+        pages = 0
+        while True:
+            data = self.client.get(url, {'cursor': cursor} if cursor else {}).json()
+            amounts += [Decimal(tx['amount']) for tx in data['transactions']]
+            pages += 1
+            cursor = data['next_cursor']
+            if cursor is None:
+                break
+        self.assertEqual(amounts, self.expected())
+        self.assertEqual(pages, 3)
+
+    def test_a_page_is_one_query_per_source(self):
+        filters = [Q(), Q(), Q()]
+        _, cursor = receiver_history.fetch_page(self.user, filters, page_size=4)
+        with self.assertNumQueries(3):
+            transactions, _ = receiver_history.fetch_page(self.user, filters, cursor, page_size=4)
+        self.assertEqual([tx['type'] for tx in transactions], [
+            'Transfer to Mobile', 'Payment to Code Holder', 'Bank Transfer', 'Payment to Code Holder',
+        ])
+
+    def test_filters_apply_to_every_page(self):
+        response = self.client.get(reverse('receiver_history'), {'receiver': '250788'})
+        self.assertEqual([tx['details'] for tx in response.context['transactions']], ['Mobile: 250788000001'] * 3)
+        self.assertIsNone(response.context['next_cursor'])
+
+        response = self.client.get(reverse('receiver_history'), {'start_date': '2024-05-02', 'end_date': '2024-05-03'})
+        self.assertEqual(len(response.context['transactions']), 4)
+        data = self.client.get(reverse('receiver_history_page'), {
+            'start_date': '2024-05-02', 'end_date': '2024-05-03', 'cursor': response.context['next_cursor'],
+        }).json()
+        self.assertEqual(len(data['transactions']), 2)
+        self.assertEqual(data['transactions'][-1]['date_display'], '2024-05-02 12:00')
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('receiver_history_page'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 400)
+
+class CounterpartySearchTestCase(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email='search@example.com', password='secret')
+
+    def search(self, text, field='name'):
+        return sorted(counterparties.search(self.user, text, [field]).values_list(field, flat=True))
+
+    def test_ingestion_links_rows_to_counterparties(self):
+        process_xml_file(build_backup(SAMPLE_BODIES), self.user)
+        self.assertEqual(
+            sorted(Counterparty.objects.filter(user=self.user).values_list('name', 'number')),
+            [
+                ('Agent Sophia', '250790777777'), ('DIRECT PAYMENT LTD', ''),
+                # Sender of incoming money and paid as a code holder
+                ('Jane Smith', ''),
+                # Bank transfers record the number as part of the recipient
+                ('Jane Smith (250790777777)', ''),
+                ('Samuel Carter', '250791666666'),
+            ],
+        )
+        for model, (name_field, _) in counterparties.SOURCES.items():
+            for row in model.objects.filter(user=self.user).select_related('counterparty'):
+                with self.subTest(model=model.__name__):
+                    self.assertEqual(row.counterparty.name, getattr(row, name_field))
+
+    def test_migration_links_rows_like_rebuild(self):
+        # The frozen copy in migration 0014 links existing rows as the
+        # counterparties module does
+        migration = importlib.import_module('transactions.migrations.0014_counterparty_entities')
+        process_xml_file(build_backup(SAMPLE_BODIES), self.user)
+        TransferToMobile.objects.create(
+            user=self.user, amount=100, recipient='SAMUEL  carter', recipient_number='0791666666',
+            date_time=utc(2024, 6, 1), fee=0,
+        )
+        counterparties.rebuild(self.user)
+        expected = {
+            model: sorted(model.objects.filter(user=self.user).values_list('id', 'counterparty__name', 'counterparty__number'))
+            for model in counterparties.SOURCES
+        }
+        for model in counterparties.SOURCES:
+            model.objects.update(counterparty=None)
+        Counterparty.objects.all().delete()
+        migration.link_transactions(django_apps, mock.Mock(connection=connection))
+        for model in counterparties.SOURCES:
+            with self.subTest(model=model.__name__):
+                self.assertEqual(
+                    sorted(model.objects.filter(user=self.user).values_list('id', 'counterparty__name', 'counterparty__number')),
+                    expected[model],
+                )
+
+    def test_spellings_resolve_to_one_counterparty(self):
+        cache = counterparties.CounterpartyCache()
+        ids = cache.resolve([
+            (self.user.pk, 'Jane  Smith', '0788123456'),
+            (self.user.pk, 'JANE SMITH ', '+250 788 123 456'),
+            (self.user.pk, 'Jane Smith', '788123456'),
+            (self.user.pk, 'Jane Smith', ''),
+            (None, 'Jane Smith', ''),
+        ])
+        self.assertEqual(ids[0], ids[1])
+        self.assertEqual(ids[0], ids[2])
+        self.assertNotEqual(ids[0], ids[3])
+        self.assertIsNone(ids[4])
+        self.assertEqual(
+            sorted(Counterparty.objects.filter(user=self.user).values_list('name', 'normalized_name', 'number')),
+            [('Jane Smith', 'jane smith', ''), ('Jane Smith', 'jane smith', '250788123456')],
+        )
+        # Names already resolved in the upload cost no query
+        with self.assertNumQueries(0):
+            self.assertEqual(cache.resolve([(self.user.pk, 'jane smith', '250788123456')]), [ids[0]])
+        # Another upload finds the stored counterparties
+        self.assertEqual(counterparties.CounterpartyCache().resolve([(self.user.pk, 'Jane Smith', '')]), [ids[3]])
+
+    def test_search_matches_like_icontains(self):
+        names = ['Jane Smith', 'JANE DOE', 'Alex Doe', 'Grace Uwase']
+        for i, name in enumerate(names):
+            BankTransfer.objects.create(user=self.user, amount=100, recipient=name, date_time=utc(2024, 5, 1 + i))
+        TransferToMobile.objects.create(
+            user=self.user, amount=100, recipient='Jane Smith', recipient_number='250788123456',
+            date_time=utc(2024, 6, 1), fee=0,
+        )
+        counterparties.rebuild(self.user)
+        for text in ['jane', 'doe', 'e', 'ce uw', 'smith', 'xyz', '50_8', '%']:
+            with self.subTest(text=text):
+                expected = sorted(set(BankTransfer.objects.filter(recipient__icontains=text).values_list('recipient', flat=True)))
+                self.assertEqual(sorted(set(self.search(text))), expected)
+        self.assertEqual(self.search('8123', 'number'), ['250788123456'])
+        # Counterparties matching by name or number
+        names = counterparties.search(self.user, '8123').values_list('name', flat=True)
+        self.assertEqual(list(names), ['Jane Smith'])
+
+    @skipUnless(connection.vendor == 'sqlite', "SQLite FTS5 index")
+    def test_search_uses_the_trigram_index(self):
+        self.assertTrue(counterparties.has_fts_index())
+        query = str(counterparties.search(self.user, 'smith').query)
+        self.assertIn(counterparties.FTS_TABLE, query)
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN QUERY PLAN SELECT rowid FROM {counterparties.FTS_TABLE} WHERE name LIKE '%smith%'")
+            plan = ' '.join(str(row[-1]) for row in cursor.fetchall())
+        self.assertIn('VIRTUAL TABLE INDEX', plan)
+
+        # The index follows deletes and updates of the counterparty table
+        counterparty = Counterparty.objects.create(user=self.user, name='Jane Smith')
+        self.assertEqual(self.search('smith'), ['Jane Smith'])
+        Counterparty.objects.filter(pk=counterparty.pk).update(name='Jane Doe')
+        self.assertEqual(self.search('smith'), [])
+        counterparty.delete()
+        self.assertEqual(self.search('jane'), [])
+
+    def postgresql_without_pg_trgm(self):
+        # A schema editor on a PostgreSQL database where the extension can't
+        # be created; the savepoints run on the test database
+        executed = []
+
+        def execute(statement):
+            if statement.startswith('CREATE EXTENSION'):
+                raise DatabaseError('permission denied to create extension "pg_trgm"')
+            executed.append(statement)
+
+        editor = mock.MagicMock()
+        editor.connection.vendor = 'postgresql'
+        editor.connection.alias = connection.alias
+        editor.connection.cursor.return_value.__enter__.return_value.execute.side_effect = execute
+        return editor, executed
+
+    def test_search_index_is_skipped_without_pg_trgm(self):
+        editor, executed = self.postgresql_without_pg_trgm()
+        with self.assertLogs('transactions.utils.counterparties', 'WARNING'):
+            counterparties.create_search_index(editor)
+        self.assertEqual(executed, [])
+
+        migration = importlib.import_module('transactions.migrations.0013_counterparty')
+        editor, executed = self.postgresql_without_pg_trgm()
+        migration.create_index(None, editor)
+        self.assertFalse([statement for statement in executed if statement.startswith('CREATE')])
+
+
+class CounterpartyTotalTestCase(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email='totals@example.com', password='secret')
+
+    def test_ingestion_keeps_totals_consistent(self):
+        process_xml_file(build_backup(SAMPLE_BODIES), self.user)
+        self.assertEqual(counterparty_totals.check(), [])
+        jane = Counterparty.objects.get(user=self.user, name='Jane Smith')
+        self.assertEqual(
+            sorted(jane.totals.values_list('kind', 'count')),
+            [(sms_parser.INCOMING, 1), (sms_parser.PAYMENT_TO_CODE, 1)],
+        )
+        # Re-uploading the same backup adds nothing
+        process_xml_file(build_backup(SAMPLE_BODIES), self.user)
+        self.assertEqual(counterparty_totals.check(), [])
+
+    def test_add_rows_adds_to_stored_totals_in_the_database(self):
+        jane = Counterparty.objects.create(user=self.user, name='Jane Smith', normalized_name='jane smith')
+        # Stored by another upload after this one's rows were inserted
+        CounterpartyTotal.objects.create(
+            user=self.user, counterparty=jane, kind=sms_parser.PAYMENT_TO_CODE, count=2, amount=Decimal('300'),
+        )
+        rows = [
+            PaymentToCodeHolder.objects.create(
+                user=self.user, transaction_id=f'T{i}', amount=amount, recipient='Jane Smith',
+                date_time=utc(2024, 5, 1 + i), counterparty=jane,
+            )
+            for i, amount in enumerate([Decimal('100.50'), Decimal('50')])
+        ]
+        with self.assertNumQueries(2):
+            counterparty_totals.add_rows(PaymentToCodeHolder, [row.pk for row in rows])
+        self.assertEqual(
+            list(jane.totals.values_list('kind', 'count', 'amount')),
+            [(sms_parser.PAYMENT_TO_CODE, 4, Decimal('450.50'))],
+        )
+
+    def test_top_groups_spellings_and_reads_the_index(self):
+        for i, name in enumerate(['Shop', 'SHOP', 'Cafe', 'shop ']):
+            PaymentToCodeHolder.objects.create(
+                user=self.user, transaction_id=f'T{i}', amount=100 * (i + 1), recipient=name, date_time=utc(2024, 5, 1 + i),
+            )
+        counterparties.rebuild(self.user)
+        counterparty_totals.rebuild(self.user)
+        with self.assertNumQueries(1):
+            top = counterparty_totals.top(self.user, sms_parser.PAYMENT_TO_CODE, 30, 'recipient')
+        self.assertEqual(top, [
+            {'recipient': 'Shop', 'transaction_count': 3, 'total_amount': Decimal('700')},
+            {'recipient': 'Cafe', 'transaction_count': 1, 'total_amount': Decimal('300')},
+        ])
+        self.assertEqual(counterparty_totals.top(self.user, sms_parser.PAYMENT_TO_CODE, 1, 'recipient')[0]['recipient'], 'Shop')
+        if connection.vendor == 'sqlite':
+            plan = CounterpartyTotal.objects.filter(user=self.user, kind=sms_parser.PAYMENT_TO_CODE).order_by('-amount', 'id').explain()
+            self.assertIn('USING INDEX', plan)
+            self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_check_reports_drift(self):
+        process_xml_file(build_backup(SAMPLE_BODIES), self.user)
+        total = CounterpartyTotal.objects.get(kind=sms_parser.MOBILE_TRANSFER)
+        total.count = 7
+        total.save()
+        TransferToMobile.objects.filter(user=self.user).update(amount=1)
+        BankTransfer.objects.create(
+            user=self.user, amount=50, recipient='Jane Smith', date_time=utc(2024, 5, 1),
+            counterparty=Counterparty.objects.get(user=self.user, name='Jane Smith'),
+        )
+        drifts = counterparty_totals.check(self.user)
+        self.assertEqual(
+            sorted((drift.kind, drift.expected, drift.stored) for drift in drifts),
+            [
+                (sms_parser.BANK_TRANSFER, (1, Decimal('50')), None),
+                (sms_parser.MOBILE_TRANSFER, (1, Decimal('1')), (7, Decimal('10000'))),
+            ],
+        )
+
+        out = io.StringIO()
+        with self.assertRaises(CommandError):
+            call_command('check_counterparty_totals', stdout=out)
+        self.assertIn('expected 1 for 50, stored none', out.getvalue())
+        call_command('check_counterparty_totals', '--fix', stdout=io.StringIO())
+        self.assertEqual(counterparty_totals.check(), [])
+
+class TransactionCountTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(email='counts@example.com', password='secret')
+
+    def actual_counts(self):
+        return {kind: model.objects.count() for kind, model in process_data.TRANSACTION_MODELS.items()}
+
+    def test_home_page_reads_the_cached_counts(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            process_xml_file(build_backup(SAMPLE_BODIES), self.user)
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('home'))
+        with self.assertNumQueries(0):
+            self.client.get(reverse('home'))
+        actual = self.actual_counts()
+        self.assertEqual(
+            {kind: count for kind, count in transaction_counts.counts().items() if count},
+            {kind: count for kind, count in actual.items() if count},
+        )
+        self.assertEqual(response.context['incoming_count'], IncomingMoney.objects.count())
+        self.assertEqual(
+            response.context['outgoing_count'],
+            PaymentToCodeHolder.objects.count() + TransferToMobile.objects.count() + BankTransfer.objects.count(),
+        )
+        self.assertEqual(response.context['total_transactions'], sum(actual.values()))
+
+    def test_upload_invalidates_the_counts(self):
+        self.assertEqual(self.client.get(reverse('home')).context['total_transactions'], 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            process_xml_file(build_backup(SAMPLE_BODIES), self.user)
+        total = sum(self.actual_counts().values())
+        self.assertEqual(self.client.get(reverse('home')).context['total_transactions'], total)
+        # Re-uploading the same backup adds nothing
+        with self.captureOnCommitCallbacks(execute=True):
+            process_xml_file(build_backup(SAMPLE_BODIES), self.user)
+        self.assertEqual(self.client.get(reverse('home')).context['total_transactions'], total)
+
+    def test_rebuild_recounts(self):
+        process_xml_file(build_backup(SAMPLE_BODIES), self.user)
+        IncomingMoney.objects.all().delete()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('rebuild_transaction_counts', stdout=io.StringIO())
+        self.assertEqual(transaction_counts.counts(), self.actual_counts())
+
+
+class RequestMetricsTestCase(TestCase):
+    def setUp(self):
+        request_metrics.reset()
+        self.user = CustomUser.objects.create_user(email='metrics@example.com', password='secret')
+
+    def test_metrics_endpoint_serves_per_view_histograms(self):
+        self.client.force_login(self.user)
+        self.client.get(reverse('dashboard'))
+        self.client.get(reverse('dashboard'))
+        self.client.get('/no-such-page/')
+
+        self.assertEqual(self.client.get(reverse('metrics'), REMOTE_ADDR='10.0.0.1').status_code, 403)
+        with override_settings(METRICS_ALLOWED_IPS=['127.0.0.1']):
+            response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        text = response.content.decode()
+        self.assertIn('# TYPE mmony_request_duration_seconds histogram', text)
+        self.assertIn('mmony_request_queries_count{view="dashboard"} 2', text)
+        self.assertIn('mmony_request_queries_bucket{view="dashboard",le="+Inf"} 2', text)
+        self.assertIn('mmony_response_size_bytes_count{view="dashboard"} 2', text)
+        self.assertIn('mmony_request_sql_seconds_count{view="unresolved"} 1', text)
+        self.assertNotIn('peak_allocations', text)
+        # Buckets are cumulative
+        buckets = [
+            int(line.rsplit(' ', 1)[1]) for line in text.splitlines()
+            if line.startswith('mmony_request_queries_bucket{view="dashboard"')
+        ]
+        self.assertEqual(buckets, sorted(buckets))
+
+    def test_metrics_are_private_by_default(self):
+        # Behind a reverse proxy on the same host, every request comes from
+        # loopback
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        self.user.is_staff = True
+        self.user.save()
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 200)
+
+    @override_settings(METRICS_ALLOWED_IPS=['10.0.0.5'], METRICS_CLIENT_IP_HEADER='HTTP_X_FORWARDED_FOR')
+    def test_trusted_proxy_header_gives_the_client_address(self):
+        url = reverse('metrics')
+        self.assertEqual(self.client.get(url, HTTP_X_FORWARDED_FOR='10.0.0.5').status_code, 200)
+        # Only the address the proxy appended counts
+        self.assertEqual(self.client.get(url, HTTP_X_FORWARDED_FOR='10.0.0.5, 203.0.113.9').status_code, 403)
+        self.assertEqual(self.client.get(url, REMOTE_ADDR='10.0.0.5').status_code, 403)
+
+    def test_result_cache_counters_are_exported(self):
+        result_cache.stats.clear()
+        cache.clear()
+        self.client.force_login(self.user)
+        get_widget(self.client, 'analysis', 'anomalies')
+        get_widget(self.client, 'analysis', 'anomalies')
+        text = request_metrics.render()
+        self.assertIn('# TYPE mmony_result_cache_lookups_total counter', text)
+        self.assertIn('mmony_result_cache_lookups_total{method="AnalysisView.get_anomalies",result="miss"} 1', text)
+        self.assertIn('mmony_result_cache_lookups_total{method="AnalysisView.get_anomalies",result="hit"} 1', text)
+
+    def test_allocations_are_traced_when_enabled(self):
+        with override_settings(REQUEST_METRICS_TRACE_ALLOCATIONS=True):
+            middleware = RequestMetricsMiddleware(lambda request: HttpResponse(b'x' * 100))
+        self.addCleanup(tracemalloc.stop)
+        request = RequestFactory().get('/')
+        middleware(request)
+        self.assertIn('mmony_request_peak_allocations_bytes_count{view="unresolved"} 1', request_metrics.render())
+
+    @override_settings(DEBUG=True, REQUEST_METRICS_REPEATED_QUERIES=3)
+    def test_repeated_queries_are_logged_in_debug(self):
+        def n_plus_one(request):
+            for pk in range(4):
+                CustomUser.objects.filter(pk=pk).exists()
+            CounterpartyTotal.objects.count()
+            CounterpartyTotal.objects.count()
+            return HttpResponse()
+
+        with self.assertLogs('transactions.middleware', 'WARNING') as logs:
+            RequestMetricsMiddleware(n_plus_one)(RequestFactory().get('/'))
+        self.assertEqual(len(logs.output), 2)
+        self.assertIn('similar query run 4 times, from transactions/tests.py', logs.output[0])
+        self.assertIn('in n_plus_one', logs.output[0])
+        self.assertIn('duplicate query run 2 times', logs.output[1])
+
+        with override_settings(DEBUG=False), self.assertNoLogs('transactions.middleware'):
+            RequestMetricsMiddleware(n_plus_one)(RequestFactory().get('/'))
+
+
+class SMSParserTestCase(TestCase):
+    def test_classifies_every_category(self):
+        kinds = [sms_parser.parse_sms(body).kind for body in SAMPLE_BODIES]
+        self.assertEqual(kinds, [
+            sms_parser.SYSTEM, sms_parser.INCOMING, sms_parser.INCOMING, sms_parser.PAYMENT_TO_CODE,
+            sms_parser.PAYMENT_TO_CODE, sms_parser.MOBILE_TRANSFER, sms_parser.BANK_DEPOSIT,
+            sms_parser.AIRTIME_BILL, sms_parser.CASH_POWER_BILL, sms_parser.BILL_PAYMENT,
+            sms_parser.THIRD_PARTY, sms_parser.WITHDRAWAL, sms_parser.BANK_TRANSFER,
+            sms_parser.INTERNET_BUNDLE, sms_parser.VOICE_BUNDLE, sms_parser.IGNORED,
+        ])
+
+    def test_extracts_all_fields_in_one_result(self):
+        result = sms_parser.parse_sms(SAMPLE_BODIES[5])
+        self.assertIsNone(result.reason)
+        self.assertEqual(result.fields, {
+            'amount': 10000,
+            'recipient': 'Samuel Carter',
+            'recipient_number': '250791666666',
+            'date_time': '2024-05-11 20:34:47',
+            'fee': 100,
+        })
+
+    def test_bank_transfers_are_not_taken_for_withdrawals(self):
+        # Both start with "You "
+        result = sms_parser.parse_sms(SAMPLE_BODIES[12])
+        self.assertEqual(result.kind, sms_parser.BANK_TRANSFER)
+        self.assertIsNone(result.reason)
+        self.assertEqual(result.fields, {
+            'amount': 30000,
+            'recipient': 'Jane Smith (250790777777)',
+            'date_time': '2024-06-01 10:00:00',
+        })
+        self.assertEqual(sms_parser.parse_sms(SAMPLE_BODIES[11]).kind, sms_parser.WITHDRAWAL)
+
+    def test_missing_fields_report_a_reason(self):
+        result = sms_parser.parse_sms(SAMPLE_BODIES[2])
+        self.assertIsNone(result.fields)
+        self.assertIn("Incoming Money", result.reason)
+
+    def test_fields_may_be_separated_by_line_breaks(self):
+        body = SAMPLE_BODIES[1].replace(" Your new balance", "\nYour new balance")
+        self.assertEqual(sms_parser.parse_sms(body).fields['transaction_id'], '76662021700')
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class IngestionJobTestCase(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+        self.user = CustomUser.objects.create_user(email='jobs@example.com', password='secret')
+        self.client.force_login(self.user)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def upload(self, bodies=SAMPLE_BODIES):
+        backup = SimpleUploadedFile('backup.xml', build_backup(bodies).getvalue(), content_type='text/xml')
+        return self.client.post(reverse('upload'), {'file': backup})
+
+    def test_upload_queues_a_job_without_processing_it(self):
+        response = self.upload()
+        job = IngestionJob.objects.get(user=self.user)
+        self.assertRedirects(response, f"{reverse('upload')}?job={job.pk}")
+        self.assertEqual(job.status, IngestionJob.STATUS_QUEUED)
+        self.assertFalse(IncomingMoney.objects.filter(user=self.user).exists())
+
+    def test_worker_processes_queued_jobs(self):
+        self.upload()
+        self.assertEqual(run_pending_jobs(), 1)
+        job = IngestionJob.objects.get(user=self.user)
+        self.assertEqual(job.status, IngestionJob.STATUS_SUCCEEDED)
+        self.assertEqual(job.message_count, len(SAMPLE_BODIES))
+        self.assertEqual(job.transaction_count, 11)
+        self.assertEqual(job.failed_count, 3)
+        self.assertIsNotNone(job.duration)
+        self.assertEqual(IncomingMoney.objects.filter(user=self.user).count(), 1)
+        self.assertEqual(run_pending_jobs(), 0)
+
+    def test_worker_stores_the_run_report(self):
+        self.upload()
+        with override_settings(INGESTION_TRACE_MEMORY=True):
+            run_pending_jobs()
+        job = IngestionJob.objects.get(user=self.user)
+        report = job.report
+        self.assertEqual(report['messages'], len(SAMPLE_BODIES))
+        self.assertEqual((report['transactions'], report['failed'], report['duplicates']), (11, 3, 0))
+        self.assertTrue(report['committed'])
+        self.assertEqual(sum(category['messages'] for category in report['categories'].values()), len(SAMPLE_BODIES))
+        self.assertEqual(sum(category['failed'] for category in report['categories'].values()), 3)
+        self.assertEqual(report['categories'][sms_parser.INCOMING], {
+            'messages': 2, 'failed': 1, 'seconds': report['categories'][sms_parser.INCOMING]['seconds'],
+        })
+        self.assertEqual(report['models']['IncomingMoney']['rows'], 1)
+        self.assertEqual(report['models']['FailedSMSLog']['rows'], 2)
+        timings = report['seconds']
+        self.assertGreater(timings['total'], 0)
+        self.assertLessEqual(timings['parse'] + timings['classify'] + timings['write'], timings['total'])
+        self.assertGreater(report['messages_per_second'], 0)
+        self.assertGreater(report['peak_memory_bytes'], 0)
+
+        out = io.StringIO()
+        call_command('ingestion_report', stdout=out)
+        self.assertIn(f"{job.pk:>6} ", out.getvalue())
+        out = io.StringIO()
+        call_command('ingestion_report', str(job.pk), stdout=out)
+        self.assertIn('IncomingMoney', out.getvalue())
+        with self.assertRaises(CommandError):
+            call_command('ingestion_report', str(job.pk + 1), stdout=io.StringIO())
+
+    def test_failed_job_keeps_a_partial_report(self):
+        backup = SimpleUploadedFile('broken.xml', build_backup(SAMPLE_BODIES).getvalue()[:-len(b"</smses>")], content_type='text/xml')
+        self.client.post(reverse('upload'), {'file': backup})
+        run_pending_jobs()
+        job = IngestionJob.objects.get(user=self.user)
+        self.assertEqual(job.status, IngestionJob.STATUS_FAILED)
+        report = job.report
+        # The totals agree with the per-category counts of the messages read
+        # before the error
+        self.assertEqual(sum(category['messages'] for category in report['categories'].values()), len(SAMPLE_BODIES))
+        self.assertEqual(report['messages'], len(SAMPLE_BODIES))
+        self.assertEqual(report['failed'], sum(category['failed'] for category in report['categories'].values()))
+        self.assertEqual(report['transactions'], 11)
+        self.assertFalse(report['committed'])
+        self.assertIsNone(report['peak_memory_bytes'])
+        out = io.StringIO()
+        call_command('ingestion_report', str(job.pk), stdout=out)
+        self.assertIn('rolled back', out.getvalue())
+
+    def abandon(self, attempts=1, minutes_ago=30):
+        # A job left running by a worker that was killed mid-upload
+        self.upload()
+        job = IngestionJob.objects.get(user=self.user)
+        started_at = timezone.now() - timedelta(minutes=minutes_ago)
+        IngestionJob.objects.filter(pk=job.pk).update(
+            status=IngestionJob.STATUS_RUNNING, attempts=attempts,
+            started_at=started_at, heartbeat_at=started_at,
+        )
+        return job
+
+    def test_stale_running_job_is_requeued_and_processed(self):
+        job = self.abandon()
+        self.assertEqual(recover_stale_jobs(), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.started_at), (IngestionJob.STATUS_QUEUED, None))
+        self.assertEqual(run_pending_jobs(), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (IngestionJob.STATUS_SUCCEEDED, 2))
+        # Set again when the job was claimed
+        self.assertGreater(job.heartbeat_at, timezone.now() - timedelta(minutes=1))
+
+    def test_stale_job_fails_after_max_attempts(self):
+        job = self.abandon(attempts=2)
+        self.assertEqual(recover_stale_jobs(), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, IngestionJob.STATUS_FAILED)
+        self.assertIn('2 attempts', job.error)
+        self.assertIsNotNone(job.finished_at)
+        self.assertEqual(run_pending_jobs(), 0)
+
+    def test_live_or_recent_jobs_are_not_recovered(self):
+        job = self.abandon(minutes_ago=1)
+        self.assertEqual(recover_stale_jobs(), 0)
+        # Started long ago but still beating
+        IngestionJob.objects.filter(pk=job.pk).update(started_at=timezone.now() - timedelta(hours=2))
+        self.assertEqual(recover_stale_jobs(), 0)
+        job.refresh_from_db()
+        self.assertEqual(job.status, IngestionJob.STATUS_RUNNING)
+
+    def test_incremental_upload_skips_messages_before_watermark(self):
+        self.upload(SAMPLE_BODIES[:8])
+        run_pending_jobs()
+        self.assertEqual(XMLFile.watermark_for(self.user), 1700000000007)
+
+        # A fuller backup of the same phone: only the message at the
+        # watermark and the ones after it are classified
+        self.upload()
+        with mock.patch.object(sms_parser, 'parse_sms', wraps=sms_parser.parse_sms) as parse_sms:
+            run_pending_jobs()
+        self.assertEqual(parse_sms.call_count, len(SAMPLE_BODIES) - 7)
+        self.assertEqual(XMLFile.watermark_for(self.user), 1700000000015)
+        self.assertEqual(IncomingMoney.objects.filter(user=self.user).count(), 1)
+        self.assertEqual(WithdrawalFromAgent.objects.filter(user=self.user).count(), 1)
+        self.assertEqual(FailedSMSLog.objects.filter(user=self.user).count(), 2)
+
+    def test_failed_job_records_error(self):
+        backup = SimpleUploadedFile('broken.xml', b'<smses><sms body="x" />', content_type='text/xml')
+        self.client.post(reverse('upload'), {'file': backup})
+        run_pending_jobs()
+        job = IngestionJob.objects.get(user=self.user)
+        self.assertEqual(job.status, IngestionJob.STATUS_FAILED)
+        self.assertIn('ParseError', job.error)
+
+    def test_progress_endpoint(self):
+        self.upload()
+        job = IngestionJob.objects.get(user=self.user)
+        url = reverse('ingestion_job_progress', args=[job.pk])
+        self.assertEqual(self.client.get(url).json()['status'], 'queued')
+        run_pending_jobs()
+        progress = self.client.get(url).json()
+        self.assertEqual(progress['status'], 'succeeded')
+        self.assertEqual(progress['percent'], 100.0)
+
+        other = CustomUser.objects.create_user(email='other@example.com', password='secret')
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(url).status_code, 404)
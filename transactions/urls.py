@@ -1,11 +1,20 @@
 from django.urls import path
-from .views import HomeView, UploadView, DashboardView, AnalysisView
-from .views_receiver_history import ReceiverHistoryView
+from .views import (
+    HomeView, UploadView, IngestionJobProgressView, BalanceSeriesView, DashboardView, AnalysisView,
+    WidgetDataView, MetricsView,
+)
+from .views_receiver_history import ReceiverHistoryView, ReceiverHistoryPageView
 
 urlpatterns = [
     path('', HomeView.as_view(), name='home'),
     path('upload/', UploadView.as_view(), name='upload'),
+    path('upload/jobs/<int:pk>/progress/', IngestionJobProgressView.as_view(), name='ingestion_job_progress'),
     path('dashboard/', DashboardView.as_view(), name='dashboard'),
+    path('dashboard/widgets/<slug:widget>/', WidgetDataView.as_view(page_view=DashboardView), name='dashboard_widget'),
     path('analysis/', AnalysisView.as_view(), name='analysis'),
+    path('analysis/widgets/<slug:widget>/', WidgetDataView.as_view(page_view=AnalysisView), name='analysis_widget'),
+    path('analysis/balance/', BalanceSeriesView.as_view(), name='balance_series'),
     path('receiver-history/', ReceiverHistoryView.as_view(), name='receiver_history'),
+    path('receiver-history/page/', ReceiverHistoryPageView.as_view(), name='receiver_history_page'),
+    path('metrics', MetricsView.as_view(), name='metrics'),
 ]
@@ -0,0 +1,140 @@
+"""
+Vectorised anomaly detection for the analysis page.
+
+Flags three kinds of anomalies over a user's transactions:
+
+* amounts more than three standard deviations above the overall mean,
+* amounts more than three standard deviations above the mean of their
+  transaction type,
+* transactions between 22:00 and 05:59.
+
+All statistics and flags are computed in a few NumPy passes over column
+arrays (per-type statistics with ``bincount`` over integer type codes); Python
+objects are only built for the rows that are reported. The records match
+those of the former pandas implementation: one per flagged transaction, the
+first matching rule in the order above wins, and every record has the keys
+of all the rules that reported something (NaN where a rule doesn't apply).
+
+Like ``sms_parser`` this module has no Django dependencies.
+"""
+
+import numpy as np
+
+HIGH_AMOUNT = 'High Amount'
+HIGH_AMOUNT_FOR_TYPE = 'High Amount for {}'
+UNUSUAL_TIME = 'Unusual Time (Late Night/Early Morning)'
+
+# Hours (inclusive) outside of which a transaction is considered unusual
+NIGHT_START = 22
+NIGHT_END = 5
+
+# Record keys common to all rules, then the keys each rule adds, in the
+# order they appear in the records
+BASE_KEYS = ('date_time', 'amount', 'type', 'id', 'description', 'sender', 'recipient')
+OVERALL_KEYS = ('anomaly_type', 'threshold', 'deviation_percent', 'overall_mean', 'times_above_mean')
+TYPE_KEYS = ('anomaly_type', 'threshold', 'type_mean', 'deviation_percent', 'times_above_type_mean')
+NIGHT_KEYS = ('hour', 'anomaly_type', 'unusual_hour')
+
+_OVERALL, _TYPE, _NIGHT = 0, 1, 2
+_RULE_KEYS = {_OVERALL: OVERALL_KEYS, _TYPE: TYPE_KEYS, _NIGHT: NIGHT_KEYS}
+
+
+def _std(sum_sq, count):
+    # Sample standard deviation, NaN with fewer than two values
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(count > 1, np.sqrt(sum_sq / (count - 1)), np.nan)
+
+
+def type_statistics(amounts, codes, type_count):
+    """Per-type (mean, standard deviation, count) arrays indexed by type code."""
+    counts = np.bincount(codes, minlength=type_count)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = np.bincount(codes, weights=amounts, minlength=type_count) / counts
+    deviations = amounts - means[codes]
+    sum_sq = np.bincount(codes, weights=deviations * deviations, minlength=type_count)
+    return means, _std(sum_sq, counts), counts
+
+
+def detect_anomalies(date_times, amounts, types, ids, hours, descriptions=None, senders=None, recipients=None):
+    """
+    Return anomaly records for transactions given as parallel columns.
+    ``amounts`` are signed, ``types`` are type labels and ``hours`` the hour
+    of each ``date_time``; the text columns default to empty strings.
+    """
+    amounts = np.asarray(amounts, dtype=np.float64)
+    hours = np.asarray(hours, dtype=np.int64)
+    if amounts.size == 0:
+        return []
+    type_names, codes = np.unique(np.asarray(types), return_inverse=True)
+
+    overall_mean = amounts.mean()
+    overall_std = amounts.std(ddof=1) if amounts.size > 1 else np.nan
+    overall_threshold = overall_mean + 3 * overall_std
+    type_means, type_stds, _ = type_statistics(amounts, codes, len(type_names))
+    type_thresholds = type_means + 3 * type_stds
+
+    # Rows flagged by each rule, in report order: overall outliers, then
+    # per-type outliers grouped by type name, then night-time transactions
+    overall_rows = np.flatnonzero(amounts > overall_threshold)
+    type_rows = np.flatnonzero(amounts > type_thresholds[codes])
+    type_rows = type_rows[np.argsort(codes[type_rows], kind='stable')]
+    night_rows = np.flatnonzero((hours >= NIGHT_START) | (hours <= NIGHT_END))
+
+    sizes = {_OVERALL: overall_rows.size, _TYPE: type_rows.size, _NIGHT: night_rows.size}
+    rows = np.concatenate([overall_rows, type_rows, night_rows])
+    rules = np.repeat(list(sizes), list(sizes.values()))
+    # Keep the first report of each transaction
+    _, first = np.unique(rows, return_index=True)
+    first.sort()
+    rows, rules = rows[first], rules[first]
+    if rows.size == 0:
+        return []
+
+    # Every record has the keys of each rule that flagged any transaction,
+    # even if all of them were reported by an earlier rule
+    keys = list(BASE_KEYS)
+    for rule, size in sizes.items():
+        if size:
+            keys.extend(key for key in _RULE_KEYS[rule] if key not in keys)
+    # Hours stay integers only when no record lacks them
+    night_only = not sizes[_OVERALL] and not sizes[_TYPE]
+    empty = dict.fromkeys(keys, np.nan)
+
+    # Rule-specific values, computed for the reported rows only
+    row_amounts = amounts[rows]
+    row_codes = codes[rows]
+    thresholds = np.where(rules == _OVERALL, overall_threshold, type_thresholds[row_codes])
+    means = np.where(rules == _OVERALL, overall_mean, type_means[row_codes])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        deviation = np.round((row_amounts - thresholds) / thresholds * 100, 2)
+        times_above = np.round(row_amounts / means, 2)
+    row_hours = hours[rows]
+
+    records = []
+    for i, (row, rule) in enumerate(zip(rows.tolist(), rules.tolist())):
+        record = dict(empty)
+        record['date_time'] = date_times[row]
+        record['amount'] = float(row_amounts[i])
+        record['type'] = str(type_names[row_codes[i]])
+        record['id'] = ids[row]
+        record['description'] = descriptions[row] if descriptions is not None else ''
+        record['sender'] = senders[row] if senders is not None else ''
+        record['recipient'] = recipients[row] if recipients is not None else ''
+        if rule == _OVERALL:
+            record['anomaly_type'] = HIGH_AMOUNT
+            record['threshold'] = float(overall_threshold)
+            record['deviation_percent'] = float(deviation[i])
+            record['overall_mean'] = float(overall_mean)
+            record['times_above_mean'] = float(times_above[i])
+        elif rule == _TYPE:
+            record['anomaly_type'] = HIGH_AMOUNT_FOR_TYPE.format(record['type'])
+            record['threshold'] = float(thresholds[i])
+            record['type_mean'] = float(means[i])
+            record['deviation_percent'] = float(deviation[i])
+            record['times_above_type_mean'] = float(times_above[i])
+        else:
+            hour = int(row_hours[i])
+            record['anomaly_type'] = UNUSUAL_TIME
+            record['hour'] = record['unusual_hour'] = hour if night_only else float(hour)
+        records.append(record)
+    return records
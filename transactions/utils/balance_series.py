@@ -0,0 +1,72 @@
+"""
+Downsampled running-balance series for charts.
+
+The balance chart never needs every ledger entry: ``lttb`` keeps the points
+that preserve the shape of the series (Largest-Triangle-Three-Buckets, from
+Steinarsson's "Downsampling Time Series for Visual Representation") and
+``daily`` starts from the closing balance of each day, read from the daily
+rollups, so the payload stays bounded whatever the length of the history.
+"""
+
+import numpy as np
+from django.db.models import Sum
+
+from ..models import DailyRollup, LedgerEntry
+from .rollups import period_start
+
+LTTB = 'lttb'
+DAILY = 'daily'
+METHODS = (LTTB, DAILY)
+
+
+def lttb(x, y, threshold):
+    """
+    Indices of the ``threshold`` points of (x, y) that LTTB keeps: the first
+    and last, and from each of the buckets in between the point forming the
+    largest triangle with the previous kept point and the next bucket's
+    average. ``x`` must be increasing.
+    """
+    size = len(x)
+    if threshold >= size or threshold < 3:
+        return np.arange(size)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    every = (size - 2) / (threshold - 2)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = kept = 0
+    for bucket in range(threshold - 2):
+        start = int(bucket * every) + 1
+        end = int((bucket + 1) * every) + 1
+        next_end = min(int((bucket + 2) * every) + 1, size)
+        average_x = x[end:next_end].mean()
+        average_y = y[end:next_end].mean()
+        areas = np.abs(
+            (x[kept] - average_x) * (y[start:end] - y[kept])
+            - (x[kept] - x[start:end]) * (average_y - y[kept])
+        )
+        kept = start + int(areas.argmax())
+        selected[bucket + 1] = kept
+    selected[-1] = size - 1
+    return selected
+
+
+def balance_series(user, method=LTTB, points=1000):
+    """
+    Return the user's balance as a list of {'date_time', 'balance'} points,
+    per ledger entry or per day, reduced to at most ``points`` with LTTB.
+    """
+    if method == DAILY:
+        # Closing balance of each day: running sum of the daily totals
+        totals = DailyRollup.objects.filter(user=user).values('period').annotate(total=Sum('amount')).order_by('period')
+        rows = []
+        balance = 0
+        for row in totals:
+            balance += row['total']
+            rows.append((period_start(row['period']), balance))
+    else:
+        rows = list(LedgerEntry.objects.filter(user=user).order_by('date_time', 'id').values_list('date_time', 'balance'))
+    if len(rows) > points:
+        timestamps = [date_time.timestamp() for date_time, _ in rows]
+        balances = [balance or 0 for _, balance in rows]
+        rows = [rows[i] for i in lttb(timestamps, balances, points).tolist()]
+    return [{'date_time': date_time, 'balance': balance} for date_time, balance in rows]
@@ -0,0 +1,139 @@
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connections, router
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+def has_fingerprint(model):
+    return any(field.name == 'fingerprint' for field in model._meta.concrete_fields)
+
+
+def get_batch_size(batch_size=None):
+    if batch_size:
+        return batch_size
+    return getattr(settings, 'INGESTION_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+
+
+def add_to_totals(model, rows, unique_fields, total_fields):
+    """
+    Insert ``rows``, unsaved instances of ``model``, or where a row with the
+    same ``unique_fields`` is already stored, add their ``total_fields`` to
+    it. The addition is done by the database in an
+    ``INSERT ... ON CONFLICT DO UPDATE SET f = f + excluded.f`` (PostgreSQL
+    and SQLite), so concurrent uploads adding to the same row can't overwrite
+    each other's totals the way reading and writing them back would.
+    """
+    if not rows:
+        return
+    connection = connections[router.db_for_write(model)]
+    quote = connection.ops.quote_name
+    opts = model._meta
+    fields = [field for field in opts.concrete_fields if not field.primary_key]
+    table = quote(opts.db_table)
+    conflict = ', '.join(quote(opts.get_field(name).column) for name in unique_fields)
+    updates = ', '.join(
+        f'{column} = {table}.{column} + EXCLUDED.{column}'
+        for column in (quote(opts.get_field(name).column) for name in total_fields)
+    )
+    placeholders = '(' + ', '.join(['%s'] * len(fields)) + ')'
+    batch_size = min(get_batch_size(), connection.ops.bulk_batch_size(fields, rows))
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            params = [
+                field.get_db_prep_save(getattr(row, field.attname), connection)
+                for row in batch for field in fields
+            ]
+            cursor.execute(
+                f'INSERT INTO {table} ({", ".join(quote(field.column) for field in fields)}) '
+                f'VALUES {", ".join([placeholders] * len(batch))} '
+                f'ON CONFLICT ({conflict}) DO UPDATE SET {updates}',
+                params,
+            )
+
+
+class BulkWriter:
+    """
+    Buffers unsaved model instances per model and writes each buffer with a
+    single ``bulk_create`` once it reaches ``batch_size``.
+
+    Used as a context manager, remaining rows are flushed on a clean exit and
+    discarded if the block raises, so wrapping it in ``transaction.atomic()``
+    gives one transaction per upload.
+
+    For models with a ``fingerprint`` field, rows whose (user, fingerprint)
+    is already stored, or repeated within the batch, are dropped before the
+    insert and counted in ``duplicates``; the insert itself ignores conflicts
+    in case a concurrent upload stored the same rows first.
+
+    ``before_flush``, if given, is called with the model and the rows about
+    to be inserted (duplicates already dropped) before every write, e.g. to
+    fill in foreign keys; ``on_flush`` with the model and the rows inserted
+    after every write, e.g. to maintain tables derived from them.
+    """
+
+    def __init__(self, batch_size=None, on_flush=None, before_flush=None):
+        self.batch_size = get_batch_size(batch_size)
+        self.on_flush = on_flush
+        self.before_flush = before_flush
+        self.buffers = defaultdict(list)
+        self.counts = defaultdict(int)
+        self.duplicates = defaultdict(int)
+        # Time spent writing each model's rows, hooks included
+        self.seconds = defaultdict(float)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+        else:
+            self.buffers.clear()
+        return False
+
+    def add(self, instance):
+        model = type(instance)
+        buffer = self.buffers[model]
+        buffer.append(instance)
+        if len(buffer) >= self.batch_size:
+            self.flush(model)
+
+    def flush(self, model=None):
+        models = [model] if model is not None else list(self.buffers)
+        for model in models:
+            buffer = self.buffers.pop(model, None)
+            if not buffer:
+                continue
+            start = time.perf_counter()
+            if has_fingerprint(model):
+                rows = self.drop_duplicates(model, buffer)
+                self.duplicates[model] += len(buffer) - len(rows)
+            else:
+                rows = buffer
+            if self.before_flush is not None:
+                self.before_flush(model, rows)
+            model.objects.bulk_create(rows, batch_size=self.batch_size, ignore_conflicts=has_fingerprint(model))
+            self.counts[model] += len(rows)
+            if self.on_flush is not None:
+                self.on_flush(model, rows)
+            self.seconds[model] += time.perf_counter() - start
+
+    def drop_duplicates(self, model, buffer):
+        user_ids = {obj.user_id for obj in buffer}
+        fingerprints = {obj.fingerprint for obj in buffer}
+        seen = set(
+            model.objects.filter(user_id__in=user_ids, fingerprint__in=fingerprints)
+            .values_list('user_id', 'fingerprint')
+        )
+        rows = []
+        for obj in buffer:
+            key = (obj.user_id, obj.fingerprint)
+            if obj.fingerprint is not None and obj.user_id is not None and key in seen:
+                continue
+            seen.add(key)
+            rows.append(obj)
+        return rows
@@ -0,0 +1,41 @@
+"""
+Columnar JSON payloads for the dashboard and analysis widgets.
+
+The pages render as a shell and fetch each widget's data from its own
+endpoint. Rows are sent as one array per field rather than a list of
+objects, so field names appear once per payload and each array holds values
+of a single type, which keeps the payloads small and compresses well.
+"""
+
+from decimal import Decimal
+
+from django.http import JsonResponse
+
+
+def compact(value):
+    # Decimals as JSON numbers rather than the strings DjangoJSONEncoder
+    # makes of them
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+
+def columns(rows, fields=None):
+    """
+    ``{field: [value of each row]}`` for a list of dicts. ``fields`` default
+    to every key of the rows, in order of first appearance; rows without a
+    field get None.
+    """
+    if fields is None:
+        fields = list(dict.fromkeys(key for row in rows for key in row))
+    return {field: [compact(row.get(field)) for row in rows] for field in fields}
+
+
+def mapping_columns(mapping, key_field, value_field):
+    """``{key_field: [keys], value_field: [values]}`` for a dict."""
+    return {key_field: list(mapping), value_field: [compact(value) for value in mapping.values()]}
+
+
+def response(data):
+    # Compact separators: the payloads are mostly punctuation and numbers
+    return JsonResponse(data, json_dumps_params={'separators': (',', ':')})
@@ -0,0 +1,287 @@
+"""
+Counterparties: the people, agents and merchants a user exchanges money with.
+
+Names and phone numbers come from regex captures in the SMS bodies and vary
+in case, spacing and number format from one message to the next. Each
+distinct (normalized name, normalized number) of a user is stored once as a
+``Counterparty`` and the transaction rows point at it:
+
+* at ingestion, a ``CounterpartyCache`` per upload resolves the rows of each
+  batch before they are inserted, creating the counterparties it hasn't
+  seen, so every name costs one lookup per upload;
+* ``manage.py rebuild_counterparties`` links the rows written before (or
+  outside) the pipeline.
+
+The names and numbers carry a trigram index, so the receiver history's
+substring searches don't scan the transaction tables:
+
+* on SQLite, an external-content FTS5 table with the trigram tokenizer,
+  kept in sync with triggers, which answers ``LIKE '%text%'`` from its index;
+* on PostgreSQL, pg_trgm GIN indexes on ``UPPER(name)`` and ``UPPER(number)``,
+  which serve Django's ``icontains`` lookups. Where the extension can't be
+  created (managed databases only allow extensions on their allow-list, and
+  the app's role may lack the privilege), the indexes are skipped and the
+  same lookups scan the counterparty table.
+
+The migrations keep their own copies of these statements, so changing them
+here doesn't change what an applied migration did.
+
+``search`` returns the counterparties matching a search as a subquery, so
+the history filters become ``counterparty IN (...)`` lookups on the (user,
+counterparty) indexes. SQLite only prefers those indexes to walking the
+history by date once it has statistics on the tables, which
+``update_statistics`` gathers after ingestion and rebuilds.
+"""
+
+import logging
+import unicodedata
+from collections import defaultdict
+
+from django.db import DatabaseError, connection, transaction
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from ..models import (
+    BankTransfer, Counterparty, IncomingMoney, PaymentToCodeHolder, ThirdPartyTransaction,
+    TransferToMobile, WithdrawalFromAgent,
+)
+from .bulk_writer import get_batch_size
+
+logger = logging.getLogger(__name__)
+
+# Transaction models with a counterparty: (name field, number field or None)
+SOURCES = {
+    IncomingMoney: ('sender', None),
+    PaymentToCodeHolder: ('recipient', None),
+    TransferToMobile: ('recipient', 'recipient_number'),
+    ThirdPartyTransaction: ('initiated_by', None),
+    WithdrawalFromAgent: ('agent_name', 'agent_number'),
+    BankTransfer: ('recipient', None),
+}
+
+SEARCH_FIELDS = ('name', 'number')
+
+TABLE = Counterparty._meta.db_table
+FTS_TABLE = f'{TABLE}_search'
+
+SQLITE_INDEX = [
+    f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5("
+    f"name, number, content='{TABLE}', content_rowid='id', tokenize='trigram')",
+    f"CREATE TRIGGER {FTS_TABLE}_insert AFTER INSERT ON {TABLE} BEGIN "
+    f"INSERT INTO {FTS_TABLE}(rowid, name, number) VALUES (new.id, new.name, new.number); END",
+    f"CREATE TRIGGER {FTS_TABLE}_delete AFTER DELETE ON {TABLE} BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, number) VALUES ('delete', old.id, old.name, old.number); END",
+    f"CREATE TRIGGER {FTS_TABLE}_update AFTER UPDATE ON {TABLE} BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, number) VALUES ('delete', old.id, old.name, old.number); "
+    f"INSERT INTO {FTS_TABLE}(rowid, name, number) VALUES (new.id, new.name, new.number); END",
+    # Index the rows already in the table
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')",
+]
+SQLITE_DROP_INDEX = [
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_insert",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_delete",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_update",
+    f"DROP TABLE IF EXISTS {FTS_TABLE}",
+]
+POSTGRESQL_INDEX = ["CREATE EXTENSION IF NOT EXISTS pg_trgm"] + [
+    f"CREATE INDEX IF NOT EXISTS {TABLE}_{field}_trgm ON {TABLE} USING gin (UPPER({field}) gin_trgm_ops)"
+    for field in SEARCH_FIELDS
+]
+POSTGRESQL_DROP_INDEX = [f"DROP INDEX IF EXISTS {TABLE}_{field}_trgm" for field in SEARCH_FIELDS]
+
+
+def create_search_index(schema_editor):
+    # Migrations 0013 and 0014 run their own copies of this. SQLite builds
+    # without FTS5 or its trigram tokenizer (before 3.34) keep working
+    # without the index
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        try:
+            with schema_editor.connection.cursor() as cursor:
+                for statement in SQLITE_INDEX:
+                    cursor.execute(statement)
+        except DatabaseError:
+            drop_search_index(schema_editor)
+    elif vendor == 'postgresql':
+        # In a savepoint, as a failed statement aborts the whole transaction
+        # on PostgreSQL
+        try:
+            with transaction.atomic(using=schema_editor.connection.alias), schema_editor.connection.cursor() as cursor:
+                for statement in POSTGRESQL_INDEX:
+                    cursor.execute(statement)
+        except DatabaseError as exc:
+            logger.warning("Counterparty search indexes not created, searches will scan the table: %s", exc)
+
+
+def drop_search_index(schema_editor):
+    statements = {'sqlite': SQLITE_DROP_INDEX, 'postgresql': POSTGRESQL_DROP_INDEX}
+    with schema_editor.connection.cursor() as cursor:
+        for statement in statements.get(schema_editor.connection.vendor, []):
+            cursor.execute(statement)
+
+
+def update_statistics(db_connection=connection):
+    # Sampled ANALYZE of the tables the receiver history searches, so the
+    # SQLite planner knows how selective a counterparty is; PostgreSQL keeps its
+    # own statistics
+    if db_connection.vendor != 'sqlite':
+        return
+    with db_connection.cursor() as cursor:
+        cursor.execute("PRAGMA analysis_limit=1000")
+        for table in [model._meta.db_table for model in SOURCES] + [TABLE]:
+            cursor.execute(f"ANALYZE {table}")
+
+
+# Whether each SQLite database (by name) has the FTS5 index
+_fts_databases = {}
+
+
+def has_fts_index():
+    if connection.vendor != 'sqlite':
+        return False
+    name = connection.settings_dict['NAME']
+    if name not in _fts_databases:
+        _fts_databases[name] = FTS_TABLE in connection.introspection.table_names()
+    return _fts_databases[name]
+
+
+def search(user, text, fields=SEARCH_FIELDS):
+    """
+    The user's counterparties with any of ``fields`` containing ``text``,
+    case-insensitively, as ``icontains`` would match them.
+    """
+    # The trigram index needs at least three characters, and LIKE wildcards
+    # in the search would need escaping; the fallback still only scans the
+    # counterparty table
+    indexed = has_fts_index() and len(text) >= 3 and not set(text) & {'%', '_', '\\'}
+    condition = Q()
+    for field in fields:
+        if indexed:
+            condition |= Q(id__in=RawSQL(f"SELECT rowid FROM {FTS_TABLE} WHERE {field} LIKE %s", [f'%{text}%']))
+        else:
+            condition |= Q(**{f'{field}__icontains': text})
+    return Counterparty.objects.filter(condition, user=user)
+
+
+def normalize_name(name):
+    # Display form: Unicode compatibility characters folded, whitespace
+    # collapsed
+    return ' '.join(unicodedata.normalize('NFKC', name or '').split())
+
+
+def normalize_number(number):
+    # Digits only; Rwandan mobile numbers written nationally (07XXXXXXXX) or
+    # without prefix (7XXXXXXXX) get the 250 country code
+    digits = ''.join(c for c in number or '' if c in '0123456789')
+    if len(digits) == 10 and digits.startswith('07'):
+        return '250' + digits[1:]
+    if len(digits) == 9 and digits.startswith('7'):
+        return '250' + digits
+    return digits
+
+
+def identity(user_id, name, number):
+    # (user id, normalized name, number) identifying a counterparty, and the
+    # name to display if it has to be created
+    display = normalize_name(name)
+    return (user_id, display.casefold(), normalize_number(number)), display
+
+
+class CounterpartyCache:
+    """
+    Counterparty ids by identity, filled as the rows of one upload (or
+    rebuild) are resolved. ``model`` is the Counterparty model, for use with
+    the historical models of migrations.
+    """
+
+    def __init__(self, batch_size=None, model=Counterparty):
+        self.batch_size = get_batch_size(batch_size)
+        self.model = model
+        self.ids = {}
+
+    def resolve(self, rows):
+        """
+        Return the counterparty id of each (user id, name, number) of
+        ``rows``, creating the counterparties missing. Rows without a user
+        get None.
+        """
+        identities = [identity(*row) if row[0] is not None else (None, None) for row in rows]
+        # The first spelling of a new counterparty is the one displayed
+        missing = {}
+        for key, display in identities:
+            if key is not None and key not in self.ids:
+                missing.setdefault(key, display)
+        if missing:
+            self.create(missing)
+        return [self.ids.get(key) for key, _ in identities]
+
+    def create(self, missing):
+        keys = list(missing)
+        for start in range(0, len(keys), self.batch_size):
+            chunk = keys[start:start + self.batch_size]
+            self.model.objects.bulk_create(
+                [self.model(user_id=user_id, name=missing[(user_id, normalized_name, number)],
+                            normalized_name=normalized_name, number=number)
+                 for user_id, normalized_name, number in chunk],
+                ignore_conflicts=True,
+            )
+            # Read the ids back, including those of counterparties that
+            # already existed or were created concurrently
+            wanted = set(chunk)
+            stored = self.model.objects.filter(
+                user_id__in={key[0] for key in chunk}, normalized_name__in={key[1] for key in chunk},
+            ).values_list('user_id', 'normalized_name', 'number', 'id')
+            for user_id, normalized_name, number, pk in stored:
+                if (user_id, normalized_name, number) in wanted:
+                    self.ids[(user_id, normalized_name, number)] = pk
+
+    def resolve_instances(self, model, rows):
+        """Set ``counterparty_id`` on unsaved transaction rows of ``model``."""
+        if model not in SOURCES or not rows:
+            return
+        name_field, number_field = SOURCES[model]
+        ids = self.resolve([
+            (row.user_id, getattr(row, name_field), getattr(row, number_field) if number_field else '')
+            for row in rows
+        ])
+        for row, pk in zip(rows, ids):
+            row.counterparty_id = pk
+
+
+def link_rows(model, name_field, number_field, cache, user=None, batch_size=None):
+    # Point the rows of ``model`` without a counterparty at theirs, in
+    # batches by id; returns how many rows were linked
+    batch_size = get_batch_size(batch_size)
+    rows = model.objects.filter(counterparty__isnull=True, user__isnull=False)
+    if user is not None:
+        rows = rows.filter(user=user)
+    fields = ['id', 'user_id', name_field] + ([number_field] if number_field else [])
+    linked = 0
+    last_id = 0
+    while True:
+        batch = list(rows.filter(id__gt=last_id).order_by('id').values_list(*fields)[:batch_size])
+        if not batch:
+            return linked
+        last_id = batch[-1][0]
+        ids = cache.resolve([(row[1], row[2], row[3] if number_field else '') for row in batch])
+        # One UPDATE per counterparty of the batch
+        by_counterparty = defaultdict(list)
+        for row, pk in zip(batch, ids):
+            by_counterparty[pk].append(row[0])
+        for pk, row_ids in by_counterparty.items():
+            model.objects.filter(id__in=row_ids).update(counterparty_id=pk)
+        linked += len(batch)
+
+
+def rebuild(user=None, batch_size=None):
+    """
+    Create the counterparties missing for existing transaction rows and link
+    the rows without one, for all users or one. Returns the number of
+    counterparties of the user(s).
+    """
+    cache = CounterpartyCache(batch_size)
+    for model, (name_field, number_field) in SOURCES.items():
+        link_rows(model, name_field, number_field, cache, user, batch_size)
+    update_statistics()
+    counterparties = Counterparty.objects.all() if user is None else Counterparty.objects.filter(user=user)
+    return counterparties.count()
@@ -0,0 +1,132 @@
+"""
+Per-counterparty totals of the transactions.
+
+``CounterpartyTotal`` holds, per counterparty and kind, the number of
+transactions and the sum of their amounts. Ingestion adds each batch of new
+rows to it, the dashboard's top-N lists read the largest totals with an
+indexed ``ORDER BY amount DESC LIMIT n``, ``rebuild`` recomputes the table
+from the transaction rows and ``check`` (``manage.py
+check_counterparty_totals``) reports where the stored totals have drifted
+from them.
+"""
+
+from collections import defaultdict
+from typing import NamedTuple, Optional, Tuple
+
+from django.db.models import Count, Sum
+
+from ..models import CounterpartyTotal
+from .bulk_writer import add_to_totals, get_batch_size
+from .counterparties import SOURCES
+from .ledger import LEDGER_SOURCES
+
+# Kind of the transactions of each model with a counterparty
+KINDS = {source.model: kind for kind, source in LEDGER_SOURCES.items() if source.model in SOURCES}
+
+TOTAL_FIELDS = ['count', 'amount']
+
+
+class Drift(NamedTuple):
+    user_id: Optional[int]
+    counterparty_id: int
+    kind: str
+    # (count, amount) from the transaction rows and as stored; None when
+    # there is no row
+    expected: Optional[Tuple[int, object]]
+    stored: Optional[Tuple[int, object]]
+
+
+def add_rows(model, ids):
+    """
+    Add the transaction rows of ``model`` with these ids, just inserted, to
+    their counterparties' totals, with one upsert that adds to the stored
+    totals.
+    """
+    kind = KINDS.get(model)
+    if kind is None or not ids:
+        return
+    totals = defaultdict(lambda: [0, 0])
+    users = {}
+    rows = model.objects.filter(id__in=ids, counterparty__isnull=False).values_list('user_id', 'counterparty_id', 'amount')
+    for user_id, counterparty_id, amount in rows:
+        total = totals[counterparty_id]
+        total[0] += 1
+        total[1] += amount or 0
+        users[counterparty_id] = user_id
+    add_to_totals(
+        CounterpartyTotal,
+        [
+            CounterpartyTotal(user_id=users[counterparty_id], counterparty_id=counterparty_id, kind=kind, count=count, amount=amount)
+            for counterparty_id, (count, amount) in totals.items()
+        ],
+        ['counterparty', 'kind'],
+        TOTAL_FIELDS,
+    )
+
+
+def computed(user=None):
+    # {(counterparty id, kind): (user id, count, amount)} grouped from the
+    # transaction rows
+    totals = {}
+    for model, kind in KINDS.items():
+        rows = model.objects.filter(counterparty__isnull=False)
+        if user is not None:
+            rows = rows.filter(user=user)
+        grouped = rows.values('user_id', 'counterparty_id').annotate(count=Count('id'), amount=Sum('amount')).order_by()
+        for row in grouped:
+            totals[(row['counterparty_id'], kind)] = (row['user_id'], row['count'], row['amount'])
+    return totals
+
+
+def stored(user=None):
+    rows = CounterpartyTotal.objects.all() if user is None else CounterpartyTotal.objects.filter(user=user)
+    return {
+        (counterparty_id, kind): (user_id, count, amount)
+        for user_id, counterparty_id, kind, count, amount in rows.values_list('user_id', 'counterparty_id', 'kind', 'count', 'amount')
+    }
+
+
+def check(user=None):
+    """
+    Compare the stored totals, for all users or one, with totals recomputed
+    from the transaction rows. Returns a ``Drift`` per differing total.
+    """
+    expected = computed(user)
+    actual = stored(user)
+    drifts = []
+    for key in sorted(expected.keys() | actual.keys()):
+        want, have = expected.get(key), actual.get(key)
+        if want is not None and have is not None and want[1:] == have[1:]:
+            continue
+        user_id = (want or have)[0]
+        drifts.append(Drift(user_id, key[0], key[1], want and want[1:], have and have[1:]))
+    return drifts
+
+
+def rebuild(user=None, batch_size=None):
+    """
+    Recompute the totals from the transaction rows, for all users or one.
+    Returns the number of totals written.
+    """
+    totals = computed(user)
+    (CounterpartyTotal.objects.all() if user is None else CounterpartyTotal.objects.filter(user=user)).delete()
+    CounterpartyTotal.objects.bulk_create(
+        [
+            CounterpartyTotal(user_id=user_id, counterparty_id=counterparty_id, kind=kind, count=count, amount=amount)
+            for (counterparty_id, kind), (user_id, count, amount) in totals.items()
+        ],
+        batch_size=get_batch_size(batch_size),
+    )
+    return len(totals)
+
+
+def top(user, kind, limit, label):
+    """
+    The user's ``limit`` counterparties with the largest total amount of
+    ``kind``, as dicts of the name (under ``label``), transaction count and
+    total amount.
+    """
+    rows = CounterpartyTotal.objects.filter(user=user, kind=kind).order_by('-amount', 'id').values_list(
+        'counterparty__name', 'count', 'amount'
+    )[:limit]
+    return [{label: name, 'transaction_count': count, 'total_amount': amount} for name, count, amount in rows]
@@ -0,0 +1,58 @@
+"""
+Content fingerprints for transaction rows.
+
+A fingerprint is a SHA-1 over the transaction kind and the fields that
+identify it, so the same SMS uploaded twice produces the same value whether
+it is computed from freshly parsed fields or from a row already in the
+database. Each transaction model has a unique (user, fingerprint) constraint.
+"""
+
+import hashlib
+from datetime import datetime
+from decimal import Decimal
+
+from django.utils import timezone
+
+from . import sms_parser
+
+# Fields that identify a transaction of each kind
+FINGERPRINT_FIELDS = {
+    sms_parser.INCOMING: ('amount', 'sender', 'date_time', 'transaction_id'),
+    sms_parser.PAYMENT_TO_CODE: ('transaction_id', 'amount', 'recipient', 'date_time'),
+    sms_parser.MOBILE_TRANSFER: ('amount', 'recipient', 'recipient_number', 'date_time', 'fee'),
+    sms_parser.BANK_DEPOSIT: ('amount', 'date_time'),
+    sms_parser.AIRTIME_BILL: ('transaction_id', 'amount', 'date_time', 'fee'),
+    sms_parser.CASH_POWER_BILL: ('transaction_id', 'amount', 'date_time', 'fee'),
+    sms_parser.THIRD_PARTY: ('amount', 'initiated_by', 'date_time', 'transaction_id'),
+    sms_parser.WITHDRAWAL: ('user_name', 'agent_name', 'agent_number', 'amount', 'date_time'),
+    sms_parser.BANK_TRANSFER: ('amount', 'recipient', 'date_time'),
+    sms_parser.INTERNET_BUNDLE: ('amount', 'bundle_size', 'unit'),
+    sms_parser.VOICE_BUNDLE: ('amount', 'minutes', 'smses'),
+}
+
+# Bundle messages carry no timestamp in their body, so their fingerprint also
+# includes the SMS's own ``date`` attribute; otherwise repeat purchases of the
+# same bundle would be collapsed into one
+UNDATED_KINDS = {sms_parser.INTERNET_BUNDLE, sms_parser.VOICE_BUNDLE}
+
+
+def _canonical(value):
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        # Parsed timestamps are naive strings interpreted in the default time
+        # zone, so stored values are compared in that zone too
+        if timezone.is_aware(value):
+            value = timezone.make_naive(value)
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(value, (int, Decimal)):
+        return format(Decimal(value).normalize(), 'f')
+    return str(value)
+
+
+def fingerprint(kind, values, sms_date=None):
+    parts = [kind]
+    parts.extend(_canonical(values.get(field)) for field in FINGERPRINT_FIELDS[kind])
+    if kind in UNDATED_KINDS:
+        parts.append(str(sms_date or ''))
+    return hashlib.sha1('\x1f'.join(parts).encode('utf-8')).hexdigest()
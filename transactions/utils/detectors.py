@@ -0,0 +1,279 @@
+"""
+Pluggable anomaly detectors over a user's ledger.
+
+A detector is a ``Detector`` subclass registered with ``@register``: it gets
+the user's ledger as column arrays sorted by date and returns the rows it
+flags, each with an anomaly type and a dict of details. Every detector makes
+O(n) passes over the columns (plus the per-kind medians of ``MADDetector``).
+
+``run`` loads the ledger once, runs the enabled detectors and replaces their
+stored ``DetectedAnomaly`` rows for the user; ingestion calls it once each
+upload that added transactions has committed, and ``manage.py
+detect_anomalies`` reruns it. The amount statistics of the threshold and MAD
+detectors change with every new entry, so each run covers the whole ledger.
+
+The detectors enabled, and their options, come from the ANOMALY_DETECTORS
+setting: a dict mapping detector names to keyword arguments overriding the
+class attributes. All registered detectors run with their defaults when it
+isn't set.
+"""
+
+import math
+from collections import Counter, deque
+from typing import List, NamedTuple
+
+import numpy as np
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+
+from ..models import DetectedAnomaly, LedgerEntry
+from . import anomalies
+from .bulk_writer import get_batch_size
+
+# Registered detector classes by name, in the order they run
+DETECTORS = {}
+
+
+class Ledger(NamedTuple):
+    # A user's ledger entries as parallel columns, sorted by date
+    ids: List[int]
+    date_times: list
+    amounts: np.ndarray
+    kinds: List[str]
+    counterparties: List[str]
+    # Seconds since the epoch of each date_time
+    timestamps: np.ndarray
+
+
+def register(detector_class):
+    DETECTORS[detector_class.name] = detector_class
+    return detector_class
+
+
+class Detector:
+    name = None
+
+    def __init__(self, **options):
+        for option, value in options.items():
+            if option.startswith('_') or not hasattr(type(self), option):
+                raise ImproperlyConfigured(f"Unknown option {option!r} for the {self.name!r} anomaly detector.")
+            setattr(self, option, value)
+
+    def detect(self, ledger):
+        """Return (row index, anomaly type, details) for each flagged row of ``ledger``."""
+        raise NotImplementedError
+
+
+@register
+class ThresholdDetector(Detector):
+    # The original rules: amounts above mean + 3 standard deviations, overall
+    # and per kind, and transactions late at night
+    name = 'threshold'
+
+    RULE_KEYS = {
+        anomalies.HIGH_AMOUNT: anomalies.OVERALL_KEYS,
+        anomalies.UNUSUAL_TIME: anomalies.NIGHT_KEYS,
+    }
+
+    def detect(self, ledger):
+        hours = np.fromiter((date_time.hour for date_time in ledger.date_times), dtype=np.int64, count=len(ledger.ids))
+        records = anomalies.detect_anomalies(
+            ledger.date_times, ledger.amounts, [LedgerEntry.KIND_LABELS[kind] for kind in ledger.kinds],
+            range(len(ledger.ids)), hours,
+        )
+        flagged = []
+        for record in records:
+            keys = self.RULE_KEYS.get(record['anomaly_type'], anomalies.TYPE_KEYS)
+            details = {key: record[key] for key in keys if key != 'anomaly_type'}
+            if 'hour' in details:
+                details['hour'] = details['unusual_hour'] = int(details['hour'])
+            flagged.append((record['id'], record['anomaly_type'], details))
+        return flagged
+
+
+@register
+class MADDetector(Detector):
+    # Amounts far above the median of their kind, measured in median
+    # absolute deviations (the modified z-score of Iglewicz and Hoaglin),
+    # which a few huge transactions can't inflate the way they inflate a
+    # standard deviation
+    name = 'mad'
+    threshold = 3.5
+    # Kinds with fewer transactions are skipped
+    min_count = 10
+
+    def detect(self, ledger):
+        amounts = np.abs(ledger.amounts)
+        kinds, codes = np.unique(np.asarray(ledger.kinds), return_inverse=True)
+        order = np.argsort(codes, kind='stable')
+        bounds = np.searchsorted(codes[order], np.arange(len(kinds) + 1))
+        flagged = []
+        for code, kind in enumerate(kinds.tolist()):
+            rows = order[bounds[code]:bounds[code + 1]]
+            if rows.size < self.min_count:
+                continue
+            values = amounts[rows]
+            median = np.median(values)
+            mad = np.median(np.abs(values - median))
+            if mad == 0:
+                continue
+            scores = 0.6745 * (values - median) / mad
+            for i in np.flatnonzero(scores > self.threshold).tolist():
+                flagged.append((int(rows[i]), f'Unusual Amount for {LedgerEntry.KIND_LABELS[kind]}', {
+                    'median': float(median),
+                    'mad': float(mad),
+                    'robust_z': round(float(scores[i]), 2),
+                }))
+        flagged.sort(key=lambda item: item[0])
+        return flagged
+
+
+@register
+class RollingZScoreDetector(Detector):
+    # Amounts far from the recent transactions with the same counterparty:
+    # the z-score against the mean and standard deviation of the previous
+    # ``window`` amounts of that (kind, counterparty), kept as running sums
+    name = 'rolling_zscore'
+    window = 20
+    min_periods = 5
+    threshold = 3.0
+
+    def detect(self, ledger):
+        windows = {}
+        flagged = []
+        amounts = np.abs(ledger.amounts).tolist()
+        for row, (kind, counterparty, amount) in enumerate(zip(ledger.kinds, ledger.counterparties, amounts)):
+            if not counterparty:
+                continue
+            state = windows.get((kind, counterparty))
+            if state is None:
+                state = windows[(kind, counterparty)] = [deque(), 0.0, 0.0]
+            values, total, total_sq = state
+            count = len(values)
+            if count >= self.min_periods:
+                mean = total / count
+                std = math.sqrt(max(total_sq - total * mean, 0.0) / (count - 1))
+                if std > 0 and (amount - mean) / std > self.threshold:
+                    flagged.append((row, 'Unusual Amount for Counterparty', {
+                        'counterparty': counterparty,
+                        'window_mean': round(mean, 2),
+                        'window_std': round(std, 2),
+                        'zscore': round((amount - mean) / std, 2),
+                        'window': count,
+                    }))
+            values.append(amount)
+            total += amount
+            total_sq += amount * amount
+            if count + 1 > self.window:
+                oldest = values.popleft()
+                total -= oldest
+                total_sq -= oldest * oldest
+            state[1], state[2] = total, total_sq
+        return flagged
+
+
+@register
+class BurstDetector(Detector):
+    # At least ``count`` transactions within ``minutes`` minutes. Every
+    # transaction of a burst is flagged; consecutive windows that overlap
+    # form one burst
+    name = 'burst'
+    count = 5
+    minutes = 10
+
+    def detect(self, ledger):
+        size = len(ledger.ids)
+        if size < self.count or self.count < 2:
+            return []
+        timestamps = ledger.timestamps
+        span = self.minutes * 60
+        starts = np.flatnonzero(timestamps[self.count - 1:] - timestamps[:size - self.count + 1] <= span)
+        if starts.size == 0:
+            return []
+        # Mark the rows covered by any window, then split the covered rows
+        # into bursts wherever a gap breaks them
+        coverage = np.zeros(size + 1, dtype=np.int64)
+        np.add.at(coverage, starts, 1)
+        np.add.at(coverage, starts + self.count, -1)
+        covered = np.cumsum(coverage[:size]) > 0
+        gaps = np.diff(timestamps) > span
+        breaks = np.concatenate([[True], ~covered[:-1] | gaps]) & covered
+        burst_ids = np.cumsum(breaks)
+        rows = np.flatnonzero(covered)
+        bursts = burst_ids[rows]
+        first = rows[np.searchsorted(bursts, bursts, side='left')]
+        last = rows[np.searchsorted(bursts, bursts, side='right') - 1]
+        flagged = []
+        for row, start, end in zip(rows.tolist(), first.tolist(), last.tolist()):
+            flagged.append((row, 'Burst of Transactions', {
+                'burst_size': end - start + 1,
+                'burst_start': ledger.date_times[start].isoformat(),
+                'burst_end': ledger.date_times[end].isoformat(),
+                'window_minutes': self.minutes,
+            }))
+        return flagged
+
+
+def enabled_detectors():
+    config = getattr(settings, 'ANOMALY_DETECTORS', None)
+    if config is None:
+        return [detector_class() for detector_class in DETECTORS.values()]
+    unknown = set(config) - set(DETECTORS)
+    if unknown:
+        raise ImproperlyConfigured(f"Unknown anomaly detectors in ANOMALY_DETECTORS: {', '.join(sorted(unknown))}.")
+    return [DETECTORS[name](**(options or {})) for name, options in config.items()]
+
+
+def load_ledger(user, batch_size=None):
+    # Stream the entries in chunks straight into columns sized from a count,
+    # rather than materializing every row tuple and transposing them. Entries
+    # added between the count and the read are left for the next run
+    entries = LedgerEntry.objects.filter(user=user)
+    size = entries.count()
+    ids = [0] * size
+    date_times = [None] * size
+    amounts = np.empty(size, dtype=np.float64)
+    kinds = [None] * size
+    counterparties = [None] * size
+    timestamps = np.empty(size, dtype=np.float64)
+    rows = entries.order_by('date_time', 'id').values_list(
+        'id', 'date_time', 'amount', 'kind', 'counterparty'
+    )[:size].iterator(chunk_size=get_batch_size(batch_size))
+    loaded = 0
+    for row, (pk, date_time, amount, kind, counterparty) in enumerate(rows):
+        ids[row] = pk
+        date_times[row] = date_time
+        amounts[row] = amount
+        kinds[row] = kind
+        counterparties[row] = counterparty
+        timestamps[row] = date_time.timestamp()
+        loaded += 1
+    if loaded < size:
+        # Entries deleted since the count
+        del ids[loaded:], date_times[loaded:], kinds[loaded:], counterparties[loaded:]
+        amounts, timestamps = amounts[:loaded], timestamps[:loaded]
+    return Ledger(ids, date_times, amounts, kinds, counterparties, timestamps)
+
+
+def run(user, detectors=None, batch_size=None):
+    """
+    Run ``detectors`` (the enabled ones by default) over the user's ledger
+    and replace their stored anomalies. Returns the number of anomalies per
+    detector name.
+    """
+    detectors = enabled_detectors() if detectors is None else detectors
+    ledger = load_ledger(user, batch_size)
+    counts = Counter()
+    rows = []
+    for detector in detectors:
+        for row, anomaly_type, details in detector.detect(ledger):
+            counts[detector.name] += 1
+            rows.append(DetectedAnomaly(
+                user=user, detector=detector.name, entry_id=ledger.ids[row],
+                anomaly_type=anomaly_type, date_time=ledger.date_times[row], details=details,
+            ))
+    with transaction.atomic():
+        DetectedAnomaly.objects.filter(user=user, detector__in=[d.name for d in detectors]).delete()
+        DetectedAnomaly.objects.bulk_create(rows, batch_size=get_batch_size(batch_size))
+    return counts
@@ -0,0 +1,215 @@
+"""
+Background ingestion jobs.
+
+Uploads are queued as ``IngestionJob`` rows and processed outside the request
+by ``manage.py run_ingestion_worker``. Because an upload is written in a
+single transaction, live progress is published through the cache rather than
+the job row, which is only updated when a job starts and finishes.
+
+Progress goes to the ``ingestion`` cache when one is configured, so that
+culling of the result cache can't drop it.
+
+A worker signals that it is still running a job by refreshing the job's
+``heartbeat_at`` from a separate thread (and database connection, outside
+the upload's transaction). Running jobs whose heartbeat has lapsed belonged
+to a worker that was killed or restarted; their upload's transaction was
+rolled back, so ``recover_stale_jobs`` requeues them, or marks them failed
+once they have used up their attempts.
+"""
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DatabaseError, close_old_connections, connection
+from django.db.models import F
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from ..models import IngestionJob
+from .ingestion_report import RunReport
+from .process_data import process_xml_file
+
+logger = logging.getLogger(__name__)
+
+PROGRESS_TIMEOUT = 60 * 60
+
+
+def progress_cache():
+    return caches['ingestion' if 'ingestion' in settings.CACHES else 'default']
+
+
+def progress_key(job_id):
+    return f'ingestion-job:{job_id}:progress'
+
+
+def stale_after():
+    return getattr(settings, 'INGESTION_JOB_STALE_AFTER', 10 * 60)
+
+
+def enqueue_ingestion(xml_file_instance):
+    return IngestionJob.objects.create(
+        xml_file=xml_file_instance,
+        user=xml_file_instance.user,
+        total_bytes=xml_file_instance.file.size,
+    )
+
+
+def claim_next_job():
+    # Claim the oldest queued job. The conditional UPDATE only succeeds for
+    # one worker, so several workers can poll the same queue safely.
+    for job in IngestionJob.objects.filter(status=IngestionJob.STATUS_QUEUED).order_by('created_at', 'id')[:10]:
+        now = timezone.now()
+        claimed = IngestionJob.objects.filter(pk=job.pk, status=IngestionJob.STATUS_QUEUED).update(
+            status=IngestionJob.STATUS_RUNNING,
+            started_at=now,
+            heartbeat_at=now,
+            attempts=F('attempts') + 1,
+        )
+        if claimed:
+            job.refresh_from_db()
+            return job
+    return None
+
+
+@contextmanager
+def heartbeat(job):
+    # Refresh the job's heartbeat from a thread while it runs, so long phases
+    # without progress callbacks (post-processing) don't make it look stale.
+    # The thread has its own connection, so the update commits straight away
+    # instead of with the upload. On SQLite it waits on the upload's write
+    # lock and may fail; SQLite deployments run a single worker anyway
+    interval = max(stale_after() / 5, 0.1)
+    stop = threading.Event()
+
+    def beat():
+        try:
+            while not stop.wait(interval):
+                try:
+                    IngestionJob.objects.filter(pk=job.pk).update(heartbeat_at=timezone.now())
+                except DatabaseError:
+                    logger.warning("Could not refresh the heartbeat of ingestion job %s", job.pk, exc_info=True)
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=beat, name=f'ingestion-job-{job.pk}-heartbeat', daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def recover_stale_jobs():
+    # Requeue the running jobs without a heartbeat in the last
+    # INGESTION_JOB_STALE_AFTER seconds, or fail those attempted
+    # INGESTION_JOB_MAX_ATTEMPTS times already (an upload that kills its
+    # worker would otherwise be retried forever). Returns how many jobs were
+    # recovered
+    max_attempts = getattr(settings, 'INGESTION_JOB_MAX_ATTEMPTS', 2)
+    cutoff = timezone.now() - timedelta(seconds=stale_after())
+    recovered = 0
+    running = IngestionJob.objects.alias(
+        last_seen=Coalesce('heartbeat_at', 'started_at'),
+    ).filter(status=IngestionJob.STATUS_RUNNING, last_seen__lt=cutoff)
+    for job in running:
+        # Conditional on the claim being unchanged and the heartbeat not
+        # having moved since, like ``claim_next_job``
+        stale = IngestionJob.objects.filter(
+            pk=job.pk, status=IngestionJob.STATUS_RUNNING,
+            started_at=job.started_at, heartbeat_at=job.heartbeat_at,
+        )
+        if job.attempts < max_attempts:
+            recovered += stale.update(status=IngestionJob.STATUS_QUEUED, started_at=None)
+        else:
+            recovered += stale.update(
+                status=IngestionJob.STATUS_FAILED,
+                error=f"The worker stopped while processing this upload ({job.attempts} attempts).",
+                finished_at=timezone.now(),
+            )
+        progress_cache().delete(progress_key(job.pk))
+    return recovered
+
+
+def run_job(job):
+    def report(stats, bytes_read):
+        progress_cache().set(progress_key(job.pk), {
+            'bytes_read': bytes_read,
+            'message_count': stats['messages'],
+            'transaction_count': stats['transactions'],
+            'failed_count': stats['failed'],
+        }, PROGRESS_TIMEOUT)
+
+    run_report = RunReport(trace_memory=getattr(settings, 'INGESTION_TRACE_MEMORY', False))
+    try:
+        with heartbeat(job):
+            stats = process_xml_file(
+                job.xml_file.file, job.user, progress=report,
+                incremental=getattr(settings, 'INGESTION_INCREMENTAL', True), report=run_report,
+            )
+    except Exception as exc:
+        job.status = IngestionJob.STATUS_FAILED
+        job.error = f"{type(exc).__name__}: {exc}"
+    else:
+        job.status = IngestionJob.STATUS_SUCCEEDED
+        job.message_count = stats['messages']
+        job.transaction_count = stats['transactions']
+        job.failed_count = stats['failed']
+    # Kept for failed runs too, as far as they got
+    job.report = run_report.as_dict()
+    job.finished_at = timezone.now()
+    job.save()
+    progress_cache().delete(progress_key(job.pk))
+    return job
+
+
+def run_pending_jobs(limit=None):
+    # Process queued jobs until the queue is empty (or ``limit`` is reached)
+    # and return how many were run
+    count = 0
+    while limit is None or count < limit:
+        job = claim_next_job()
+        if job is None:
+            break
+        run_job(job)
+        count += 1
+    return count
+
+
+def run_worker(poll_interval=2.0, once=False):
+    while True:
+        close_old_connections()
+        recover_stale_jobs()
+        ran = run_pending_jobs()
+        if once:
+            return ran
+        if not ran:
+            time.sleep(poll_interval)
+
+
+def job_progress(job):
+    # JSON-serialisable status for the upload page to poll
+    data = {
+        'id': job.pk,
+        'status': job.status,
+        'finished': job.is_finished,
+        'total_bytes': job.total_bytes,
+        'bytes_read': job.total_bytes if job.is_finished else 0,
+        'message_count': job.message_count,
+        'transaction_count': job.transaction_count,
+        'failed_count': job.failed_count,
+        'error': job.error,
+        'created_at': job.created_at,
+        'started_at': job.started_at,
+        'finished_at': job.finished_at,
+        'duration_seconds': job.duration.total_seconds() if job.duration else None,
+    }
+    if job.status == IngestionJob.STATUS_RUNNING:
+        data.update(progress_cache().get(progress_key(job.pk)) or {})
+    data['percent'] = round(100 * data['bytes_read'] / data['total_bytes'], 1) if data['total_bytes'] else None
+    return data
@@ -0,0 +1,157 @@
+"""
+Structured reports of ingestion runs.
+
+A ``RunReport`` is filled in by ``process_xml_file`` as an upload is
+processed, and stored on the ``IngestionJob`` when the background worker
+ran it, so runs can be compared over time (``manage.py ingestion_report``
+or the admin). It records:
+
+* time spent parsing the XML, classifying the messages of each category,
+  writing each model's rows (including the ledger, rollups and counterparty
+  updates of each batch) and post-processing (running balances, anomaly
+  detectors, planner statistics), and the run's total;
+* messages and failed extractions per category, rows written and
+  duplicates skipped per model, and the resulting messages per second;
+* with ``trace_memory``, the peak of memory allocated by Python during the
+  run, from tracemalloc (which makes parsing 3-4 times slower).
+
+A run that fails is reported as far as it got: its counts are those of the
+messages read before the error, and ``committed`` is false, as the rows it
+wrote were rolled back with the upload's transaction.
+
+With parallel parsing, classification runs in the worker processes: the
+parse time is then the time spent waiting for their results, categories
+have no time of their own and the peak memory is this process's.
+"""
+
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+from . import sms_parser
+
+
+def seconds(value):
+    return round(value, 6)
+
+
+class RunReport:
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.workers = 1
+        self.started = None
+        self.total_seconds = 0.0
+        self.parse_seconds = 0.0
+        self.post_processing_seconds = 0.0
+        self.messages = Counter()
+        self.failures = Counter()
+        self.category_seconds = defaultdict(float)
+        self.stats = Counter()
+        # {model name: (rows written, duplicates skipped, write seconds)}
+        self.models = {}
+        self.peak_memory = None
+        # Whether the upload's transaction committed
+        self.committed = False
+        self._started_tracing = False
+
+    @contextmanager
+    def run(self):
+        # Times the whole run and, with ``trace_memory``, traces its peak
+        # memory
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracing = True
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+        self.started = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.total_seconds = time.perf_counter() - self.started
+            if self.trace_memory:
+                self.peak_memory = max(tracemalloc.get_traced_memory()[1] - baseline, 0)
+                if self._started_tracing:
+                    tracemalloc.stop()
+
+    @contextmanager
+    def post_processing(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.post_processing_seconds += time.perf_counter() - start
+
+    def timed_parse(self, iterable):
+        # Yield from ``iterable``, adding the time spent producing each item
+        # (reading and parsing the XML) to the parse time
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.parse_seconds += time.perf_counter() - start
+                return
+            self.parse_seconds += time.perf_counter() - start
+            yield item
+
+    def classify(self, body):
+        # ``sms_parser.parse_sms``, timed per category
+        start = time.perf_counter()
+        result = sms_parser.parse_sms(body)
+        self.category_seconds[result.kind] += time.perf_counter() - start
+        return result
+
+    def count_message(self, result):
+        self.messages[result.kind] += 1
+        if result.fields is None and result.kind not in (sms_parser.SYSTEM, sms_parser.IGNORED):
+            self.failures[result.kind] += 1
+
+    def finish(self, stats, writer):
+        # Record the run's totals and what ``writer`` wrote, if it was
+        # created
+        self.stats = Counter({key: value for key, value in stats.items() if key != 'last_sms_date'})
+        if writer is None:
+            return
+        for model in set(writer.counts) | set(writer.duplicates):
+            self.models[model.__name__] = (writer.counts[model], writer.duplicates[model], writer.seconds[model])
+
+    def as_dict(self):
+        """The report as a JSON-serialisable dict."""
+        write_seconds = sum(model_seconds for _, _, model_seconds in self.models.values())
+        classify_seconds = sum(self.category_seconds.values())
+        accounted = self.parse_seconds + classify_seconds + write_seconds + self.post_processing_seconds
+        messages = self.stats['messages']
+        return {
+            'messages': messages,
+            'transactions': self.stats['transactions'],
+            'failed': self.stats['failed'],
+            'skipped': self.stats['skipped'],
+            'duplicates': sum(duplicates for _, duplicates, _ in self.models.values()),
+            'workers': self.workers,
+            'committed': self.committed,
+            'seconds': {
+                'total': seconds(self.total_seconds),
+                'parse': seconds(self.parse_seconds),
+                'classify': seconds(classify_seconds),
+                'write': seconds(write_seconds),
+                'post_processing': seconds(self.post_processing_seconds),
+                'other': seconds(max(self.total_seconds - accounted, 0)),
+            },
+            'messages_per_second': round(messages / self.total_seconds, 1) if self.total_seconds else None,
+            'peak_memory_bytes': self.peak_memory,
+            'categories': {
+                kind: {
+                    'messages': count,
+                    'failed': self.failures[kind],
+                    'seconds': seconds(self.category_seconds[kind]),
+                }
+                for kind, count in sorted(self.messages.items())
+            },
+            'models': {
+                name: {'rows': rows, 'duplicates': duplicates, 'write_seconds': seconds(model_seconds)}
+                for name, (rows, duplicates, model_seconds) in sorted(self.models.items())
+            },
+        }
@@ -0,0 +1,160 @@
+"""
+Unified transaction ledger.
+
+Every dated transaction row is mirrored as a ``LedgerEntry`` with its kind,
+direction, signed amount, fee and counterparty, so aggregate queries read one
+indexed table instead of a union over the transaction models. Entries are
+written by the ingestion pipeline right after the source rows are inserted,
+and ``rebuild_ledger`` recreates them from the source tables.
+
+Each entry also stores the user's running balance after it. New entries get
+theirs from ``update_balances`` once an upload is written; an entry dated
+before existing ones shifts the balances after it, which are rewritten from
+that point on.
+"""
+
+from typing import NamedTuple, Optional
+
+from django.db.models import Q
+
+from ..models import (
+    IncomingMoney, PaymentToCodeHolder, TransferToMobile, BankDeposit,
+    AirtimeBillPayment, CashPowerBillPayment, ThirdPartyTransaction,
+    WithdrawalFromAgent, BankTransfer, LedgerEntry
+)
+from . import sms_parser
+from .bulk_writer import get_batch_size
+
+
+class LedgerSource(NamedTuple):
+    model: type
+    direction: str
+    # Field holding the other party of the transaction, if any
+    counterparty_field: Optional[str] = None
+    fee_field: Optional[str] = None
+
+
+# Bundle purchases have no date_time and are not part of the ledger
+LEDGER_SOURCES = {
+    sms_parser.INCOMING: LedgerSource(IncomingMoney, LedgerEntry.DIRECTION_IN, 'sender'),
+    sms_parser.PAYMENT_TO_CODE: LedgerSource(PaymentToCodeHolder, LedgerEntry.DIRECTION_OUT, 'recipient'),
+    sms_parser.MOBILE_TRANSFER: LedgerSource(TransferToMobile, LedgerEntry.DIRECTION_OUT, 'recipient', 'fee'),
+    sms_parser.BANK_DEPOSIT: LedgerSource(BankDeposit, LedgerEntry.DIRECTION_IN),
+    sms_parser.AIRTIME_BILL: LedgerSource(AirtimeBillPayment, LedgerEntry.DIRECTION_OUT, fee_field='fee'),
+    sms_parser.CASH_POWER_BILL: LedgerSource(CashPowerBillPayment, LedgerEntry.DIRECTION_OUT, fee_field='fee'),
+    sms_parser.THIRD_PARTY: LedgerSource(ThirdPartyTransaction, LedgerEntry.DIRECTION_OUT, 'initiated_by'),
+    sms_parser.WITHDRAWAL: LedgerSource(WithdrawalFromAgent, LedgerEntry.DIRECTION_OUT, 'agent_name'),
+    sms_parser.BANK_TRANSFER: LedgerSource(BankTransfer, LedgerEntry.DIRECTION_OUT, 'recipient'),
+}
+
+SOURCE_KINDS = {source.model: kind for kind, source in LEDGER_SOURCES.items()}
+
+
+def source_fields(source):
+    fields = ['id', 'user_id', 'amount', 'date_time']
+    fields.extend(field for field in (source.counterparty_field, source.fee_field) if field)
+    return fields
+
+
+def build_entries(kind, rows):
+    # Turn ``values(*source_fields(...))`` dicts of one kind into entries
+    source = LEDGER_SOURCES[kind]
+    sign = -1 if source.direction == LedgerEntry.DIRECTION_OUT else 1
+    source_model = source.model.__name__
+    return [
+        LedgerEntry(
+            user_id=row['user_id'],
+            kind=kind,
+            direction=source.direction,
+            amount=sign * (row['amount'] or 0),
+            fee=(row[source.fee_field] or 0) if source.fee_field else 0,
+            counterparty=(row[source.counterparty_field] or '') if source.counterparty_field else '',
+            date_time=row['date_time'],
+            source_model=source_model,
+            source_id=row['id'],
+        )
+        for row in rows
+    ]
+
+
+def record_rows(model, rows):
+    """
+    Write ledger entries for transaction rows just inserted by a
+    ``BulkWriter``. Inserts may have ignored conflicts, so the rows' ids are
+    looked up by fingerprint, and rows that already have an entry are
+    skipped. Returns the new entries.
+    """
+    kind = SOURCE_KINDS.get(model)
+    if kind is None or not rows:
+        return []
+    stored = list(model.objects.filter(
+        user_id__in={row.user_id for row in rows},
+        fingerprint__in={row.fingerprint for row in rows},
+    ).order_by('id').values(*source_fields(LEDGER_SOURCES[kind])))
+    recorded = set(LedgerEntry.objects.filter(
+        source_model=model.__name__, source_id__in=[row['id'] for row in stored]
+    ).values_list('source_id', flat=True))
+    entries = build_entries(kind, [row for row in stored if row['id'] not in recorded])
+    LedgerEntry.objects.bulk_create(entries, ignore_conflicts=True)
+    return entries
+
+
+def rebuild(user=None, clear=False, batch_size=None):
+    """
+    Create the entries missing for existing transaction rows (all of them
+    after ``clear``), optionally for one user only. Returns how many source
+    rows were scanned.
+    """
+    batch_size = get_batch_size(batch_size)
+    entries = LedgerEntry.objects.all() if user is None else LedgerEntry.objects.filter(user=user)
+    if clear:
+        entries.delete()
+    scanned = 0
+    for kind, source in LEDGER_SOURCES.items():
+        rows = source.model.objects.all() if user is None else source.model.objects.filter(user=user)
+        batch = []
+        for row in rows.order_by('id').values(*source_fields(source)).iterator(chunk_size=batch_size):
+            batch.append(row)
+            if len(batch) >= batch_size:
+                LedgerEntry.objects.bulk_create(build_entries(kind, batch), ignore_conflicts=True)
+                scanned += len(batch)
+                batch = []
+        if batch:
+            LedgerEntry.objects.bulk_create(build_entries(kind, batch), ignore_conflicts=True)
+            scanned += len(batch)
+    return scanned
+
+
+def update_balances(user=None, batch_size=None):
+    """
+    Fill in the running balance of entries that have none, for one user or
+    all of them. Balances are recomputed from the earliest such entry, so
+    entries inserted out of order repair the balances after them; when new
+    entries all come after the existing ones only they are written. Returns
+    the number of entries updated.
+    """
+    batch_size = get_batch_size(batch_size)
+    if user is not None:
+        user_ids = [user.pk]
+    else:
+        user_ids = LedgerEntry.objects.filter(balance__isnull=True).values_list('user_id', flat=True).distinct()
+    updated = 0
+    for user_id in list(user_ids):
+        entries = LedgerEntry.objects.filter(user_id=user_id)
+        first = entries.filter(balance__isnull=True).order_by('date_time', 'id').values_list('date_time', 'id').first()
+        if first is None:
+            continue
+        date_time, pk = first
+        before = Q(date_time__lt=date_time) | Q(date_time=date_time, id__lt=pk)
+        balance = entries.filter(before).order_by('-date_time', '-id').values_list('balance', flat=True).first() or 0
+        changed = []
+        for pk, amount, stored in entries.exclude(before).order_by('date_time', 'id').values_list('id', 'amount', 'balance'):
+            balance += amount
+            if stored != balance:
+                changed.append((pk, balance))
+        for start in range(0, len(changed), batch_size):
+            LedgerEntry.objects.bulk_update(
+                [LedgerEntry(id=pk, balance=balance) for pk, balance in changed[start:start + batch_size]], ['balance']
+            )
+        updated += len(changed)
+    return updated
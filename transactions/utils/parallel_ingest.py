@@ -0,0 +1,93 @@
+"""
+Process-pool parsing of SMS backups.
+
+The parent splits the raw XML into byte chunks at ``<sms`` tag boundaries
+without parsing it; worker processes parse each chunk and classify its
+messages with ``sms_parser``. Chunks are consumed in submission order, so the
+output is identical to parsing the file serially.
+
+Like ``sms_parser`` this module has no Django dependencies, so workers can be
+started with either the fork or the spawn start method.
+"""
+
+import xml.etree.ElementTree as ET
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from . import sms_parser
+
+SMS_TAG = b"<sms "
+DEFAULT_CHUNK_BYTES = 1 << 20
+
+
+def iter_xml_chunks(xml_file, chunk_bytes=DEFAULT_CHUNK_BYTES):
+    """
+    Yield byte strings each holding a run of complete top-level elements,
+    starting at the first ``<sms`` tag and stopping before the root's
+    closing tag.
+    """
+    buffer = b""
+    started = False
+    while True:
+        block = xml_file.read(chunk_bytes)
+        if not block:
+            break
+        buffer += block
+        if not started:
+            first = buffer.find(SMS_TAG)
+            if first == -1:
+                continue
+            buffer = buffer[first:]
+            started = True
+        cut = buffer.rfind(SMS_TAG)
+        if cut > 0:
+            yield buffer[:cut]
+            buffer = buffer[cut:]
+    if started:
+        # Drop the root element's closing tag
+        end = buffer.rfind(b"</")
+        if end != -1:
+            buffer = buffer[:end]
+        if buffer.strip():
+            yield buffer
+
+
+def parse_xml_chunk(chunk, keep_body_kinds=frozenset(), since=None):
+    """
+    Parse one chunk and return ``(sms date, body, ParseResult)`` tuples in
+    document order. Bodies are only sent back for failed extractions whose
+    kind is in ``keep_body_kinds``, to keep inter-process traffic small.
+
+    Messages dated before ``since`` are not classified and are returned as
+    ``(sms date, None, None)``.
+    """
+    root = ET.fromstring(b"<smses>" + chunk + b"</smses>")
+    parsed = []
+    for sms in root.iter("sms"):
+        date = sms.attrib.get("date")
+        timestamp = sms_parser.sms_timestamp(date)
+        if since is not None and timestamp is not None and timestamp < since:
+            parsed.append((date, None, None))
+            continue
+        body = sms.attrib.get("body", "")
+        result = sms_parser.parse_sms(body)
+        keep = result.fields is None and result.kind in keep_body_kinds
+        parsed.append((date, body if keep else None, result))
+    return parsed
+
+
+def parse_xml_parallel(xml_file, workers, chunk_bytes=DEFAULT_CHUNK_BYTES, keep_body_kinds=frozenset(), since=None):
+    """
+    Yield ``(sms date, body, ParseResult)`` for every <sms> in ``xml_file``,
+    parsed by ``workers`` processes. At most two chunks per worker are in
+    flight at once, so memory stays bounded for arbitrarily large files.
+    """
+    keep_body_kinds = frozenset(keep_body_kinds)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for chunk in iter_xml_chunks(xml_file, chunk_bytes):
+            pending.append(executor.submit(parse_xml_chunk, chunk, keep_body_kinds, since))
+            if len(pending) >= workers * 2:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
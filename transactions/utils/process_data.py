@@ -1,12 +1,24 @@
+import logging
 import xml.etree.ElementTree as ET
-import re
-from datetime import datetime
+from collections import Counter
+from contextlib import nullcontext
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
 from ..models import (
     IncomingMoney, PaymentToCodeHolder, TransferToMobile, BankDeposit,
     AirtimeBillPayment, CashPowerBillPayment, ThirdPartyTransaction,
     WithdrawalFromAgent, BankTransfer, InternetBundlePurchase, VoiceBundlePurchase,
-    FailedSMSLog
+    FailedSMSLog, XMLFile
 )
+from . import (
+    counterparties, counterparty_totals, dedup, detectors, ledger, parallel_ingest, result_cache, rollups, sms_parser,
+    transaction_counts,
+)
+from .bulk_writer import BulkWriter
+from .ingestion_report import RunReport
+
+logger = logging.getLogger(__name__)
 
 # Parse the XML file
 def parse_xml(xml_file):
@@ -14,281 +26,241 @@ def parse_xml(xml_file):
     root = tree.getroot()
     return root.findall("sms")
 
-# Extract and categorize SMS messages
-def extract_transaction_data(sms_elements, user=None):
-    processed_count = 0
-    failed_count = 0
-    data = []
-    failed_sms = []
-
+# Stream <sms> elements one at a time instead of building the whole tree.
+# Each element is cleared once the consumer resumes the generator, and the
+# root is emptied so processed siblings don't accumulate, keeping memory
+# bounded no matter how large the backup is.
+def iter_sms(xml_file):
+    context = ET.iterparse(xml_file, events=("start", "end"))
+    _, root = next(context)
+    for event, elem in context:
+        if event == "end" and elem.tag == "sms":
+            yield elem
+            elem.clear()
+            root.clear()
+
+# Model each extracted transaction kind is stored as
+TRANSACTION_MODELS = {
+    sms_parser.INCOMING: IncomingMoney,
+    sms_parser.PAYMENT_TO_CODE: PaymentToCodeHolder,
+    sms_parser.MOBILE_TRANSFER: TransferToMobile,
+    sms_parser.BANK_DEPOSIT: BankDeposit,
+    sms_parser.AIRTIME_BILL: AirtimeBillPayment,
+    sms_parser.CASH_POWER_BILL: CashPowerBillPayment,
+    sms_parser.THIRD_PARTY: ThirdPartyTransaction,
+    sms_parser.WITHDRAWAL: WithdrawalFromAgent,
+    sms_parser.BANK_TRANSFER: BankTransfer,
+    sms_parser.INTERNET_BUNDLE: InternetBundlePurchase,
+    sms_parser.VOICE_BUNDLE: VoiceBundlePurchase,
+}
+
+# Categories whose extraction failures are recorded in FailedSMSLog
+LOGGED_FAILURE_KINDS = {sms_parser.PAYMENT_TO_CODE, sms_parser.BILL_PAYMENT}
+
+# Keep the tables derived from the transaction rows (the ledger, its
+# rollups and the counterparty totals) in step with each batch a BulkWriter
+# inserts. Only rows that got a new ledger entry were actually inserted
+def update_derived_tables(model, rows):
+    entries = ledger.record_rows(model, rows)
+    rollups.add_entries(entries)
+    counterparty_totals.add_rows(model, [entry.source_id for entry in entries])
+
+# Rows of each transaction kind a BulkWriter inserted. Exact because
+# uploads of the same user are serialized by ``lock_user``: the writer's
+# duplicate check sees everything stored before, so the insert's
+# ignore_conflicts never skips a row
+def written_counts(writer):
+    return {kind: writer.counts[model] for kind, model in TRANSACTION_MODELS.items()}
+
+# Take a lock on the user's row, held until the upload commits, so that
+# concurrent uploads of the same user run one after the other. Each then sees
+# the rows, watermark, balances and totals the previous one stored (a no-op
+# on SQLite, which only allows one writer at a time anyway)
+def lock_user(user):
+    get_user_model().objects.select_for_update().get(pk=user.pk)
+
+# Rerun the user's anomaly detectors after an upload. The upload is already
+# committed, so a failure only leaves the previous anomalies in place until
+# the next upload or ``manage.py detect_anomalies``
+def detect_anomalies(user, batch_size=None):
+    try:
+        detectors.run(user, batch_size=batch_size)
+    except Exception:
+        logger.exception("Anomaly detection failed for user %s after an upload.", user.pk)
+    else:
+        result_cache.bump_version(user.pk)
+
+# A BulkWriter for one upload: rows get their counterparty, through a cache
+# of the counterparties already resolved in the upload, before each insert
+def upload_writer(batch_size=None):
+    cache = counterparties.CounterpartyCache(batch_size)
+    return BulkWriter(batch_size, on_flush=update_derived_tables, before_flush=cache.resolve_instances)
+
+# Classify a stream of <sms> elements, yielding (sms date, body, ParseResult).
+# Messages dated before ``since`` are yielded as (sms date, None, None)
+# without touching their body. With a ``report``, reading the elements and
+# classifying each category are timed on it.
+def parse_sms_elements(sms_elements, since=None, report=None):
+    classify = sms_parser.parse_sms
+    if report is not None:
+        sms_elements = report.timed_parse(sms_elements)
+        classify = report.classify
     for sms in sms_elements:
+        date = sms.attrib.get("date")
+        if since is not None:
+            timestamp = sms_parser.sms_timestamp(date)
+            if timestamp is not None and timestamp < since:
+                yield date, None, None
+                continue
         body = sms.attrib.get("body", "")
-        processed_successfully = False
-        reason = None
-        reason = None
-
-        # 1. System Notifications
-        if body.startswith("*143*R*"):
-            if "successfully registered" in body:
-                processed_successfully = True
-                continue  # Skip registration messages
-            if "failed" in body:
-                processed_successfully = True # Consider system failures as processed (skipped)
-                continue  # Skip failure messages for now
-
-        # 2. Incoming Money
-        elif body.startswith("You have received"):
-            match = re.search(r"received (\d+) RWF from (.+?) \(", body)
-            date_time_match = re.search(r"at (\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})", body)
-            txn_id_match = re.search(r"Financial Transaction Id: (\d+)", body)
-
-            if match and date_time_match and txn_id_match:
-                amount = int(match.group(1))
-                sender = match.group(2)
-                date_time = date_time_match.group(1)
-                txn_id = txn_id_match.group(1)
-
-                # Create IncomingMoney object
-                IncomingMoney.objects.create(
-                    amount=amount,
-                    sender=sender,
-                    date_time=date_time,
-                    transaction_id=txn_id,
-                    user=user
-                )
-                processed_successfully = True
-            else:
-                reason = "Missing data for Incoming Money (amount, sender, date, or transaction ID)"
-
-        # 3. Payments to Code Holders
-        elif body.startswith("TxId"):
-            # Generalized matching
-            txn_id_match = re.search(r"TxId: (\d+)", body)
-            amount_match = re.search(r"payment\s+of\s+([\d,]+)\s+RWF", body)  # Adjusted regex
-            recipient_match = re.search(r"to (.+?) (\d+)", body)
-            date_time_match = re.search(r"at (\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})", body)
-
-            # Extract matched components
-            txn_id = txn_id_match.group(1) if txn_id_match else None
-            amount = int(amount_match.group(1).replace(",", "")) if amount_match else None  # Remove commas from amount
-            recipient = recipient_match.group(1).strip() if recipient_match else None
-            recipient_code = recipient_match.group(2) if recipient_match else None
-            date_time = date_time_match.group(1) if date_time_match else None
-
-            if txn_id and amount and recipient and date_time:
-                # Create PaymentToCodeHolder object
-                PaymentToCodeHolder.objects.create(
-                    transaction_id=txn_id,
-                    amount=amount,
-                    recipient=recipient,
-                    date_time=date_time,
-                    user=user
-                )
-                processed_successfully = True
-                processed_count += 1
-            else:
-                reason = "Missing data for Payment to Code Holder (TxId, amount, recipient, or date)"
-                failed_count += 1
-                FailedSMSLog.objects.create(sms_body=body, reason=reason, user=user)
-
-        # 4. Transfers to Mobile Numbers
-        elif body.startswith("*165*S*"):
-            match = re.search(r"(\d+) RWF transferred to (.+?) \((250\d+)\)", body)
-            date_time_match = re.search(r"at (\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})", body)
-            fee_match = re.search(r"Fee was: (\d+) RWF", body)
-
-            if match and date_time_match and fee_match:
-                amount = int(match.group(1))
-                recipient = match.group(2)
-                recipient_number = match.group(3)
-                date_time = date_time_match.group(1)
-                fee = int(fee_match.group(1))
-
-                # Create TransferToMobile object
-                TransferToMobile.objects.create(
-                    amount=amount,
-                    recipient=recipient,
-                    recipient_number=recipient_number,
-                    date_time=date_time,
-                    fee=fee,
-                    user=user
-                )
-                processed_successfully = True
-                processed_count += 1
-            else:
-                reason = "Missing data for Transfer to Mobile (amount, recipient, number, date, or fee)"
-
-        # 5. Bank Deposits
-        elif body.startswith("*113*R*"):
-            match = re.search(r"deposit of (\d+) RWF", body)
-            date_time_match = re.search(r"at (\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})", body)
-
-            if match and date_time_match:
-                amount = int(match.group(1))
-                date_time = date_time_match.group(1)
-
-                # Create BankDeposit object
-                BankDeposit.objects.create(
-                    amount=amount,
-                    date_time=date_time,
-                    user=user
-                )
-                processed_successfully = True
-                processed_count += 1
-            else:
-                reason = "Missing data for Bank Deposit (amount or date)"
-
-        # 6. Bill Purchases (Airtime and Cash Power)
-        elif body.startswith("*162*"):
-            match = re.search(r"TxId:(\d+)\*S\*Your payment of (\d+) RWF to (Airtime|MTN Cash Power) with token.*?at (\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})", body)
-            fee_match = re.search(r"Fee was (\d+) RWF", body)
-
-            if match and fee_match:
-                txn_id = match.group(1)
-                amount = int(match.group(2))
-                bill_type = match.group(3)
-                date_time = match.group(4)
-                fee = int(fee_match.group(1))
-
-                if bill_type == "Airtime":
-                    # Create AirtimeBillPayment object
-                    AirtimeBillPayment.objects.create(
-                        transaction_id=txn_id,
-                        amount=amount,
-                        date_time=date_time,
-                        fee=fee,
-                        user=user
-                    )
-                    processed_successfully = True
-                    processed_count += 1
-                elif bill_type == "MTN Cash Power":
-                    # Create CashPowerBillPayment object
-                    CashPowerBillPayment.objects.create(
-                        transaction_id=txn_id,
-                        amount=amount,
-                        date_time=date_time,
-                        fee=fee,
-                        user=user
-                    )
-                    processed_successfully = True
-                    processed_count += 1
-            else:
-                reason = "Missing data for Bill Purchase (TxId, amount, bill type, date, or fee)"
-                failed_count += 1
-                FailedSMSLog.objects.create(sms_body=body, reason=reason, user=user)
-
-        # 7. Transactions Initiated by Another Party
-        elif body.startswith("*164*S*"):
-            match = re.search(r"A transaction of (\d+) RWF by (.*?) on your MOMO account was successfully completed at (\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})", body)
-            txn_id_match = re.search(r"Financial Transaction Id: (\d+)", body)
-
-            if match and txn_id_match:
-                amount = int(match.group(1))
-                initiator = match.group(2)
-                date_time = match.group(3)
-                txn_id = txn_id_match.group(1)
-
-                # Create ThirdPartyTransaction object
-                ThirdPartyTransaction.objects.create(
-                    amount=amount,
-                    initiated_by=initiator,
-                    date_time=date_time,
-                    transaction_id=txn_id,
-                    user=user
-                )
-                processed_successfully = True
-                processed_count += 1
-            else:
-                reason = "Missing data for Third Party Transaction (amount, initiator, date, or transaction ID)"
-
-        # 8. Withdrawals from Agents
-        elif body.startswith("You "): # More generic start
-            match = re.search(r"You (.*?)\(\*+\d{3}\) have via agent: (.*?) \((\d+)\), withdrawn (\d+) RWF.*?at (\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})", body)
-            if match:
-                user_name = match.group(1) # This captures the name dynamically
-                agent_name = match.group(2)
-                agent_number = match.group(3)
-                amount = int(match.group(4))
-                date_time = match.group(5)
-
-                # Create WithdrawalFromAgent object
-                WithdrawalFromAgent.objects.create(
-                    user_name=user_name.strip(),
-                    agent_name=agent_name.strip(),
-                    agent_number=agent_number,
-                    amount=amount,
-                    date_time=date_time,
-                    user=user
-                )
-                processed_successfully = True
-                processed_count += 1
-            else:
-                reason = "Missing data for Withdrawal from Agent (user name, agent name/number, amount, or date)"
-
-        # 9. Bank Transfers - Sending money to self or others from a bank
-        elif body.startswith("You have transferred"):
-            match = re.search(r"You have transferred (\d+) RWF to (.*?) from your .*? at (\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})", body)
-            if match:
-                amount = int(match.group(1))
-                recipient = match.group(2)
-                date_time = match.group(3)
-
-                # Create BankTransfer object
-                BankTransfer.objects.create(
-                    amount=amount,
-                    recipient=recipient.strip(),
-                    date_time=date_time,
-                    user=user
-                )
-                processed_successfully = True
-                processed_count += 1
-            else:
-                reason = "Missing data for Bank Transfer (amount, recipient, or date)"
-
-        # 10. Internet or Voice Bundle Purchases
-        elif body.startswith("Yello!Umaze kugura"):
-            if "FRW" in body or "Rwf" in body:  # Internet bundle
-                match = re.search(r"Yello!Umaze kugura ([\d,]+)(?:Rwf|FRW)\((\d+)(GB|MB)\)", body)
-                if match:
-                    amount = int(match.group(1).replace(",", ""))  # Remove commas and convert to integer
-                    bundle_size = match.group(2)
-                    unit = match.group(3)
-
-                    # Create InternetBundlePurchase object
-                    InternetBundlePurchase.objects.create(
-                        amount=amount,
-                        bundle_size=bundle_size,
-                        unit=unit,
-                        user=user
-                    )
-            elif "Frw=" in body:  # Voice bundle
-                match = re.search(r"Yello!Umaze kugura ([\d,]+)Frw=(\d+)Mins\+(\d+)SMS", body)
-                if match:
-                    amount = int(match.group(1).replace(",", ""))
-                    minutes = match.group(2)
-                    sms = match.group(3)
-
-                    # Create VoiceBundlePurchase object
-                    VoiceBundlePurchase.objects.create(
-                        amount=amount,
-                        minutes=minutes,
-                        smses=sms,
-                        user=user
-                    )
-
-    print(f"Processed {len(data)} SMS messages.")
-    print(f"Failed to process {len(failed_sms)} SMS messages.")
-    return data
-
-# Main function to process XML file
-def process_xml_file(xml_file, user=None):
-    # If xml_file is a FileField from a model, open it
-    if hasattr(xml_file, 'path'):
-        with open(xml_file.path, 'rb') as f:
-            sms_elements = parse_xml(f)
+        yield date, body, classify(body)
+
+# Messages between two calls of a ``progress`` callback
+PROGRESS_INTERVAL = 1000
+
+# Queue the row for one classified message and update ``stats``
+def store_parsed_message(sms_date, body, result, user, writer, stats, report=None):
+    if report is not None:
+        report.count_message(result)
+    timestamp = sms_parser.sms_timestamp(sms_date)
+    if timestamp is not None and timestamp > stats['last_sms_date']:
+        stats['last_sms_date'] = timestamp
+    if result.fields is not None:
+        instance = TRANSACTION_MODELS[result.kind](user=user, **result.fields)
+        instance.fingerprint = dedup.fingerprint(result.kind, result.fields, sms_date)
+        writer.add(instance)
+        stats['transactions'] += 1
     else:
-        # For backward compatibility, handle direct file objects
-        sms_elements = parse_xml(xml_file)
-
-    extract_transaction_data(sms_elements, user)
-    print(f"XML file processed successfully with {len(sms_elements)} SMS messages.")
+        if result.kind not in (sms_parser.SYSTEM, sms_parser.IGNORED):
+            stats['failed'] += 1
+        if result.kind in LOGGED_FAILURE_KINDS:
+            writer.add(FailedSMSLog(sms_body=body, reason=result.reason, user=user))
+
+# Queue the rows for a stream of (sms date, body, ParseResult) on ``writer``,
+# counting messages, extracted transactions, failed extractions and messages
+# skipped as older than the watermark in ``stats``. ``stats['last_sms_date']``
+# tracks the latest SMS date processed; a ``report`` counts the messages and
+# failures of each category.
+def store_parsed_messages(parsed_messages, user, writer, stats=None, progress=None, report=None):
+    stats = Counter() if stats is None else stats
+    for sms_date, body, result in parsed_messages:
+        stats['messages'] += 1
+        if result is None:
+            stats['skipped'] += 1
+        else:
+            store_parsed_message(sms_date, body, result, user, writer, stats, report)
+        if progress is not None and stats['messages'] % PROGRESS_INTERVAL == 0:
+            progress(stats)
+    return stats
+
+# Extract and categorize SMS messages. Rows are queued on ``writer`` and
+# written in batches; without one, a writer is created and flushed here.
+# Returns the stats of store_parsed_messages.
+def extract_transaction_data(sms_elements, user=None, writer=None):
+    if writer is None:
+        with upload_writer() as writer:
+            stats = extract_transaction_data(sms_elements, user, writer)
+        transaction_counts.add(written_counts(writer))
+        return stats
+
+    stats = store_parsed_messages(parse_sms_elements(sms_elements), user, writer)
+    logger.info(
+        "Processed %d SMS messages: %d transactions, %d failed extractions.",
+        stats['messages'], stats['transactions'], stats['failed'],
+    )
+    return stats
+
+# Main function to process XML file. The whole upload is written in one
+# transaction, with rows flushed through bulk_create every ``batch_size``
+# rows per model (defaults to settings.INGESTION_BATCH_SIZE).
+#
+# With ``workers`` > 1 (defaults to settings.INGESTION_WORKERS), XML parsing
+# and classification run in a process pool on chunks of the file while this
+# process merges the results in order and does the database writes; the rows
+# written are identical to single-process mode.
+#
+# Re-uploaded transactions are recognised by their fingerprint and skipped,
+# so overlapping backups only add the messages that are new. Counterparties
+# are resolved before each batch is flushed, ledger entries and rollups
+# updated after it; running balances once everything is written, and the
+# user's anomaly detectors once the upload has committed.
+#
+# With ``incremental``, messages dated before the user's watermark (the
+# latest SMS date ingested from their previous uploads) are skipped before
+# their body is classified, so a new full backup costs about as much as the
+# messages received since the last one. Messages at the watermark itself are
+# still processed and deduplicated. When ``xml_file`` is an XMLFile's file,
+# the latest SMS date processed is recorded on it to advance the watermark.
+#
+# ``progress`` is called every PROGRESS_INTERVAL messages with the running
+# stats and the number of bytes of the file read so far. A ``report``
+# (ingestion_report.RunReport) is filled in with the run's timings and
+# counts. Returns the stats.
+def process_xml_file(xml_file, user=None, batch_size=None, workers=None, progress=None, incremental=False, report=None):
+    if workers is None:
+        workers = getattr(settings, 'INGESTION_WORKERS', 1)
+    if report is None:
+        report = RunReport()
+    report.workers = workers
+    record = getattr(xml_file, 'instance', None)
+
+    # If xml_file is a FileField from a model, open it; otherwise handle
+    # direct file objects for backward compatibility
+    opened = open(xml_file.path, 'rb') if hasattr(xml_file, 'path') else nullcontext(xml_file)
+
+    # Counted as the messages are stored, so a run that fails still reports
+    # how far it got
+    stats = Counter()
+    writer = None
+    with report.run():
+        try:
+            with opened as f, transaction.atomic(), upload_writer(batch_size) as writer:
+                if user is not None:
+                    lock_user(user)
+                # Read after the lock, so it includes an upload that was running
+                since = XMLFile.watermark_for(user) if incremental and user is not None else None
+                if workers > 1:
+                    chunk_bytes = getattr(settings, 'INGESTION_CHUNK_BYTES', parallel_ingest.DEFAULT_CHUNK_BYTES)
+                    parsed = report.timed_parse(parallel_ingest.parse_xml_parallel(
+                        f, workers, chunk_bytes, keep_body_kinds=LOGGED_FAILURE_KINDS, since=since
+                    ))
+                else:
+                    parsed = parse_sms_elements(iter_sms(f), since=since, report=report)
+                report_progress = None if progress is None else lambda stats: progress(stats, f.tell())
+                store_parsed_messages(parsed, user, writer, stats, progress=report_progress, report=report)
+                if user is not None:
+                    # Cached dashboard/analysis results of the user are stale once
+                    # this upload commits
+                    transaction.on_commit(lambda: result_cache.bump_version(user.pk))
+                if isinstance(record, XMLFile) and stats['last_sms_date']:
+                    record.last_sms_date = max(stats['last_sms_date'], record.last_sms_date or 0)
+                    record.save(update_fields=['last_sms_date'])
+                writer.flush()
+                transaction_counts.add(written_counts(writer))
+                ledger_changed = user is not None and any(
+                    writer.counts[source.model] for source in ledger.LEDGER_SOURCES.values()
+                )
+                with report.post_processing():
+                    if ledger_changed:
+                        # Running balances of the new entries (and of any entries
+                        # after them)
+                        ledger.update_balances(user, batch_size)
+                    if any(writer.counts[model] for model in counterparties.SOURCES):
+                        counterparties.update_statistics()
+            report.committed = True
+            with report.post_processing():
+                if ledger_changed:
+                    # The user's stored anomalies over the new ledger, once the
+                    # upload has committed so its locks aren't held meanwhile
+                    detect_anomalies(user, batch_size)
+        finally:
+            report.finish(stats, writer)
+    # Transactions already stored for the user are skipped by the writer
+    stats['duplicates'] = sum(writer.duplicates.values())
+
+    summary = report.as_dict()
+    logger.info(
+        "XML file processed with %d SMS messages in %.2fs (%s messages/s).",
+        stats['messages'], summary['seconds']['total'], summary['messages_per_second'],
+    )
+    return stats
@@ -0,0 +1,116 @@
+"""
+Keyset pagination over the outgoing transfers shown in the receiver history.
+
+Payments to code holders, transfers to mobile and bank transfers are listed
+newest first in (date_time, source, id) order. A page is read with one query
+per source, each fetching at most a page of rows after the cursor through the
+(user, date_time) index, and the three sorted streams are merged with a
+k-way merge. The cost of a page doesn't depend on how far the user has
+scrolled or on the length of their history.
+
+Cursors are opaque strings encoding the (date_time, source, id) key of the
+last row of the previous page.
+"""
+
+import base64
+import heapq
+from datetime import datetime
+from itertools import islice
+from typing import Callable, NamedTuple
+
+from django.db.models import Q
+
+from ..models import BankTransfer, PaymentToCodeHolder, TransferToMobile
+
+
+class HistorySource(NamedTuple):
+    type: str
+    model: type
+    fields: tuple
+    # Builds the "Transaction ID" and "Details" columns from a row
+    transaction_id: Callable
+    details: Callable
+
+
+# Rows at the same date_time are ordered by their source's position here,
+# then by id, both descending like the date_time
+SOURCES = [
+    HistorySource(
+        'Payment to Code Holder', PaymentToCodeHolder, ('recipient', 'amount', 'transaction_id'),
+        lambda row: row['transaction_id'], lambda row: f"Code Holder: {row['recipient']}",
+    ),
+    HistorySource(
+        'Transfer to Mobile', TransferToMobile, ('recipient', 'amount', 'recipient_number'),
+        lambda row: 'N/A', lambda row: f"Mobile: {row['recipient_number']}",
+    ),
+    HistorySource(
+        'Bank Transfer', BankTransfer, ('recipient', 'amount'),
+        lambda row: 'N/A', lambda row: f"Bank: {row['recipient']}",
+    ),
+]
+
+
+def encode_cursor(key):
+    date_time, source, pk = key
+    raw = f"{date_time.isoformat()}|{source}|{pk}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return the (date_time, source, id) key of a cursor; ValueError if it is invalid."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        date_time, source, pk = raw.split('|')
+        key = (datetime.fromisoformat(date_time), int(source), int(pk))
+    except (ValueError, UnicodeDecodeError) as exc:
+        raise ValueError(f"Invalid cursor: {cursor!r}") from exc
+    if key[0].tzinfo is None or not 0 <= key[1] < len(SOURCES):
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+    return key
+
+
+def after(source, key):
+    # Rows of ``source`` that come after ``key`` in descending
+    # (date_time, source, id) order
+    date_time, key_source, pk = key
+    if source < key_source:
+        return Q(date_time__lte=date_time)
+    if source > key_source:
+        return Q(date_time__lt=date_time)
+    return Q(date_time__lt=date_time) | Q(date_time=date_time, id__lt=pk)
+
+
+def source_rows(user, source, condition, key, limit):
+    history_source = SOURCES[source]
+    rows = history_source.model.objects.filter(condition, user=user)
+    if key is not None:
+        rows = rows.filter(after(source, key))
+    rows = rows.order_by('-date_time', '-id').values('id', 'date_time', *history_source.fields)[:limit]
+    for row in rows:
+        yield (row['date_time'], source, row['id']), row
+
+
+def fetch_page(user, filters, cursor=None, page_size=50):
+    """
+    Return one page of the user's history as (transactions, next cursor);
+    the cursor is None on the last page. ``filters`` holds a Q per source,
+    in SOURCES order.
+    """
+    key = decode_cursor(cursor) if cursor else None
+    streams = [source_rows(user, source, condition, key, page_size + 1) for source, condition in enumerate(filters)]
+    merged = list(islice(heapq.merge(*streams, key=lambda item: item[0], reverse=True), page_size + 1))
+    page = merged[:page_size]
+    next_cursor = encode_cursor(page[-1][0]) if len(merged) > page_size else None
+
+    transactions = []
+    for (date_time, source, _), row in page:
+        history_source = SOURCES[source]
+        transactions.append({
+            'type': history_source.type,
+            'recipient': row['recipient'],
+            'amount': row['amount'],
+            'date_time': date_time,
+            'transaction_id': history_source.transaction_id(row),
+            'details': history_source.details(row),
+        })
+    return transactions, next_cursor
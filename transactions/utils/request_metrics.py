@@ -0,0 +1,133 @@
+"""
+Per-view request metrics, rendered in the Prometheus text format.
+
+``RequestMetricsMiddleware`` (transactions/middleware.py) records, for every
+request, the time spent in the view, the number of SQL queries and their
+total time, the Python time (the rest), the response size and, when
+``REQUEST_METRICS_TRACE_ALLOCATIONS`` is on, the peak of traced memory
+allocations. Each is added to a histogram per resolved view name, kept in
+the process; ``render`` formats them for the ``/metrics`` endpoint.
+
+The hits and misses of the dashboard and analysis result cache
+(``result_cache.stats``) are exported as a counter per cached method.
+
+Histograms are cumulative since the process started, as Prometheus expects;
+its ``rate()`` and ``histogram_quantile()`` give the rolling windows. Each
+worker process serves its own counts, so scrape every process (or run one).
+"""
+
+import threading
+from collections import defaultdict
+from typing import NamedTuple
+
+from . import result_cache
+
+PREFIX = 'mmony'
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+BYTES_BUCKETS = tuple(1024 * 4 ** power for power in range(9))
+
+
+class Metric(NamedTuple):
+    name: str
+    help: str
+    buckets: tuple
+
+
+# Metrics recorded per request, by the key the middleware observes them under
+METRICS = {
+    'duration': Metric('request_duration_seconds', "Time spent handling the request", SECONDS_BUCKETS),
+    'sql_time': Metric('request_sql_seconds', "Time spent in SQL queries", SECONDS_BUCKETS),
+    'python_time': Metric('request_python_seconds', "Time spent outside SQL queries", SECONDS_BUCKETS),
+    'queries': Metric('request_queries', "SQL queries run", QUERY_BUCKETS),
+    'response_size': Metric('response_size_bytes', "Size of the response body", BYTES_BUCKETS),
+    'peak_allocations': Metric('request_peak_allocations_bytes', "Peak of traced memory allocations", BYTES_BUCKETS),
+}
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # Observations per bucket, not cumulative; the last one is +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                break
+        else:
+            index = len(self.buckets)
+        self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+
+_lock = threading.Lock()
+# {metric key: {view name: Histogram}}
+_histograms = defaultdict(dict)
+
+
+def observe(view, values):
+    """Record one request of ``view``: ``values`` maps METRICS keys to values."""
+    with _lock:
+        for key, value in values.items():
+            histograms = _histograms[key]
+            if view not in histograms:
+                histograms[view] = Histogram(METRICS[key].buckets)
+            histograms[view].observe(value)
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+
+
+def label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_result_cache():
+    # result_cache.stats counts '<method>:hits' and '<method>:misses' next to
+    # the overall totals, which are left to sum()
+    counts = sorted(
+        (*key.rsplit(':', 1), count) for key, count in list(result_cache.stats.items()) if ':' in key
+    )
+    if not counts:
+        return []
+    name = f'{PREFIX}_result_cache_lookups_total'
+    lines = [f'# HELP {name} Cached dashboard and analysis results looked up', f'# TYPE {name} counter']
+    for method, outcome, count in counts:
+        result = 'hit' if outcome == 'hits' else 'miss'
+        lines.append(f'{name}{{method="{label(method)}",result="{result}"}} {count}')
+    return lines
+
+
+def render():
+    """The histograms in the Prometheus text exposition format."""
+    lines = []
+    with _lock:
+        for key, metric in METRICS.items():
+            histograms = _histograms.get(key)
+            if not histograms:
+                continue
+            name = f'{PREFIX}_{metric.name}'
+            lines.append(f'# HELP {name} {metric.help}')
+            lines.append(f'# TYPE {name} histogram')
+            for view in sorted(histograms):
+                histogram = histograms[view]
+                view_label = f'view="{label(view)}"'
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + ('+Inf',), histogram.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{{view_label},le="{number(bound)}"}} {cumulative}')
+                lines.append(f'{name}_sum{{{view_label}}} {number(histogram.sum)}')
+                lines.append(f'{name}_count{{{view_label}}} {histogram.count}')
+    lines.extend(render_result_cache())
+    return '\n'.join(lines) + '\n'
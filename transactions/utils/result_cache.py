@@ -0,0 +1,82 @@
+"""
+Per-user cache of dashboard and analysis results.
+
+Each user has a version number in the cache, and results are stored under
+keys that include it, so bumping the version (when an upload for the user
+commits) invalidates all of their cached results at once without having to
+find and delete them. Works with any cache backend, including local-memory
+and file-based ones.
+
+Hits and misses are counted per process in ``stats``.
+"""
+
+import time
+from collections import Counter
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+
+DEFAULT_TIMEOUT = 24 * 60 * 60
+
+stats = Counter()
+
+_MISSING = object()
+
+
+def version_key(user_id):
+    return f'results:{user_id}:version'
+
+
+def get_version(user_id):
+    version = cache.get(version_key(user_id))
+    if version is None:
+        # Start from the clock rather than 1, so a version key that was
+        # evicted never comes back with a number already used
+        cache.add(version_key(user_id), time.time_ns(), None)
+        version = cache.get(version_key(user_id))
+    return version
+
+
+def bump_version(user_id):
+    try:
+        cache.incr(version_key(user_id))
+    except ValueError:
+        cache.set(version_key(user_id), time.time_ns(), None)
+
+
+def invalidate(user=None):
+    # Drop the cached results of one user, or of everyone
+    user_ids = [user.pk] if user is not None else get_user_model().objects.values_list('pk', flat=True)
+    for user_id in user_ids:
+        bump_version(user_id)
+
+
+def cached_result(method):
+    """
+    Cache the result of a view's ``get_*`` method per user and version, and
+    per the values of its positional arguments, if it takes any.
+    """
+    name = method.__qualname__
+
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        user_id = self.request.user.pk
+        if not hasattr(self, '_result_cache_version'):
+            self._result_cache_version = get_version(user_id)
+        key = f'results:{user_id}:{self._result_cache_version}:{name}'
+        if args:
+            key += ':' + ':'.join(str(arg) for arg in args)
+        result = cache.get(key, _MISSING)
+        if result is not _MISSING:
+            stats['hits'] += 1
+            stats[f'{name}:hits'] += 1
+            return result
+        stats['misses'] += 1
+        stats[f'{name}:misses'] += 1
+        result = method(self, *args, **kwargs)
+        cache.set(key, result, getattr(settings, 'RESULT_CACHE_TIMEOUT', DEFAULT_TIMEOUT))
+        return result
+
+    return wrapper
@@ -0,0 +1,102 @@
+"""
+Daily and monthly rollups of the ledger.
+
+``DailyRollup`` and ``MonthlyRollup`` hold, per user, period and kind, the
+number of ledger entries and the sums of their signed amounts and fees.
+Ingestion adds each batch of new ledger entries to them, and ``rebuild``
+(``manage.py rebuild_rollups``) recomputes them from the ledger.
+``kind_totals`` sums a user's monthly rollups into all-time totals per kind.
+"""
+
+from collections import defaultdict
+from datetime import datetime, time
+
+from django.db.models import Sum
+from django.utils import timezone
+
+from ..models import DailyRollup, LedgerEntry, MonthlyRollup
+from .bulk_writer import add_to_totals, get_batch_size
+
+ROLLUP_FIELDS = ['count', 'amount', 'fee']
+
+
+def day_of(date_time):
+    return timezone.localtime(date_time).date() if timezone.is_aware(date_time) else date_time.date()
+
+
+def month_of(date_time):
+    return day_of(date_time).replace(day=1)
+
+
+# Rollup model and the function mapping a date_time to its period
+ROLLUPS = [
+    (DailyRollup, day_of),
+    (MonthlyRollup, month_of),
+]
+
+
+def period_start(period):
+    # The period as an aware datetime at midnight, as TruncDay/TruncMonth
+    # would return it
+    return timezone.make_aware(datetime.combine(period, time.min))
+
+
+def aggregate(entries):
+    # {rollup model: {(user_id, period, kind): [count, amount, fee]}} for
+    # ledger entries, given as objects or as
+    # (user_id, kind, amount, fee, date_time) tuples, in a single pass
+    totals = {model: defaultdict(lambda: [0, 0, 0]) for model, _ in ROLLUPS}
+    for entry in entries:
+        if isinstance(entry, LedgerEntry):
+            entry = (entry.user_id, entry.kind, entry.amount, entry.fee, entry.date_time)
+        user_id, kind, amount, fee, date_time = entry
+        for model, period_of in ROLLUPS:
+            total = totals[model][(user_id, period_of(date_time), kind)]
+            total[0] += 1
+            total[1] += amount
+            total[2] += fee
+    return totals
+
+
+def rollup_rows(model, totals):
+    return [
+        model(user_id=user_id, period=period, kind=kind, count=count, amount=amount, fee=fee)
+        for (user_id, period, kind), (count, amount, fee) in totals.items()
+    ]
+
+
+def add_entries(entries):
+    """
+    Add new ledger entries to the rollups, with one upsert per table that
+    adds their totals to the stored ones.
+    """
+    if not entries:
+        return
+    for model, totals in aggregate(entries).items():
+        add_to_totals(model, rollup_rows(model, totals), ['user', 'period', 'kind'], ROLLUP_FIELDS)
+
+
+def rebuild(user=None, batch_size=None):
+    """
+    Recompute the rollups from the ledger, for all users or one. Returns the
+    number of ledger entries read.
+    """
+    batch_size = get_batch_size(batch_size)
+    entries = LedgerEntry.objects.all() if user is None else LedgerEntry.objects.filter(user=user)
+    count = entries.count()
+    rows = entries.values_list('user_id', 'kind', 'amount', 'fee', 'date_time').iterator(chunk_size=batch_size)
+    for model, totals in aggregate(rows).items():
+        (model.objects.all() if user is None else model.objects.filter(user=user)).delete()
+        model.objects.bulk_create(rollup_rows(model, totals), batch_size=batch_size)
+    return count
+
+
+def kind_totals(user):
+    """
+    The user's all-time totals per kind, ``{kind: (count, amount, fee)}``,
+    summed from the monthly rollups in one query. Amounts are signed.
+    """
+    rows = MonthlyRollup.objects.filter(user=user).values('kind').annotate(
+        total_count=Sum('count'), total_amount=Sum('amount'), total_fee=Sum('fee'),
+    ).order_by()
+    return {row['kind']: (row['total_count'], row['total_amount'], row['total_fee']) for row in rows}
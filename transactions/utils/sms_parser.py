@@ -0,0 +1,247 @@
+"""
+Single-pass classifier/extractor for mobile money SMS bodies.
+
+Each body is dispatched on its first character to a short, ordered table of
+prefixes, and the matching category is extracted with one precompiled regex
+that captures every field at once, so the body is scanned a single time.
+
+This module has no Django dependencies so it can be shared by the web app,
+worker processes and the standalone scripts.
+"""
+
+import re
+from typing import NamedTuple, Optional
+
+# Transaction kinds, one per transaction model
+INCOMING = 'incoming'
+PAYMENT_TO_CODE = 'payment_to_code'
+MOBILE_TRANSFER = 'mobile_transfer'
+BANK_DEPOSIT = 'bank_deposit'
+AIRTIME_BILL = 'airtime_bill'
+CASH_POWER_BILL = 'cash_power_bill'
+THIRD_PARTY = 'third_party'
+WITHDRAWAL = 'withdrawal'
+BANK_TRANSFER = 'bank_transfer'
+INTERNET_BUNDLE = 'internet_bundle'
+VOICE_BUNDLE = 'voice_bundle'
+
+# Categories that don't map to a single model
+BILL_PAYMENT = 'bill_payment'  # "*162*" messages before the bill type is known
+BUNDLE = 'bundle'              # "Yello!Umaze kugura" messages of unknown bundle type
+SYSTEM = 'system'              # "*143*R*" registration/failure notifications
+IGNORED = 'ignored'            # anything without a known prefix
+
+
+class ParseResult(NamedTuple):
+    # Category the body was classified as
+    kind: str
+    # Extracted model field values, or None when nothing was extracted
+    fields: Optional[dict] = None
+    # Why extraction failed, when it did
+    reason: Optional[str] = None
+
+
+_DATE = r"(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})"
+# Gap between two fields of the same message; unlike the captures themselves
+# it may span line breaks, as separate searches over the body could
+_GAP = r"(?s:.*?)"
+
+_INCOMING = re.compile(
+    r"received (\d+) RWF from (.+?) \(" + _GAP + r"at " + _DATE + _GAP + r"Financial Transaction Id: (\d+)"
+)
+_PAYMENT_TO_CODE = re.compile(
+    r"TxId: (\d+)" + _GAP + r"payment\s+of\s+([\d,]+)\s+RWF" + _GAP + r"to (.+?) (\d+)" + _GAP + r"at " + _DATE
+)
+_MOBILE_TRANSFER = re.compile(
+    r"(\d+) RWF transferred to (.+?) \((250\d+)\)" + _GAP + r"at " + _DATE + _GAP + r"Fee was: (\d+) RWF"
+)
+_BANK_DEPOSIT = re.compile(r"deposit of (\d+) RWF" + _GAP + r"at " + _DATE)
+_BILL_PAYMENT = re.compile(
+    r"TxId:(\d+)\*S\*Your payment of (\d+) RWF to (Airtime|MTN Cash Power) with token.*?at " + _DATE
+    + _GAP + r"Fee was (\d+) RWF"
+)
+_THIRD_PARTY = re.compile(
+    r"A transaction of (\d+) RWF by (.*?) on your MOMO account was successfully completed at " + _DATE
+    + _GAP + r"Financial Transaction Id: (\d+)"
+)
+_WITHDRAWAL = re.compile(
+    r"You (.*?)\(\*+\d{3}\) have via agent: (.*?) \((\d+)\), withdrawn (\d+) RWF.*?at " + _DATE
+)
+_BANK_TRANSFER = re.compile(r"You have transferred (\d+) RWF to (.*?) from your .*? at " + _DATE)
+_INTERNET_BUNDLE = re.compile(r"Yello!Umaze kugura ([\d,]+)(?:Rwf|FRW)\((\d+)(GB|MB)\)")
+_VOICE_BUNDLE = re.compile(r"Yello!Umaze kugura ([\d,]+)Frw=(\d+)Mins\+(\d+)SMS")
+
+_BILL_KINDS = {'Airtime': AIRTIME_BILL, 'MTN Cash Power': CASH_POWER_BILL}
+
+
+def _system(body):
+    return ParseResult(SYSTEM)
+
+
+def _incoming(body):
+    match = _INCOMING.search(body)
+    if not match:
+        return ParseResult(INCOMING, reason="Missing data for Incoming Money (amount, sender, date, or transaction ID)")
+    amount, sender, date_time, txn_id = match.groups()
+    return ParseResult(INCOMING, {
+        'amount': int(amount),
+        'sender': sender,
+        'date_time': date_time,
+        'transaction_id': txn_id,
+    })
+
+
+def _payment_to_code(body):
+    match = _PAYMENT_TO_CODE.search(body)
+    if match:
+        txn_id, amount, recipient, _code, date_time = match.groups()
+        amount = int(amount.replace(",", ""))
+        recipient = recipient.strip()
+        if amount and recipient:
+            return ParseResult(PAYMENT_TO_CODE, {
+                'transaction_id': txn_id,
+                'amount': amount,
+                'recipient': recipient,
+                'date_time': date_time,
+            })
+    return ParseResult(PAYMENT_TO_CODE, reason="Missing data for Payment to Code Holder (TxId, amount, recipient, or date)")
+
+
+def _mobile_transfer(body):
+    match = _MOBILE_TRANSFER.search(body)
+    if not match:
+        return ParseResult(MOBILE_TRANSFER, reason="Missing data for Transfer to Mobile (amount, recipient, number, date, or fee)")
+    amount, recipient, recipient_number, date_time, fee = match.groups()
+    return ParseResult(MOBILE_TRANSFER, {
+        'amount': int(amount),
+        'recipient': recipient,
+        'recipient_number': recipient_number,
+        'date_time': date_time,
+        'fee': int(fee),
+    })
+
+
+def _bank_deposit(body):
+    match = _BANK_DEPOSIT.search(body)
+    if not match:
+        return ParseResult(BANK_DEPOSIT, reason="Missing data for Bank Deposit (amount or date)")
+    amount, date_time = match.groups()
+    return ParseResult(BANK_DEPOSIT, {'amount': int(amount), 'date_time': date_time})
+
+
+def _bill_payment(body):
+    match = _BILL_PAYMENT.search(body)
+    if not match:
+        return ParseResult(BILL_PAYMENT, reason="Missing data for Bill Purchase (TxId, amount, bill type, date, or fee)")
+    txn_id, amount, bill_type, date_time, fee = match.groups()
+    return ParseResult(_BILL_KINDS[bill_type], {
+        'transaction_id': txn_id,
+        'amount': int(amount),
+        'date_time': date_time,
+        'fee': int(fee),
+    })
+
+
+def _third_party(body):
+    match = _THIRD_PARTY.search(body)
+    if not match:
+        return ParseResult(THIRD_PARTY, reason="Missing data for Third Party Transaction (amount, initiator, date, or transaction ID)")
+    amount, initiator, date_time, txn_id = match.groups()
+    return ParseResult(THIRD_PARTY, {
+        'amount': int(amount),
+        'initiated_by': initiator,
+        'date_time': date_time,
+        'transaction_id': txn_id,
+    })
+
+
+def _withdrawal(body):
+    match = _WITHDRAWAL.search(body)
+    if not match:
+        return ParseResult(WITHDRAWAL, reason="Missing data for Withdrawal from Agent (user name, agent name/number, amount, or date)")
+    user_name, agent_name, agent_number, amount, date_time = match.groups()
+    return ParseResult(WITHDRAWAL, {
+        'user_name': user_name.strip(),
+        'agent_name': agent_name.strip(),
+        'agent_number': agent_number,
+        'amount': int(amount),
+        'date_time': date_time,
+    })
+
+
+def _bank_transfer(body):
+    match = _BANK_TRANSFER.search(body)
+    if not match:
+        return ParseResult(BANK_TRANSFER, reason="Missing data for Bank Transfer (amount, recipient, or date)")
+    amount, recipient, date_time = match.groups()
+    return ParseResult(BANK_TRANSFER, {
+        'amount': int(amount),
+        'recipient': recipient.strip(),
+        'date_time': date_time,
+    })
+
+
+def _bundle(body):
+    if "FRW" in body or "Rwf" in body:  # Internet bundle
+        match = _INTERNET_BUNDLE.search(body)
+        if not match:
+            return ParseResult(INTERNET_BUNDLE, reason="Missing data for Internet Bundle Purchase (amount or bundle size)")
+        amount, bundle_size, unit = match.groups()
+        return ParseResult(INTERNET_BUNDLE, {
+            'amount': int(amount.replace(",", "")),
+            'bundle_size': bundle_size,
+            'unit': unit,
+        })
+    if "Frw=" in body:  # Voice bundle
+        match = _VOICE_BUNDLE.search(body)
+        if not match:
+            return ParseResult(VOICE_BUNDLE, reason="Missing data for Voice Bundle Purchase (amount, minutes, or SMS)")
+        amount, minutes, smses = match.groups()
+        return ParseResult(VOICE_BUNDLE, {
+            'amount': int(amount.replace(",", "")),
+            'minutes': minutes,
+            'smses': smses,
+        })
+    return ParseResult(BUNDLE, reason="Unknown bundle type")
+
+
+# Prefix table, bucketed by first character. Order within a bucket matters:
+# the first matching prefix wins, so "You have transferred" comes before the
+# "You " of withdrawals, which would otherwise take (and reject) bank
+# transfer messages.
+PREFIX_TABLE = (
+    ("*143*R*", _system),
+    ("You have received", _incoming),
+    ("TxId", _payment_to_code),
+    ("*165*S*", _mobile_transfer),
+    ("*113*R*", _bank_deposit),
+    ("*162*", _bill_payment),
+    ("*164*S*", _third_party),
+    ("You have transferred", _bank_transfer),
+    ("You ", _withdrawal),
+    ("Yello!Umaze kugura", _bundle),
+)
+
+_DISPATCH = {}
+for _prefix, _handler in PREFIX_TABLE:
+    _DISPATCH.setdefault(_prefix[0], []).append((_prefix, _handler))
+_DISPATCH = {first: tuple(entries) for first, entries in _DISPATCH.items()}
+
+_IGNORED = ParseResult(IGNORED)
+
+
+def parse_sms(body):
+    """Classify an SMS body and extract its fields in a single pass."""
+    if body:
+        for prefix, handler in _DISPATCH.get(body[0], ()):
+            if body.startswith(prefix):
+                return handler(body)
+    return _IGNORED
+
+
+def sms_timestamp(date):
+    """Return an SMS ``date`` attribute as integer milliseconds, or None."""
+    try:
+        return int(date)
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,57 @@
+"""
+Site-wide transaction counts for the landing page.
+
+``TransactionCount`` holds one row per transaction kind with the number of
+rows stored for all users. Uploads add the rows they wrote in the same
+transaction, and ``counts`` reads the rows through the cache, so the landing
+page costs at most one small query whatever the size of the tables.
+``rebuild`` (``manage.py rebuild_transaction_counts``) recounts the tables,
+e.g. after rows were deleted outside the pipeline.
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+
+from ..models import TransactionCount
+
+CACHE_KEY = 'transaction-counts'
+DEFAULT_TIMEOUT = 5 * 60
+
+
+def add(counts):
+    """Add ``{kind: rows written}`` to the counts once the transaction commits."""
+    for kind, count in counts.items():
+        if not count:
+            continue
+        if not TransactionCount.objects.filter(kind=kind).update(count=F('count') + count):
+            TransactionCount.objects.bulk_create([TransactionCount(kind=kind)], ignore_conflicts=True)
+            TransactionCount.objects.filter(kind=kind).update(count=F('count') + count)
+    transaction.on_commit(invalidate)
+
+
+def invalidate():
+    cache.delete(CACHE_KEY)
+
+
+def counts():
+    """Return ``{kind: count}``, from the cache when possible."""
+    result = cache.get(CACHE_KEY)
+    if result is None:
+        result = dict(TransactionCount.objects.values_list('kind', 'count'))
+        cache.set(CACHE_KEY, result, getattr(settings, 'TRANSACTION_COUNTS_CACHE_TIMEOUT', DEFAULT_TIMEOUT))
+    return result
+
+
+def rebuild(models):
+    """
+    Recount the rows of ``models`` (a ``{kind: model}`` dict) and store the
+    counts. Returns them.
+    """
+    result = {kind: model.objects.count() for kind, model in models.items()}
+    with transaction.atomic():
+        TransactionCount.objects.all().delete()
+        TransactionCount.objects.bulk_create([TransactionCount(kind=kind, count=count) for kind, count in result.items()])
+        transaction.on_commit(invalidate)
+    return result
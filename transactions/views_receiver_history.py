@@ -1,12 +1,27 @@
+import logging
+
+from django.conf import settings
+from django.http import JsonResponse
 from django.shortcuts import render, redirect
-from django.views.generic import TemplateView
+from django.utils import timezone
+from django.views.generic import TemplateView, View
 from django.db.models import Q
-from datetime import datetime, timedelta
+from datetime import datetime, time, timedelta
 from django.utils.dateparse import parse_date
-from .models import PaymentToCodeHolder, TransferToMobile, BankTransfer
+from .utils import counterparties
+from .utils.receiver_history import fetch_page
 
-class ReceiverHistoryView(TemplateView):
-    template_name = 'transactions/receiver_history.html'
+logger = logging.getLogger(__name__)
+
+
+def start_of_day(day):
+    # Aware midnight of ``day``, so date filters compare date_time directly
+    # and can use the (user, date_time) index
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+class ReceiverHistoryMixin:
+    # Filters shared by the history page and its JSON pages
 
     def dispatch(self, request, *args, **kwargs):
         # Redirect to login if user is not authenticated
@@ -14,9 +29,14 @@ class ReceiverHistoryView(TemplateView):
             return redirect('login')
         return super().dispatch(request, *args, **kwargs)
 
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
+    def get_page_size(self):
+        return getattr(settings, 'RECEIVER_HISTORY_PAGE_SIZE', 50)
 
+    def get_filters(self):
+        """
+        Return ((code holder, mobile, bank) filters, filter parameters, error
+        messages) for the request's query string.
+        """
         # Get filter parameters from request
         start_date = self.request.GET.get('start_date')
         end_date = self.request.GET.get('end_date')
@@ -40,16 +60,15 @@ class ReceiverHistoryView(TemplateView):
             start_date_obj = parse_date(start_date)
 
             if start_date_obj:
-                # Apply the filter to all transaction types using __date lookup to ignore time
-                code_holder_filter &= Q(date_time__date__gte=start_date_obj)
-                mobile_filter &= Q(date_time__date__gte=start_date_obj)
-                bank_filter &= Q(date_time__date__gte=start_date_obj)
+                # Apply the filter to all transaction types from the start of the day
+                code_holder_filter &= Q(date_time__gte=start_of_day(start_date_obj))
+                mobile_filter &= Q(date_time__gte=start_of_day(start_date_obj))
+                bank_filter &= Q(date_time__gte=start_of_day(start_date_obj))
 
-                # Debug print to check the parsed date
-                print(f"Filtering transactions from date: {start_date_obj}")
+                logger.debug("Filtering transactions from date: %s", start_date_obj)
             else:
                 # Invalid date format, log the error and add to error messages
-                print(f"Error parsing start date: {start_date}")
+                logger.debug("Error parsing start date: %s", start_date)
                 error_messages.append(f"Invalid start date format: {start_date}. Please use YYYY-MM-DD format.")
                 # Use default start date
                 start_date = default_start_date
@@ -67,16 +86,15 @@ class ReceiverHistoryView(TemplateView):
                 # This ensures transactions from the entire end date are included
                 end_date_inclusive = end_date_obj + timedelta(days=1)
 
-                # Apply the filter to all transaction types using __date lookup to ignore time
-                code_holder_filter &= Q(date_time__date__lt=end_date_inclusive)
-                mobile_filter &= Q(date_time__date__lt=end_date_inclusive)
-                bank_filter &= Q(date_time__date__lt=end_date_inclusive)
+                # Apply the filter to all transaction types up to the start of the next day
+                code_holder_filter &= Q(date_time__lt=start_of_day(end_date_inclusive))
+                mobile_filter &= Q(date_time__lt=start_of_day(end_date_inclusive))
+                bank_filter &= Q(date_time__lt=start_of_day(end_date_inclusive))
 
-                # Debug print to check the parsed date
-                print(f"Filtering transactions until date: {end_date_obj} (inclusive)")
+                logger.debug("Filtering transactions until date: %s (inclusive)", end_date_obj)
             else:
                 # Invalid date format, log the error and add to error messages
-                print(f"Error parsing end date: {end_date}")
+                logger.debug("Error parsing end date: %s", end_date)
                 error_messages.append(f"Invalid end date format: {end_date}. Please use YYYY-MM-DD format.")
                 # Use default end date
                 end_date = default_end_date
@@ -85,17 +103,17 @@ class ReceiverHistoryView(TemplateView):
         else:
             end_date = default_end_date
 
-        # Debug print to show the actual date range being used for filtering
-        start_date_obj = parse_date(start_date)
-        end_date_obj = parse_date(end_date)
-        if start_date_obj and end_date_obj:
-            print(f"Actual date range for filtering: {start_date_obj} to {end_date_obj} (inclusive)")
+        logger.debug("Actual date range for filtering: %s to %s (inclusive)", start_date, end_date)
 
         # Create filter conditions for code_holder and receiver
         code_holder_condition = Q()
 
+        # Names and numbers are searched in the user's counterparties, through
+        # their trigram index, and the rows looked up by counterparty through
+        # the (user, counterparty) indexes of the transaction tables
+        user = self.request.user
         if code_holder:
-            code_holder_condition = Q(recipient__icontains=code_holder)
+            code_holder_condition = Q(counterparty__in=counterparties.search(user, code_holder, ['name']))
 
         # Initialize receiver conditions
         receiver_condition_basic = Q()
@@ -103,9 +121,9 @@ class ReceiverHistoryView(TemplateView):
 
         if receiver:
             # For PaymentToCodeHolder and BankTransfer, only recipient field is available
-            receiver_condition_basic = Q(recipient__icontains=receiver)
+            receiver_condition_basic = Q(counterparty__in=counterparties.search(user, receiver, ['name']))
             # For TransferToMobile, both recipient and recipient_number fields are available
-            receiver_condition_mobile = receiver_condition_basic | Q(recipient_number__icontains=receiver)
+            receiver_condition_mobile = Q(counterparty__in=counterparties.search(user, receiver, ['name', 'number']))
 
         # Apply filters to each transaction type
         if code_holder and receiver:
@@ -124,73 +142,34 @@ class ReceiverHistoryView(TemplateView):
             mobile_filter &= receiver_condition_mobile
             bank_filter &= receiver_condition_basic
 
-        # Get transactions for the current user with applied filters
-        user = self.request.user
-        code_holder_payments = PaymentToCodeHolder.objects.filter(
-            code_holder_filter, 
-            user=user
-        ).order_by('-date_time')
-
-        mobile_transfers = TransferToMobile.objects.filter(
-            mobile_filter, 
-            user=user
-        ).order_by('-date_time')
-
-        bank_transfers = BankTransfer.objects.filter(
-            bank_filter, 
-            user=user
-        ).order_by('-date_time')
-
-        # Prepare transactions for display
-        transactions = []
-
-        for payment in code_holder_payments:
-            transactions.append({
-                'type': 'Payment to Code Holder',
-                'recipient': payment.recipient,
-                'amount': payment.amount,
-                'date_time': payment.date_time,
-                'transaction_id': payment.transaction_id,
-                'details': f"Code Holder: {payment.recipient}"
-            })
-
-        for transfer in mobile_transfers:
-            transactions.append({
-                'type': 'Transfer to Mobile',
-                'recipient': transfer.recipient,
-                'amount': transfer.amount,
-                'date_time': transfer.date_time,
-                'transaction_id': getattr(transfer, 'transaction_id', 'N/A'),
-                'details': f"Mobile: {transfer.recipient_number}"
-            })
-
-        for transfer in bank_transfers:
-            transactions.append({
-                'type': 'Bank Transfer',
-                'recipient': transfer.recipient,
-                'amount': transfer.amount,
-                'date_time': transfer.date_time,
-                'transaction_id': getattr(transfer, 'transaction_id', 'N/A'),
-                'details': f"Bank: {transfer.recipient}"
-            })
-
-        # Sort transactions by date (newest first)
-        transactions.sort(key=lambda x: x['date_time'], reverse=True)
-
-        # Debug prints to show transaction counts
-        print(f"Found {len(code_holder_payments)} code holder payments")
-        print(f"Found {len(mobile_transfers)} mobile transfers")
-        print(f"Found {len(bank_transfers)} bank transfers")
-        print(f"Total transactions after filtering: {len(transactions)}")
-
-        # Add to context
-        context['transactions'] = transactions
-        context['filter_params'] = {
+        filter_params = {
             'start_date': start_date,
             'end_date': end_date,
             'code_holder': code_holder,
             'receiver': receiver
         }
+        return (code_holder_filter, mobile_filter, bank_filter), filter_params, error_messages
+
+
+class ReceiverHistoryView(ReceiverHistoryMixin, TemplateView):
+    template_name = 'transactions/receiver_history.html'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        filters, filter_params, error_messages = self.get_filters()
+        start_date = filter_params['start_date']
+        end_date = filter_params['end_date']
+        code_holder = filter_params['code_holder']
+        receiver = filter_params['receiver']
+
+        # Only the first page is rendered; the page fetches the next ones
+        # from ReceiverHistoryPageView as the user scrolls
+        transactions, next_cursor = fetch_page(self.request.user, filters, page_size=self.get_page_size())
+
+        # Add to context
+        context['transactions'] = transactions
+        context['next_cursor'] = next_cursor
+        context['filter_params'] = filter_params
 
         # Add filter status message
         filter_messages = []
@@ -209,3 +188,20 @@ class ReceiverHistoryView(TemplateView):
         context['error_messages'] = error_messages
 
         return context
+
+
+class ReceiverHistoryPageView(ReceiverHistoryMixin, View):
+    # One page of the receiver history as JSON, after ?cursor= (the
+    # next_cursor of the previous page), with the same filters as the page
+
+    def get(self, request):
+        filters, _, _ = self.get_filters()
+        try:
+            transactions, next_cursor = fetch_page(
+                request.user, filters, request.GET.get('cursor'), self.get_page_size()
+            )
+        except ValueError as exc:
+            return JsonResponse({'error': str(exc)}, status=400)
+        for transaction in transactions:
+            transaction['date_display'] = timezone.localtime(transaction['date_time']).strftime('%Y-%m-%d %H:%M')
+        return JsonResponse({'transactions': transactions, 'next_cursor': next_cursor})